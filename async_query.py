@@ -0,0 +1,347 @@
+from __future__ import annotations
+from contextlib import asynccontextmanager
+from objects import Player, PlayerItem
+from contextvars import ContextVar
+from query import Items, Players
+from collections import Counter
+import asyncpg
+
+async def create_pool(user: str, password: str, host: str, database: str, min_size: int = 1, max_size: int = 10):
+    '''Opens an asyncpg connection pool for use with AsyncQuerier'''
+    return await asyncpg.create_pool(user=user, password=password, host=host, database=database, min_size=min_size, max_size=max_size)
+
+class AsyncBaseConnection:
+    '''Async counterpart of query.BaseConnection, backed by an asyncpg connection pool.
+    asyncpg prepares and caches every statement per connection, so there is no use_prepared_statements switch'''
+    def __init__(self, pool: asyncpg.Pool) -> None:
+        self.pool = pool
+        # Many tasks share one instance, so the transaction's connection is tracked per task rather than on self
+        self.transaction_connection: ContextVar[asyncpg.Connection | None] = ContextVar('transaction_connection', default=None)
+
+    @asynccontextmanager
+    async def acquire(self):
+        '''Yields a connection to use for a single operation,
+        inside transaction() this is the transaction's connection, otherwise one from the pool'''
+        connection = self.transaction_connection.get()
+        if connection is not None:
+            yield connection
+            return
+        async with self.pool.acquire() as connection:
+            yield connection
+
+    @asynccontextmanager
+    async def transaction(self):
+        '''All queries made by this task inside this context are committed together,
+        or rolled back if an exception is raised'''
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                token = self.transaction_connection.set(connection)
+                try:
+                    yield connection
+                finally:
+                    self.transaction_connection.reset(token)
+
+    async def stream(self, query: str, *args, itersize: int = 2000):
+        '''Yields the rows of `query` from a server-side cursor, fetching `itersize` rows per round trip.
+        Cursors only exist inside a transaction, so this runs in one (a savepoint inside transaction()),
+        ended when the generator finishes or is closed'''
+        async with self.acquire() as connection:
+            async with connection.transaction():
+                async for row in connection.cursor(query, *args, prefetch=itersize):
+                    yield row
+
+class AsyncQuerier(AsyncBaseConnection):
+    '''Async counterpart of query.Querier'''
+    def __init__(self, pool: asyncpg.Pool) -> None:
+        super().__init__(pool)
+        self.items = AsyncItems(pool)
+        self.players = AsyncPlayers(pool)
+
+class AsyncItems(AsyncBaseConnection):
+    '''Async counterpart of query.Items, sharing the same in-process catalogue'''
+    def __init__(self, pool: asyncpg.Pool) -> None:
+        super().__init__(pool)
+
+    async def _fetch_catalogue_query(self):
+        '''Selects every item in the Items table along with its consumable data (if any)'''
+        async with self.acquire() as connection:
+            return await connection.fetch(Items.catalogue_query)
+
+    async def load_catalogue(self):
+        '''Returns the shared Catalogue, loading it from the DB if it has been invalidated (or never loaded)'''
+        catalogue = Items.catalogue
+        if not catalogue.is_loaded():
+            generation = catalogue.generation
+            return catalogue.load(Items.catalogue_items(await self._fetch_catalogue_query()), generation)
+        return catalogue
+
+    invalidate_catalogue = staticmethod(Items.invalidate_catalogue)
+    get_item_id = Items.get_item_id
+
+    async def fetch_name_id_map(self):
+        '''Returns a name to id map for all items in the Items table (from the catalogue, do not mutate it)'''
+        return (await self.load_catalogue()).name_id_map
+
+    async def fetch_id_name_map(self):
+        '''Returns an id to name map for all items in the Items table (from the catalogue, do not mutate it)'''
+        return (await self.load_catalogue()).id_name_map
+
+    async def fetch_item(self, item_id: int):
+        '''Returns the Item with `item_id`, or None if there is no such item'''
+        return (await self.load_catalogue()).items.get(item_id)
+
+    async def fetch_items(self):
+        '''Returns a list of every Item in the catalogue'''
+        return list((await self.load_catalogue()).items.values())
+
+    async def iter_items(self, itersize: int = 2000):
+        '''Yields every Item (in item_id order) from a single query on a server-side cursor,
+        without loading the whole table or the catalogue into memory'''
+        async for row in self.stream(Items.catalogue_query, itersize=itersize):
+            yield Items.catalogue_item(row)
+
+class AsyncPlayers(AsyncBaseConnection):
+    '''Async counterpart of query.Players'''
+    def __init__(self, pool: asyncpg.Pool) -> None:
+        super().__init__(pool)
+
+    async def _add_player_query(self, player_name: str):
+        '''Add a new player to DB'''
+        query = '''INSERT INTO Players(name)
+            VALUES ($1)
+            RETURNING *;'''
+        async with self.acquire() as connection:
+            return await connection.fetchrow(query, player_name)
+
+    async def add_player(self, player_name: str):
+        '''Adds a new player to the DB with specified name, returning a player object'''
+        return Player(*await self._add_player_query(player_name))
+
+    async def _delete_player_query(self, player_id: int):
+        '''Remove a player from the DB'''
+        query = '''DELETE FROM Players
+            WHERE player_id = $1;'''
+        async with self.acquire() as connection:
+            await connection.execute(query, player_id)
+
+    async def delete_player(self, player_id: int):
+        '''Deletes the specified player from the DB'''
+        await self._delete_player_query(player_id)
+
+    async def _fetch_player_query(self, player_id: int):
+        '''Fetches data for the specified player_id from the DB,
+            returns: `player_id, name, max_health, coins, energy, experience`'''
+        query = '''SELECT *
+            FROM Players
+            WHERE player_id = $1;'''
+        async with self.acquire() as connection:
+            return await connection.fetchrow(query, player_id)
+
+    async def fetch_player(self, player_id: int):
+        '''Queries the DB for the specified player_id
+            returns a Player object if they exist in the DB, else None'''
+        res = await self._fetch_player_query(player_id)
+        if res:
+            return Player(*res)
+        return None
+
+    async def _fetch_players_query(self):
+        '''Fetches all players from the database, returing all players'''
+        query = '''SELECT *
+            FROM Players;'''
+        async with self.acquire() as connection:
+            return await connection.fetch(query)
+
+    async def fetch_players(self):
+        '''Fetches all players from the database, returing a list of Player objects'''
+        return [Player(*row) for row in await self._fetch_players_query()]
+
+    async def _fetch_players_page_query(self, after_id: int, limit: int):
+        '''Fetches up to `limit` players with a player_id greater than `after_id`, in player_id order'''
+        query = '''SELECT *
+            FROM Players
+            WHERE player_id > $1
+            ORDER BY player_id
+            LIMIT $2;'''
+        async with self.acquire() as connection:
+            return await connection.fetch(query, after_id, limit)
+
+    async def iter_players(self, page_size: int = 500):
+        '''Yields every player as a Player object, fetching `page_size` players per query (keyset paginated on player_id)'''
+        after_id = 0
+        while True:
+            rows = await self._fetch_players_page_query(after_id, page_size)
+            for row in rows:
+                yield Player(*row)
+            if len(rows) < page_size:
+                return
+            after_id = rows[-1][0]
+
+    async def stream_players(self, itersize: int = 2000):
+        '''Yields every player as a Player object from a single query on a server-side cursor'''
+        query = '''SELECT *
+            FROM Players
+            ORDER BY player_id;'''
+        async for row in self.stream(query, itersize=itersize):
+            yield Player(*row)
+
+    async def _fetch_player_items_query(self, player_id: int):
+        '''Fetch all rows from PlayerItems with matching player_id
+            and join item id to Items table to get item info'''
+        query = '''SELECT PlayerItems.item_id, name, quantity
+            FROM PlayerItems
+            INNER JOIN Items ON Items.item_id = PlayerItems.item_id
+            WHERE player_id = $1;'''
+        async with self.acquire() as connection:
+            return await connection.fetch(query, player_id)
+
+    async def fetch_player_items(self, player_id: int):
+        '''Fetch all items from the PlayerItems table for specified player_id,
+            returning a list of Items'''
+        return [PlayerItem(*row) for row in await self._fetch_player_items_query(player_id)]
+
+    async def _fetch_player_items_page_query(self, player_id: int, after_item_id: int, limit: int):
+        '''Fetches up to `limit` of the player's items with an item_id greater than `after_item_id`, in item_id order'''
+        query = '''SELECT PlayerItems.item_id, name, quantity
+            FROM PlayerItems
+            INNER JOIN Items ON Items.item_id = PlayerItems.item_id
+            WHERE player_id = $1 AND
+            PlayerItems.item_id > $2
+            ORDER BY PlayerItems.item_id
+            LIMIT $3;'''
+        async with self.acquire() as connection:
+            return await connection.fetch(query, player_id, after_item_id, limit)
+
+    async def iter_player_items(self, player_id: int, page_size: int = 500):
+        '''Yields the player's items as PlayerItem objects, fetching `page_size` items per query (keyset paginated on item_id)'''
+        after_item_id = 0
+        while True:
+            rows = await self._fetch_player_items_page_query(player_id, after_item_id, page_size)
+            for row in rows:
+                yield PlayerItem(*row)
+            if len(rows) < page_size:
+                return
+            after_item_id = rows[-1][0]
+
+    async def stream_player_items(self, player_id: int, itersize: int = 2000):
+        '''Yields the player's items as PlayerItem objects from a single query on a server-side cursor'''
+        query = '''SELECT PlayerItems.item_id, name, quantity
+            FROM PlayerItems
+            INNER JOIN Items ON Items.item_id = PlayerItems.item_id
+            WHERE player_id = $1
+            ORDER BY PlayerItems.item_id;'''
+        async for row in self.stream(query, player_id, itersize=itersize):
+            yield PlayerItem(*row)
+
+    async def _delete_player_item_query(self, player_id: int, item_id: int):
+        '''Deletes the item for the player from the PlayerItems table'''
+        query = '''DELETE FROM PlayerItems
+            WHERE player_id = $1 AND
+            item_id = $2;'''
+        async with self.acquire() as connection:
+            await connection.execute(query, player_id, item_id)
+
+    async def delete_player_item(self, player_id: int, item_id: int):
+        '''Deletes the specified item for the specified player from the PlayerItems table'''
+        await self._delete_player_item_query(player_id, item_id)
+
+    async def _set_player_item_query(self, player_id: int, item_id: int, amount: int):
+        '''Sets the quantity of the specified item, for the specified player in the PlayerItems table'''
+        query = '''UPDATE PlayerItems
+            SET quantity = $1
+            WHERE player_id = $2 AND
+            item_id = $3;'''
+        async with self.acquire() as connection:
+            await connection.execute(query, amount, player_id, item_id)
+
+    async def set_or_delete_player_item(self, player_id: int, item_id: int, amount: int):
+        '''Sets the quantity of the specified player's item to `amount`,
+            if the amount is <= 0 the item is removed from the PlayerItems table.
+            Note: Assumes the item is in the PlayerItems table'''
+        if amount <= 0:
+            await self._delete_player_item_query(player_id, item_id)
+            return
+        await self._set_player_item_query(player_id, item_id, amount)
+
+    async def _set_player_items_query(self, player_id: int, amounts: list[tuple[int, int]]):
+        '''Sets the quantities of many of the specified player's items in the PlayerItems table in one statement,
+            `amounts` is a list of (item_id, quantity)'''
+        query = '''UPDATE PlayerItems
+            SET quantity = new.quantity
+            FROM unnest($2::int[], $3::smallint[]) AS new (item_id, quantity)
+            WHERE PlayerItems.player_id = $1 AND
+            PlayerItems.item_id = new.item_id;'''
+        async with self.acquire() as connection:
+            await connection.execute(query, player_id, [item_id for item_id, _ in amounts], [amount for _, amount in amounts])
+
+    async def _delete_player_items_query(self, player_id: int, item_ids: list[int]):
+        '''Deletes many items for the player from the PlayerItems table in one statement'''
+        query = '''DELETE FROM PlayerItems
+            WHERE player_id = $1 AND
+            item_id = ANY($2::int[]);'''
+        async with self.acquire() as connection:
+            await connection.execute(query, player_id, item_ids)
+
+    async def set_or_delete_player_items(self, player_id: int, amounts: dict[int, int]):
+        '''Bulk version of set_or_delete_player_item(), `amounts` is a `dict: [item_id, amount]`.
+            All the changes are made in a single transaction'''
+        to_set = [(item_id, amount) for item_id, amount in amounts.items() if amount > 0]
+        to_delete = [item_id for item_id, amount in amounts.items() if amount <= 0]
+        async with self.transaction():
+            if to_set:
+                await self._set_player_items_query(player_id, to_set)
+            if to_delete:
+                await self._delete_player_items_query(player_id, to_delete)
+
+    async def _upsert_player_item_query(self, player_id: int, item_id: int, amount: int):
+        '''Adds the item to the player in the PlayerItems table, or adds `amount` to the quantity if they already have it,
+            returning the new quantity'''
+        query = '''INSERT INTO PlayerItems (player_id, item_id, quantity)
+            VALUES ($1, $2, $3)
+            ON CONFLICT (player_id, item_id) DO UPDATE
+            SET quantity = PlayerItems.quantity + EXCLUDED.quantity
+            RETURNING quantity;'''
+        async with self.acquire() as connection:
+            return await connection.fetchval(query, player_id, item_id, amount)
+
+    async def update_player_item(self, player_id: int, item_id: int, amount: int):
+        '''Adds or Updates an item to/in a players inventory, returning the new item quantity'''
+        return await self._upsert_player_item_query(player_id, item_id, int(amount))
+
+    async def _grant_player_items_query(self, grants: list[tuple[int, int, int]]):
+        '''Upserts many (player_id, item_id, amount) rows into the PlayerItems table in one statement,
+            returning the (player_id, item_id, quantity) of each row'''
+        query = '''INSERT INTO PlayerItems (player_id, item_id, quantity)
+            SELECT * FROM unnest($1::bigint[], $2::int[], $3::smallint[])
+            ON CONFLICT (player_id, item_id) DO UPDATE
+            SET quantity = PlayerItems.quantity + EXCLUDED.quantity
+            RETURNING player_id, item_id, quantity;'''
+        player_ids, item_ids, amounts = (list(column) for column in zip(*grants))
+        async with self.acquire() as connection:
+            return await connection.fetch(query, player_ids, item_ids, amounts)
+
+    async def grant_player_items(self, grants: list[tuple[int, int, int]]):
+        '''Bulk version of update_player_item(), `grants` is a list of (player_id, item_id, amount) for any number of players.
+            Returns a `dict: [(player_id, item_id), new quantity]`'''
+        totals: Counter[tuple[int, int]] = Counter()
+        for player_id, item_id, amount in grants:
+            totals[(player_id, item_id)] += amount
+        if not totals:
+            return {}
+        rows = await self._grant_player_items_query([(player_id, item_id, amount) for (player_id, item_id), amount in sorted(totals.items())])
+        return {(player_id, item_id): quantity for player_id, item_id, quantity in rows}
+
+    async def _fetch_combat_items_query(self, player_id: int):
+        '''Selects all item attributes required in combat for a specified player_id'''
+        query = '''SELECT type, Items.item_id, name, quantity, min_range, max_range, min_turns, max_turns, min_experience, max_experience
+            FROM PlayerItems
+            INNER JOIN Items ON Items.item_id = PlayerItems.item_id
+            INNER JOIN ConsumableData ON Items.consumable_id = ConsumableData.consumable_id
+            WHERE PlayerItems.player_id = $1 AND
+            type IN ('damage', 'heal');'''
+        async with self.acquire() as connection:
+            return await connection.fetch(query, player_id)
+
+    async def fetch_combat_items(self, player_id: int):
+        '''Returns two lists of CombatItem objects, damaging & healing, for use in Combat'''
+        return Players.combat_items(await self._fetch_combat_items_query(player_id))
@@ -0,0 +1,240 @@
+from __future__ import annotations
+from simulate import SimulatedCombat
+from random import seed
+import numpy as np
+import objects
+
+def ranges_chance(starts: np.ndarray, stops: np.ndarray, values: np.ndarray):
+    '''Vectorised Combat.BaseClass.calculate_ranges_chance, `values` has one value per game (row)'''
+    values = values[:, None]
+    in_range = (starts <= values) & (values < stops)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(in_range, (stops - values)/(stops - starts), 0.0)
+
+def chance_of_at_least(starts: np.ndarray, stops: np.ndarray, values: np.ndarray):
+    '''Vectorised probability.chance_of_at_least, each row of starts/stops are the (inclusive) ranges rolled in one game.
+    Padding should be the range 0-0 which does not change the total'''
+    games, rolls = starts.shape
+    highest_total = int(stops.sum(axis=1).max()) if rolls and games else 0
+    totals = np.arange(highest_total+1)
+    probabilities = np.zeros((games, highest_total+1))
+    probabilities[:, 0] = 1.0
+    rows = np.arange(games)[:, None]
+    for roll in range(rolls):
+        start, stop = starts[:, roll][:, None], stops[:, roll][:, None]
+        # Convolving with a uniform distribution is a sliding window sum over the prefix sums
+        prefix = np.concatenate((np.zeros((games, 1)), np.cumsum(probabilities, axis=1)), axis=1)
+        upper = np.clip(totals - start + 1, 0, highest_total+1)
+        lower = np.clip(totals - stop, 0, highest_total+1)
+        probabilities = (prefix[rows, upper] - prefix[rows, lower])/(stop - start + 1)
+    return np.where(totals >= values[:, None], probabilities, 0.0).sum(axis=1)
+
+def pick(candidates: np.ndarray, rng: np.random.Generator):
+    '''Returns the column of a uniformly random True value in each row of `candidates`, like random.choice() on each row'''
+    totals = candidates.sum(axis=1)
+    chosen = (rng.random(len(candidates))*totals).astype(np.int64)
+    return (np.cumsum(candidates, axis=1) > chosen[:, None]).argmax(axis=1)
+
+class Side:
+    '''One side (the player or the enemy) of every game in a BatchSimulation.
+    The items are columns: the damaging items, then the healing items, then the default punch.
+    Their stats never change so they are kept as 1D arrays, while counts, health and cooldowns are (games x items) or (games) arrays'''
+    def __init__(self, damaging: list[objects.CombatItem], healing: list[objects.CombatItem], max_health: np.ndarray, difficulty: np.ndarray, risk: np.ndarray) -> None:
+        items = damaging + healing + [objects.PUNCH]
+        self.punch = len(items) - 1
+        self.is_heal = np.array([False]*len(damaging) + [True]*len(healing) + [False])
+        self.starts = np.array([item.range.start for item in items])
+        self.stops = np.array([item.range.stop for item in items])
+        self.turn_starts = np.array([item.turns.start for item in items])
+        self.turn_stops = np.array([item.turns.stop for item in items])
+        self.range_avg = (self.stops + self.starts)/2
+        self.range_size = self.stops - self.starts + 1
+        self.turn_avg = (self.turn_stops + self.turn_starts)/2
+
+        # The damaging items in the orders of Combat.BaseClass.indexes (np.lexsort is stable, so ties keep their order)
+        damaging_columns = np.flatnonzero(~self.is_heal)
+        self.orders: dict[str, np.ndarray] = {
+            'range_avg': damaging_columns[np.lexsort((-self.range_avg[damaging_columns],))],
+            'range_size': damaging_columns[np.lexsort((-self.range_size[damaging_columns],))],
+            'danger': damaging_columns[np.lexsort((self.turn_avg[damaging_columns], -self.range_size[damaging_columns], -self.range_avg[damaging_columns]))]
+        }
+
+        games = len(max_health)
+        self.counts = np.tile(np.array([item.count for item in items]), (games, 1))
+        self.held = np.ones((games, len(items)), dtype=bool) # Whether the item is still in the damaging/healing list
+        self.held[:, self.punch] = self.punch == 0 # Only if there are no other items (Combat.BaseClass.ensure_move_available)
+        self.max_health = max_health
+        self.health = max_health.copy()
+        self.cooldown = np.zeros(games, dtype=np.int64)
+        self.moves = np.zeros(games, dtype=np.int64)
+        self.difficulty = difficulty
+        self.risk = risk
+        self.moves_to_predict: int = 2
+
+    def ranks(self, order: str, damaging: np.ndarray):
+        '''Returns the position of each held damaging item in the `order` index, -1 for other items'''
+        columns = self.orders[order]
+        ranks = np.full(damaging.shape, -1)
+        ranks[:, columns] = np.where(damaging[:, columns], np.cumsum(damaging[:, columns], axis=1) - 1, -1)
+        return ranks
+
+    def first_n_ranges(self, games: np.ndarray, n: int):
+        '''Vectorised Enemy.get_n_items(player.indexes['danger'].items, n), returning the `tuple: [starts, stops]` of the ranges taken.
+        Rows that take fewer than `n` items are padded with the range 0-0'''
+        columns = self.orders['danger']
+        counts = np.where(self.held[games][:, columns], self.counts[games][:, columns], 0)
+        taken = np.cumsum(np.clip(n - (np.cumsum(counts, axis=1) - counts), 0, counts), axis=1) # Running total of items taken
+        starts = np.zeros((len(games), n), dtype=np.int64)
+        stops = np.zeros((len(games), n), dtype=np.int64)
+        for roll in range(n):
+            column = columns[(taken > roll).argmax(axis=1)]
+            starts[:, roll] = np.where(taken[:, -1] > roll, self.starts[column], 0)
+            stops[:, roll] = np.where(taken[:, -1] > roll, self.stops[column], 0)
+        return starts, stops
+
+    def likely_heals(self, healing: np.ndarray, required: np.ndarray):
+        '''Vectorised Enemy.find_items_likely_to_roll_required(self.healing, required), returning a mask of the items'''
+        difference = np.where(healing, np.abs(self.range_avg - required[:, None]), np.inf)
+        closest = healing & (self.range_avg == self.range_avg[difference.argmin(axis=1)][:, None])
+        smallest = np.where(closest, self.range_size, np.iinfo(np.int64).max).min(axis=1)
+        return closest & (self.range_size == smallest[:, None])
+
+def decide_moves(side: Side, opponent: Side, games: np.ndarray, rng: np.random.Generator):
+    '''Vectorised Enemy.make_move for `side` against `opponent` in each of `games`, returning the column of the item to use in each'''
+    held = side.held[games]
+    damaging = held & ~side.is_heal
+    healing = held & side.is_heal
+    has_damaging = damaging.any(axis=1)
+    has_healing = healing.any(axis=1)
+    health = side.health[games]
+    max_health = side.max_health[games]
+    health_lost = max_health - health
+    risk = side.risk[games]
+    opponent_health = opponent.health[games]
+    opponent_max_health = opponent.max_health[games]
+
+    # Can the opponent be killed this move?
+    chances = ranges_chance(side.starts, side.stops, opponent_health)
+    killing = damaging & (chances > risk[:, None])
+    kill = np.where(killing, chances, -1.0).argmax(axis=1)
+
+    # Could the opponent kill side in their next moves? If so heal
+    starts, stops = opponent.first_n_ranges(games, side.moves_to_predict)
+    chance_of_dying = chance_of_at_least(starts, stops, health)
+    opponent_has_damaging = (opponent.held[games] & ~opponent.is_heal).any(axis=1)
+    must_heal = opponent_has_damaging & (chance_of_dying > risk) & (health_lost > 0) & has_healing
+    likely_heals = side.likely_heals(healing, health_lost)
+    urgent_heal = np.where(likely_heals, side.turn_avg, np.inf).argmin(axis=1)
+
+    # Otherwise a normal move (Enemy.normal_move_candidates and Enemy.choose_move)
+    difficulty = side.difficulty[games]
+    health_threshold = 0.5 + (0.5-difficulty)/2
+    percentage = 0.5 + (0.5-difficulty)/(3/2)
+    ranks = np.where((opponent_health/opponent_max_health < health_threshold)[:, None], side.ranks('range_avg', damaging), side.ranks('range_size', damaging))
+    attacks = damaging & (ranks < np.ceil(damaging.sum(axis=1)*percentage)[:, None])
+    # Stable sort of those attacks by avg cooldown, lowest first if side has 'lower' health otherwise highest first
+    cooldowns = np.where((health/max_health < health_threshold)[:, None], side.turn_avg, -side.turn_avg)
+    before = attacks[:, None, :] & ((cooldowns[:, None, :] < cooldowns[:, :, None]) | ((cooldowns[:, None, :] == cooldowns[:, :, None]) & (ranks[:, None, :] < ranks[:, :, None])))
+    attacks &= before.sum(axis=2) < np.ceil(attacks.sum(axis=1)*percentage)[:, None]
+    attack = pick(attacks, rng)
+    heal = pick(likely_heals, rng)
+    considers_healing = ~has_damaging | (has_healing & (health_lost/max_health >= risk))
+    attack_is_better = side.range_avg[attack]/opponent_max_health > side.range_avg[heal]/max_health
+    normal = np.where(has_damaging & (~considers_healing | attack_is_better), attack, heal)
+
+    return np.where(killing.any(axis=1), kill, np.where(must_heal, urgent_heal, normal))
+
+def use_items(side: Side, target: Side, games: np.ndarray, columns: np.ndarray, rng: np.random.Generator):
+    '''Vectorised Combat.BaseClass.use_item, `side` uses the item in `columns` in each of `games`'''
+    amounts = rng.integers(side.starts[columns], side.stops[columns]+1)
+    side.cooldown[games] += rng.integers(side.turn_starts[columns], side.turn_stops[columns]+1)
+    side.moves[games] += 1
+
+    used = columns != side.punch # The default punch is never used up
+    side.counts[games[used], columns[used]] -= 1
+    side.held[games[used], columns[used]] = side.counts[games[used], columns[used]] >= 1
+    side.held[games, side.punch] |= ~side.held[games].any(axis=1)
+
+    heals = side.is_heal[columns]
+    side.health[games[heals]] = np.clip(side.health[games[heals]] + amounts[heals], 0, side.max_health[games[heals]])
+    target.health[games[~heals]] = np.clip(target.health[games[~heals]] - amounts[~heals], 0, target.max_health[games[~heals]])
+
+class BatchSimulation:
+    '''Plays many headless Enemy-vs-Enemy combats with the same items in lockstep, one round of every game per step.
+    The state of every game is kept in arrays (see Side) and both sides' moves are decided and made as array operations.
+    Games where either side is hard, and so searches, are played one at a time with SimulatedCombat when their result is asked for'''
+    def __init__(self,
+            damaging: list[objects.CombatItem],
+            healing: list[objects.CombatItem],
+            games: int,
+            max_health: int = 10,
+            difficulty: float = None,
+            risk: float = None,
+            player_difficulty: float = None,
+            player_risk: float = None,
+            seed: int = None
+        ) -> None:
+        self.rng = np.random.default_rng(seed)
+        def setting(value: float | None, low: float, high: float):
+            return np.full(games, value) if value else np.round(self.rng.uniform(low, high, games), 3)
+        enemy_difficulty, player_difficulty = setting(difficulty, 0.25, 0.75), setting(player_difficulty, 0.25, 0.75)
+        enemy_risk, player_risk = setting(risk, 0.3, 0.85), setting(player_risk, 0.3, 0.85)
+
+        # Matches Combat.Enemy.get_difficulty_name() == Combat.Enemy.search_difficulty
+        searching = (enemy_difficulty >= 0.65) | (player_difficulty >= 0.65)
+        # SimulatedCombat rolls with the random module, so each searched game is given a seed of its own from self.rng
+        self.searched_seeds = {int(game): int(self.rng.integers(2**63)) for game in np.flatnonzero(searching)}
+        self.searched: dict[int, objects.CombatResult] = {}
+        self.loadout = (damaging, healing, max_health)
+
+        player_max_health = np.full(games, max_health)
+        enemy_max_health = np.round(player_max_health + player_max_health*(enemy_difficulty-0.5)).astype(np.int64) # Combat.Enemy.calculate_max_health
+        self.player = Side(damaging, healing, player_max_health, player_difficulty, player_risk)
+        self.enemy = Side(damaging, healing, enemy_max_health, enemy_difficulty, enemy_risk)
+        self.active = ~searching
+        self.rounds = np.zeros(games, dtype=np.int64)
+        self.health_history: list[tuple[np.ndarray, np.ndarray]] = [(self.player.health.copy(), self.enemy.health.copy())]
+
+    def step(self):
+        '''Plays one round of every unfinished combat'''
+        player, enemy = self.player, self.enemy
+        games = np.flatnonzero(self.active & (player.cooldown == 0))
+        if len(games):
+            use_items(player, enemy, games, decide_moves(player, enemy, games, self.rng), self.rng)
+        games = np.flatnonzero(self.active & (enemy.cooldown == 0) & (enemy.health > 0)) # Enemy may have died on players turn
+        if len(games):
+            use_items(enemy, player, games, decide_moves(enemy, player, games, self.rng), self.rng)
+
+        player.cooldown[self.active] -= 1
+        enemy.cooldown[self.active] -= 1
+        self.rounds[self.active] += 1
+        self.health_history.append((player.health.copy(), enemy.health.copy()))
+        self.active &= (player.health > 0) & (enemy.health > 0)
+
+    def play_searched(self, game: int):
+        '''Plays a game where either side searches with SimulatedCombat, seeding the random module with the game's seed'''
+        damaging, healing, max_health = self.loadout
+        seed(self.searched_seeds[game])
+        self.searched[game] = SimulatedCombat(damaging, healing, max_health, difficulty=self.enemy.difficulty[game], risk=self.enemy.risk[game],
+            player_difficulty=self.player.difficulty[game], player_risk=self.player.risk[game]).result
+
+    def result(self, game: int):
+        '''Returns the CombatResult of a finished game'''
+        if game in self.searched_seeds:
+            if game not in self.searched:
+                self.play_searched(game)
+            return self.searched[game]
+        history = self.health_history[:self.rounds[game]+1]
+        return objects.CombatResult(
+            'enemy' if self.enemy.health[game] else 'player',
+            int(self.player.moves[game]),
+            int(self.enemy.moves[game]),
+            [int(health[0][game]) for health in history],
+            [int(health[1][game]) for health in history]
+        )
+
+    def run(self):
+        '''Plays every combat to the end, returning their CombatResults'''
+        while self.active.any():
+            self.step()
+        return [self.result(game) for game in range(len(self.rounds))]
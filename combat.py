@@ -1,35 +1,79 @@
 from __future__ import annotations
 from psycopg2.extensions import (connection as PostgresConnection, cursor as PostgresCursor)
-from operator import attrgetter, methodcaller
+from psycopg2.pool import AbstractConnectionPool
+from operator import attrgetter
 from random import choice, randint, uniform
 from difflib import get_close_matches
+from collections import OrderedDict
+from bisect import bisect_left
+from threading import Lock
+from probability import chance_of_at_least
+from search import Expectimax
 from query import Connection
-from copy import deepcopy
 from math import ceil
 import objects
 
 debug = False
 
+class DecisionCache:
+    '''A least recently used cache of the enemy's move candidates, keyed on the game state.
+    Shared by every enemy so it may be used from many threads at once, each operation holds a lock'''
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self.entries: OrderedDict[tuple, tuple] = OrderedDict()
+        self.hits: int = 0
+        self.misses: int = 0
+        self.lock = Lock()
+
+    def get(self, key: tuple):
+        '''Returns the cached value for `key` or None if it is not cached'''
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key: tuple, value: tuple):
+        '''Caches `value`, removing the least recently used entry if the cache is full'''
+        with self.lock:
+            self.entries[key] = value
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
 class Combat(Connection):
     class Item(objects.CombatItem):
         '''Class representation of a game item with methods'''
+        __slots__ = ('initial_count', 'current_chance', 'range_avg', 'turn_avg', 'range_size')
         def __init__(self, item_id: int, name: str, count: int, item_range: range, turns: range, experience: range) -> None:
             super().__init__(item_id, name, count, item_range, turns, experience)
             self.initial_count: int = int(count)
             self.current_chance: float | None = None # Used for processing
-            self.tmp_count: int | None = None # Used for processing
+
+            # The ranges do not change during combat so the stats are only calculated once
+            self.range_avg: float = (self.range.stop + self.range.start)/2
+            self.turn_avg: float = (self.turns.stop + self.turns.start)/2
+            self.range_size: int = self.range.stop - self.range.start + 1
 
         def get_range_avg(self):
             '''Return the range avg of the item'''
-            return (self.range.stop + self.range.start)/2
+            return self.range_avg
 
         def get_turn_avg(self):
             '''Return the turn avg of the item'''
-            return (self.turns.stop + self.turns.start)/2
+            return self.turn_avg
 
         def get_range(self) -> int:
             '''Return the range of damage/healing the item can do'''
-            return self.range.stop - self.range.start + 1
+            return self.range_size
         
         def roll_amount(self):
             '''Simulates using the attack/heal, returning the amount'''
@@ -47,16 +91,101 @@ class Combat(Connection):
             '''Updated the count of that item'''
             self.count -= 1
 
+        def get_signature(self):
+            '''Returns a tuple of everything about the item the enemy AI's decisions depend on.
+            The bounds are used rather than the ranges themselves, as every empty range (eg. range(2,2) and range(3,3)) is equal'''
+            return (self.range.start, self.range.stop, self.turns.start, self.turns.stop, self.count)
+
+    class ItemIndex:
+        '''A list of items kept sorted by `key`, items are inserted/removed with a binary search instead of re-sorting the list'''
+        __slots__ = ('key', 'keys', 'items', 'item_keys', 'insertions')
+        def __init__(self, items: list[Combat.Item], key) -> None:
+            self.key = key
+            self.keys: list[tuple] = []
+            self.items: list[Combat.Item] = []
+            self.item_keys: dict[int, tuple] = {} # id(item) -> the key it was inserted with
+            self.insertions: int = 0 # Added to each key so items with equal keys stay in the order they were added
+            for item in items:
+                self.add(item)
+
+        def add(self, item: Combat.Item):
+            '''Inserts `item` into its sorted position'''
+            item_key = (self.key(item), self.insertions)
+            self.insertions += 1
+            index = bisect_left(self.keys, item_key)
+            self.keys.insert(index, item_key)
+            self.items.insert(index, item)
+            self.item_keys[id(item)] = item_key
+
+        def remove(self, item: Combat.Item):
+            '''Removes `item` from the index'''
+            index = bisect_left(self.keys, self.item_keys.pop(id(item)))
+            del self.keys[index]
+            del self.items[index]
+
+    class Inventory:
+        '''A list of items that also keeps the total count of all the items in it.
+        The list is wrapped rather than subclassed so it can only be changed through append(), remove() and reduce(),
+        which keep the total correct. Reading it works like a list, `+` and copy() return plain lists'''
+        __slots__ = ('items', 'total')
+        def __init__(self, items: list[Combat.Item] = ()) -> None:
+            self.items: list[Combat.Item] = list(items)
+            self.total: int = sum(item.count for item in self.items)
+
+        def __iter__(self):
+            return iter(self.items)
+
+        def __len__(self):
+            return len(self.items)
+
+        def __contains__(self, item: Combat.Item):
+            return item in self.items
+
+        def __getitem__(self, index: int):
+            return self.items[index]
+
+        def __add__(self, other: list[Combat.Item]):
+            return self.items + list(other)
+
+        def __radd__(self, other: list[Combat.Item]):
+            return list(other) + self.items
+
+        def __repr__(self):
+            return f'Inventory({self.items!r})'
+
+        def copy(self):
+            return self.items.copy()
+
+        def append(self, item: Combat.Item):
+            self.items.append(item)
+            self.total += item.count
+
+        def remove(self, item: Combat.Item):
+            self.items.remove(item)
+            self.total -= item.count
+
+        def reduce(self, item: Combat.Item):
+            '''Reduces the count of `item` by 1'''
+            item.reduce_count()
+            self.total -= 1
+
     class BaseClass:
+        __slots__ = ('name', 'max_health', 'health', 'turn_cooldown', 'move_number', 'damaging', 'healing', 'used', 'indexes')
         def __init__(self, name, max_health, damaging, healing, health=None) -> None:
             self.name: str = name
             self.max_health: int = max_health
             self.health: int = health if health else max_health
             self.turn_cooldown: int = 0
             self.move_number: int = 0
-            self.damaging: list[Combat.Item] = damaging
-            self.healing: list[Combat.Item] = healing
+            self.damaging: Combat.Inventory = Combat.Inventory(damaging)
+            self.healing: Combat.Inventory = Combat.Inventory(healing)
             self.used: list[Combat.Item] = []
+            # self.damaging sorted in the orders the enemy AI needs, updated whenever an item is added or removed
+            self.indexes: dict[str, Combat.ItemIndex] = {
+                'range_avg': Combat.ItemIndex(self.damaging, lambda item: -item.range_avg), # Largest range avg first
+                'range_size': Combat.ItemIndex(self.damaging, lambda item: -item.range_size), # Largest range first
+                'danger': Combat.ItemIndex(self.damaging, lambda item: (-item.range_avg, -item.range_size, item.turn_avg))
+            }
             self.ensure_move_available()
 
         def get_input(self, prompt: str = ''):
@@ -92,48 +221,28 @@ class Combat(Connection):
             '''Returns a float between 0-1 respresenting the % of health lost'''
             return self.health_lost()/self.max_health
 
-        def get_largest_range(self, items: list[Combat.Item]): #items -> eg. self.damaging or self.healing
-            '''Returns the range of the item with the largest range'''
-            return max(items, key=methodcaller('get_range')).get_range()
-        
-        def get_largest_range_avg(self, items: list[Combat.Item]):
-            '''Returns the range avg of the item with the largest range avg'''
-            return max(items, key=methodcaller('get_range_avg')).get_range_avg()
-
         def get_smallest_range(self, items: list[Combat.Item]):
             '''Returns the range of the item with the smallest range'''
-            return min(items, key=methodcaller('get_range')).get_range()
+            return min(items, key=attrgetter('range_size')).range_size
 
         def get_closest_range_avg(self, items: list[Combat.Item], target_value: float):
             '''Returns the range_avg of the item in `items` that's range_avg is closest to `target_value`'''
-            return min(items, key=lambda x:abs(x.get_range_avg()-target_value)).get_range_avg()
+            return min(items, key=lambda x:abs(x.range_avg-target_value)).range_avg
             # check/test this reurns the range_avg closest above not below
 
-        def calculate_item_count(self, items: list[Combat.Item]):
+        def calculate_item_count(self, items: Combat.Inventory):
             '''Returns the true count of how many items are 'in' items,
             this is necessary as Item objects have their own count attribute so simply calling len() would not suffice'''
-            total = 0
-            for item in items:
-                total += item.count
-            return total
+            return items.total
 
         def get_n_items(self, items: list[Combat.Item], n: int = 1):
-            '''Returns the first n or as many as possible items from items, taking into account the items count attribute'''
-            item_count = self.calculate_item_count(items)
-            if n > item_count:
-                n = item_count
+            '''Returns the first n or as many as possible items from items, taking into account the items count attribute,
+            an item appears in the returned list once for each of its count that is taken. `items` is not modified'''
             items_list: list[Combat.Item] = []
-            current_item = items.pop(0)
-            current_item.tmp_count = int(current_item.count)
-            while n:
-                if current_item.tmp_count < 1:
-                    current_item = items.pop(0)
-                    current_item.tmp_count = int(current_item.count)
-                items_list.append(current_item)
-                current_item.tmp_count -= 1
-                n -= 1
-            for item in items_list:
-                item.tmp_count = None
+            for item in items:
+                if len(items_list) >= n:
+                    break
+                items_list.extend([item]*min(item.count, n-len(items_list)))
             return items_list
 
         def calculate_ranges_chance(self, item_range: range, value: int):
@@ -161,14 +270,20 @@ class Combat(Connection):
             '''Combat would break is one of then opponents had no moves,
             so if both damging and healing is empty then a default punch attack is added to the instance'''
             if self.damaging + self.healing == []:
-                self.damaging.append(Combat.Item(None, 'punch', 1, range(1,2), range(2,2), range(0,0)))
+                punch = Combat.Item(objects.PUNCH.id, objects.PUNCH.name, objects.PUNCH.count, objects.PUNCH.range, objects.PUNCH.turns, objects.PUNCH.experience)
+                self.damaging.append(punch)
+                for index in self.indexes.values():
+                    index.add(punch)
 
         def remove_item(self, items: list[Combat.Item], item: Combat.Item):
             '''Reduces the count of an item in item_list or moves it to self.used if count is 0'''
-            if item.name != 'punch': # If they are using the default punch attack do not remove
-                item.reduce_count()
+            if item.name != objects.PUNCH.name: # If they are using the default punch attack do not remove
+                items.reduce(item)
                 if item.get_count() < 1:
                     items.remove(item)
+                    if items is self.damaging:
+                        for index in self.indexes.values():
+                            index.remove(item)
                     self.add_to_used(item)
                 self.ensure_move_available()
             
@@ -196,11 +311,24 @@ class Combat(Connection):
 
     class Enemy(BaseClass):
         '''An AI controlled enemy for the player to face in combat'''
+        search_difficulty: str = 'hard' # Enemies of this difficulty use the expectimax search instead of the heuristics
+        search_time_budget: float = 0.02 # Seconds the search may take per move
+        search_max_depth: int = 8
+        search_node_budget: int | None = None # Nodes the search may expand per move, None for no limit
+        decision_cache: DecisionCache = DecisionCache(50_000) # Shared by all enemies
+        __slots__ = ('difficulty', 'risk', 'moves_to_predict', 'search', 'search_items')
         def __init__(self, Player: Combat.BaseClass, damaging, healing, health=None, difficulty=None, risk=None) -> None:
-            self.difficulty: float = difficulty if difficulty else round(uniform(0.25, 0.75), 3)
+            self.init_ai(difficulty, risk)
             super().__init__(self.generate_name(), self.calculate_max_health(Player.max_health), damaging, healing, health)
+
+        def init_ai(self, difficulty: float | None, risk: float | None):
+            '''Sets up the state of the AI, before BaseClass.__init__ as the name and max health depend on the difficulty.
+            Also used by instances that are not enemies but are controlled by this AI (see simulate.py)'''
+            self.difficulty: float = difficulty if difficulty else round(uniform(0.25, 0.75), 3)
             self.risk: float = risk if risk else round(uniform(0.3, 0.85), 3) # The maximum risk enemy will take
             self.moves_to_predict: int = 2
+            self.search: Expectimax | None = None
+            self.search_items: tuple[list[Combat.Item], ...] = ()
 
         def debug(self, text: str):
             '''Displays debug information if debug is True'''
@@ -229,20 +357,20 @@ class Combat(Connection):
             return f'{self.get_difficulty_name()} {choice(names)}'
 
         ## Generic Function ##
-        def get_items_with_target_method_value(self, items: list[Combat.Item], value_to_match, method_to_get_value):
-            '''Returns a list of items from `items` where the result of `method_to_get_value` matches `value_to_match`'''
-            return [item for item in items if getattr(item, method_to_get_value)() == value_to_match]
+        def get_items_with_target_attribute_value(self, items: list[Combat.Item], value_to_match, attribute: str):
+            '''Returns a list of items from `items` where the value of `attribute` matches `value_to_match`'''
+            return [item for item in items if getattr(item, attribute) == value_to_match]
 
         def find_items_likely_to_roll_required(self, items: list[Combat.Item], required_amount: int):
             '''Return a list of items most likely to roll the value of `required_amount` in `items`,
             these will be items that have a close range_avg and a narrow range.'''
             # Find items with range_avg that is closest to the required amount
             target_range_avg = self.get_closest_range_avg(items, required_amount)
-            items_of_range_avg = self.get_items_with_target_method_value(items, target_range_avg, 'get_range_avg')
+            items_of_range_avg = self.get_items_with_target_attribute_value(items, target_range_avg, 'range_avg')
 
             # Of those items return the ones with the smallest range (most likely to roll nearest required amount)
             smallest_range = self.get_smallest_range(items_of_range_avg)
-            items_of_smallest_range = self.get_items_with_target_method_value(items_of_range_avg, smallest_range, 'get_range')
+            items_of_smallest_range = self.get_items_with_target_attribute_value(items_of_range_avg, smallest_range, 'range_size')
 
             # items_of_smallest_range has been narrowed down a lot so it is likely this list contains only 1 item
             return items_of_smallest_range
@@ -251,9 +379,37 @@ class Combat(Connection):
             '''Returns the first x% of items in `items`, will always return at least one item'''
             return items[:ceil(len(items)*percentage)]
 
+        def choose_move(self, player: Combat.Player, attacks: list[Combat.Item], heals: list[Combat.Item]):
+            '''Randomly selects one of the candidate attacks and one of the candidate heals,
+            returning whichever of the two would be more effective'''
+            selected_attack = choice(attacks) if attacks else None
+            if not heals:
+                return selected_attack
+
+            # select a random one (choice is likey from a list of 1 as heals have been narrowed down)
+            selected_heal = choice(heals)
+            if selected_attack:
+                self.debug('Comparing attack to heal to see which is more effective')
+                # Now we have 'the perfect' heal and 'the perfect' attack
+                # Lets compare which one would be more effective, based on the change to the recipients health
+                percentage_change_in_player_health = selected_attack.range_avg/player.max_health
+                percentage_change_in_enemy_health = selected_heal.range_avg/self.max_health
+
+                if percentage_change_in_player_health > percentage_change_in_enemy_health:
+                    self.debug(f'Decided attack is more effective: {selected_attack.name}')
+                    return selected_attack
+
+            # Else there are no attacks or healing is more effective, so return the selected heal (to use)
+            self.debug(f'Decided to use heal (potentially most effective): {selected_heal.name}')
+            return selected_heal
+
         def normal_move(self, player: Combat.Player):
             '''Returns an Item the enemy should use,
                 there are no immediate opportunities/dangers so this is a broarder move.'''
+            return self.choose_move(player, *self.normal_move_candidates(player))
+
+        def normal_move_candidates(self, player: Combat.Player):
+            '''Returns the attacks and heals suitable for a normal move, one of which is picked by choose_move()'''
             ### EXPLANATION ###
             '''The choice of move is made based off multiple factors:
                 % Enemy health lost > risk --> enemy could heal (lower difficulty more likely to heal)
@@ -293,7 +449,7 @@ class Combat(Connection):
 
             self.debug('-> Now attempting normal_move')
 
-            selected_attack = None
+            selected_attacks = []
             if self.damaging:
                 # We need to decide if the player is on 'lower' or 'higher' health,
                 # this is roughly 50% of max_health with some variation based on the enemys dificulty.
@@ -304,12 +460,12 @@ class Combat(Connection):
 
                 if player.health_remaining_percentage() < health_threshold:
                     self.debug("Player has 'lower' health -> attempting to use stonger attacks")
-                    # Sort self.damaging by range_avg (largest first)
-                    self.damaging.sort(key=methodcaller('get_range_avg'), reverse=True)
+                    # self.damaging by range_avg (largest first)
+                    sorted_attacks = self.indexes['range_avg'].items
                 else:
                     self.debug("Player has 'higher' health -> attempting to use larger range attacks")
-                    # Sort self.damaging by range (largest first)
-                    self.damaging.sort(key=methodcaller('get_range'), reverse=True)
+                    # self.damaging by range (largest first)
+                    sorted_attacks = self.indexes['range_size'].items
                 
 
                 # Now we want to select a % of those attacks
@@ -317,7 +473,7 @@ class Combat(Connection):
                     # higher difficulty (.75) --> 33.3% of attacks chosen, more likely to use attack that meets criteria
                     # lower difficulty (.25) --> 66.6% of attacks chosen, less likely to use attack that meets criteria
 
-                selected_attacks = self.select_percentage_of_list(self.damaging, percentage_of_attacks_to_select)
+                selected_attacks = self.select_percentage_of_list(sorted_attacks, percentage_of_attacks_to_select)
                 self.debug(f'Selected {len(selected_attacks)} possible attack(s): {self.debug_display_items(selected_attacks)}')
 
 
@@ -330,13 +486,13 @@ class Combat(Connection):
                     reverse = True
 
 
-                selected_attacks.sort(key=methodcaller('get_turn_avg'), reverse=reverse)
+                selected_attacks.sort(key=attrgetter('turn_avg'), reverse=reverse)
 
                 # Select another % of those attacks (same % as before)
-                # Then randomly select one from this heavily narrowed down list
+                # One is then randomly selected from this heavily narrowed down list in choose_move()
                 # We have narrowed it down so much it is highly unlikely this final list contains more than 1 attack
-                selected_attack = choice(self.select_percentage_of_list(selected_attacks, percentage_of_attacks_to_select))
-                self.debug(f'Selected best suited attack as: {selected_attack.name}')
+                selected_attacks = self.select_percentage_of_list(selected_attacks, percentage_of_attacks_to_select)
+                self.debug(f'Selected best suited attack(s) as: {self.debug_display_items(selected_attacks)}')
                 
                 # Now we have a good attack for the current situation
                 # However we also want to take into account the enemys health
@@ -348,8 +504,8 @@ class Combat(Connection):
                     # Enemy's health is above risk threshold, no need to heal
                     # OR enemy has no heals
                     # Use suitable attack we found earlier
-                    self.debug(f'No need to heal / I have no healing, using attack: {selected_attack.name}')
-                    return selected_attack
+                    self.debug('No need to heal / I have no healing, using attack')
+                    return selected_attacks, []
 
                 # Else - Have lost a % of health that outweighs risk enemy wants to take
                 # So now find healings that would remedy...
@@ -357,27 +513,10 @@ class Combat(Connection):
 
             # !!! Notice the indentation difference, the following will happen even if the enemy never had any attacks !!!
 
-            # We now select a heal as the function would have returned already if a previous condition had been met
+            # We now select heals as the function would have returned already if a previous condition had been met
             likely_perfect_healing_items = self.find_items_likely_to_roll_required(self.healing, self.health_lost())
-            # select a random one (choice is likey from a list of 1 as heals have been narrowed down)
-            selected_heal = choice(likely_perfect_healing_items)
-            self.debug(f'Selected likely perfect heal: {selected_heal.name}')
-            
-
-            if selected_attack:
-                self.debug('Comparing attack to heal to see which is more effective')
-                # Now we have 'the perfect' heal and 'the perfect' attack
-                # Lets compare which one would be more effective, based on the change to the recipients health
-                percentage_change_in_player_health = selected_attack.get_range_avg()/player.max_health
-                percentage_change_in_enemy_health = selected_heal.get_range_avg()/self.max_health
-
-                if percentage_change_in_player_health > percentage_change_in_enemy_health:
-                    self.debug(f'Decided attack is more effective: {selected_attack.name}')
-                    return selected_attack
-
-            # Else there are no attacks or healing is more effective, so return the selected heal (to use)
-            self.debug(f'Decided to use heal (potentially most effective): {selected_heal.name}')
-            return selected_heal
+            self.debug(f'Selected likely perfect heal(s): {self.debug_display_items(likely_perfect_healing_items)}')
+            return selected_attacks, likely_perfect_healing_items
 
         def get_overlapping_items(self, items: list[Combat.Item], health: int):
             '''Return a list of items where the item range overlaps with the `health` passed if the overlap is above self.risk
@@ -396,20 +535,66 @@ class Combat(Connection):
             self.debug('Looking for items that can kill player this turn')
             return self.get_overlapping_items(self.damaging, player.health)
 
-        def get_items_with_max_range_avg(self, items: list[Combat.Item]): # A specific version of the get_items_with_target_method_value() method
-            '''Returns a list of items from `items` where the value of the items' range_avg matches the largest range avg in `items`'''
-            largest_range_avg = self.get_largest_range_avg(items)
-            return [item for item in items if item.get_range_avg() == largest_range_avg]
-        
-        def get_items_with_max_range(self, items: list[Combat.Item]): # A specific version of the get_items_with_target_method_value() method
-            '''Returns a list of items from `items` where the value of the items' range matches the largest range in `items`'''
-            largest_range = self.get_largest_range(items)
-            return [item for item in items if item.get_range() == largest_range]
+        def search_move(self, player: Combat.Player) -> Combat.Item:
+            '''Returns the Item the expectimax search finds has the best expected outcome'''
+            # Used up items stay in the search (with a count of 0), so it only needs rebuilding if an item is added (punch)
+            searched_items = [item for items in self.search_items for item in items]
+            current_items = self.damaging + self.healing + player.damaging + player.healing
+            if self.search is None or any(item not in searched_items for item in current_items):
+                self.search_items = (self.damaging.copy(), self.healing.copy(), player.damaging.copy(), player.healing.copy())
+                self.search = Expectimax(*self.search_items, self.max_health, player.max_health, self.search_max_depth, self.search_time_budget,
+                    node_budget=self.search_node_budget)
+
+            enemy_damaging, enemy_healing, player_damaging, player_healing = self.search_items
+            enemy_items = enemy_damaging + enemy_healing
+            state = (
+                self.health,
+                player.health,
+                0,
+                player.turn_cooldown,
+                tuple(item.count for item in enemy_items),
+                tuple(item.count for item in player_damaging + player_healing)
+            )
+            index = self.search.best_move(state)
+            self.debug(f'Search reached depth {self.search.depth_reached}')
+            if index == -1: # Only the default punch is left, which is always in self.damaging
+                return self.damaging[0]
+            return enemy_items[index]
+
+        def get_decision_key(self, player: Combat.Player):
+            '''Returns a tuple of the game state move_candidates() depends on (cooldowns do not affect it)'''
+            return (
+                self.health, self.max_health, player.health, player.max_health,
+                self.difficulty, self.risk, self.moves_to_predict,
+                tuple(item.get_signature() for item in self.damaging),
+                tuple(item.get_signature() for item in self.healing),
+                tuple(item.get_signature() for item in player.damaging)
+            )
 
         def make_move(self, player: Combat.Player) -> Combat.Item:
             '''This is called everytime the enemy should make a move, 
             it returns an Item from either self.damaging or self.healing to be used'''
-
+            if self.get_difficulty_name() == self.search_difficulty:
+                return self.search_move(player)
+
+            # The candidates only depend on the game state, so they are cached as positions in self.damaging + self.healing
+            # and the random choice between them is made afterwards
+            items = self.damaging + self.healing
+            key = self.get_decision_key(player)
+            candidates = self.decision_cache.get(key)
+            if candidates is None:
+                move, attacks, heals = self.move_candidates(player)
+                candidates = (items.index(move) if move is not None else None, tuple(items.index(item) for item in attacks), tuple(items.index(item) for item in heals))
+                self.decision_cache.put(key, candidates)
+            move_index, attack_indexes, heal_indexes = candidates
+            if move_index is not None:
+                # A kill or an urgent heal, there is nothing to choose between so no random choice is made
+                return items[move_index]
+            return self.choose_move(player, [items[index] for index in attack_indexes], [items[index] for index in heal_indexes])
+
+        def move_candidates(self, player: Combat.Player):
+            '''Returns `tuple: [move, attacks, heals]`, move is the Item to use when there is an attack that can kill the player
+            or a heal is needed. Otherwise it is None and choose_move() picks between the attacks and heals'''
             # Look for attack that can kill player this move, otherwise move on
             possible_kill_attacks = self.can_player_be_killed(player)
             if possible_kill_attacks:
@@ -418,59 +603,28 @@ class Combat(Connection):
                 most_likely_kill_attack = self.get_highest_current_chance(possible_kill_attacks)
                 self.clear_current_chance_attributes(possible_kill_attacks)
                 self.debug(f'Found attack that can kill player this move: {most_likely_kill_attack.name}')
-                return most_likely_kill_attack
+                return most_likely_kill_attack, [], []
             
             if player.damaging:
                 # Find most dangerous attacks to me
                 # These will be the ones with the highest avg dmg, then largest range (to account for worst case)
 
-                max_avg_selections = []
-                max_range_selections = []
-                dangerous_player_items = []
-                player_attacks_count = self.calculate_item_count(player.damaging)
-                moves_to_predict = self.moves_to_predict if player_attacks_count >= self.moves_to_predict else player_attacks_count
-                while self.calculate_item_count(dangerous_player_items) < moves_to_predict:
-                    if not max_range_selections:
-                        if not max_avg_selections:
-                            max_avg_selections = self.get_items_with_max_range_avg(player.damaging)
-                        max_range_selections = self.get_items_with_max_range(max_avg_selections)
-                        max_range_selections.sort(key=methodcaller('get_turn_avg')) #Check if this sorts into the correct way around
-                        
-                    selection = max_range_selections.pop(0)
-                    dangerous_player_items.append(selection)
-                    max_avg_selections.remove(selection)
-                    player.damaging.remove(selection)
-
-                # Player item processing complete, return player items
-                for item in dangerous_player_items:
-                    player.damaging.append(item)
-
-                dangerous_player_items = self.get_n_items(dangerous_player_items, n=self.moves_to_predict)
+                # The player's 'danger' index is already sorted by highest avg dmg, then largest range, then lowest avg cooldown
+                dangerous_player_items = self.get_n_items(player.indexes['danger'].items, n=self.moves_to_predict)
                 self.debug(f"Player items dangerous to me: {self.debug_display_items(dangerous_player_items)}")
 
-                in_range_count = 0
-                if moves_to_predict == 2:
-                    total_possible_count = dangerous_player_items[0].get_range() * dangerous_player_items[1].get_range()
-                    for number in dangerous_player_items[0].range:
-                        for number2 in dangerous_player_items[1].range:
-                            if number + number2 >= self.health:
-                                in_range_count += 1
-                else:
-                    total_possible_count = dangerous_player_items[0].get_range()
-                    for number in dangerous_player_items[0].range:
-                        if number >= self.health:
-                            in_range_count += 1
+                chance_of_dying = chance_of_at_least([item.range for item in dangerous_player_items], self.health)
 
-                self.debug(f'There is a {round(in_range_count/total_possible_count*100)}% chance I die in the next 2 player moves')
-                if in_range_count/total_possible_count > self.risk:
+                self.debug(f'There is a {round(chance_of_dying*100)}% chance I die in the next {len(dangerous_player_items)} player moves')
+                if chance_of_dying > self.risk:
                     # Attempt to heal, when healing we want to find the perfect healing for the situation
                     self.debug(f'Attempting to heal')
                     if self.health_lost() and self.healing:
                         likely_perfect_healing_items = self.find_items_likely_to_roll_required(self.healing, self.health_lost())
                         # Pick the one with lowest avg turns cooldown
-                        heal_to_use = min(likely_perfect_healing_items, key=methodcaller('get_turn_avg')) # the heal to use
+                        heal_to_use = min(likely_perfect_healing_items, key=attrgetter('turn_avg')) # the heal to use
                         self.debug(f'Selected {heal_to_use.name} as the heal to use')
-                        return heal_to_use
+                        return heal_to_use, [], []
                     self.debug('Cannot heal, moving on')
             
             # If this point is reached:
@@ -479,10 +633,11 @@ class Combat(Connection):
             self.debug(f'I cannot kill player next move, player cannot kill me in {self.moves_to_predict} moves (based on risk)')
 
             # --> Normal attack should be carried out
-            return self.normal_move(player)
+            return None, *self.normal_move_candidates(player)
         
     class Player(BaseClass):
         '''The human controlled player in combat'''
+        __slots__ = ('id', 'item_names')
         def __init__(self, player_id: int, name: str, max_health: int, damaging: list[Combat.Item], healing: list[Combat.Item], health=None) -> None:
             super().__init__(name, max_health, damaging, healing, health)
             self.id = player_id
@@ -522,21 +677,25 @@ class Combat(Connection):
 
     ###################################################################################
 
-    def __init__(self, connection: PostgresConnection, cursor: PostgresCursor, player: objects.Player) -> None:
-        super().__init__(connection, cursor)
+    def __init__(self, connection: PostgresConnection, cursor: PostgresCursor, player: objects.Player, pool: AbstractConnectionPool = None) -> None:
+        super().__init__(connection, cursor, pool)
         damaging, healing = self.querier.players.fetch_combat_items(player.id)
+        self.create_instances(player.id, player.name, player.max_health, damaging, healing)
+        self.ouput('Beginning Combat!\n')
+        self.enemy.debug(f'DIFFICULTY: {self.enemy.difficulty} - RISK: {self.enemy.risk}')
+        self.result: objects.CombatResult = self.main()
 
+    def create_instances(self, player_id: int, name: str, max_health: int, damaging: list[objects.CombatItem], healing: list[objects.CombatItem]):
+        '''Creates the player and enemy instances from the players items'''
         # Map returned items to combat items with methods
         damaging = [Combat.Item(item.id, item.name, item.count, item.range, item.turns, item.experience) for item in damaging]
         healing = [Combat.Item(item.id, item.name, item.count, item.range, item.turns, item.experience) for item in healing]
         
         # Create an instance of player and enemy
-        self.player: Combat.Player = self.Player(player.id, player.name, player.max_health, damaging, healing)
-        self.enemy: Combat.Enemy = self.Enemy(self.player, deepcopy(damaging), deepcopy(healing))
+        self.player: Combat.Player = self.Player(player_id, name, max_health, damaging, healing)
+        self.enemy: Combat.Enemy = self.Enemy(self.player, [item.clone() for item in damaging], [item.clone() for item in healing])
         self.instances: list[Combat.BaseClass] = (self.player, self.enemy)
-        print('Beginning Combat!\n')
-        self.enemy.debug(f'DIFFICULTY: {self.enemy.difficulty} - RISK: {self.enemy.risk}')
-        self.main()
+        self.health_history: list[tuple[int, int]] = [(self.player.health, self.enemy.health)]
 
     def ouput(self, text: str):
         print(text)
@@ -591,24 +750,54 @@ Heals\n\
 
     def update_db_items(self, player: Combat.Player):
         '''Updates the players items in the DB to reflect the changes after some were used in Combat'''
+        amounts: dict[int, int] = {}
         for item in player.damaging + player.healing + player.used:
             if item.initial_count != item.count: # Dont unnecessarily update the DB
-                self.querier.players.set_or_delete_player_item(player.id, item.id, item.count)
+                amounts[item.id] = item.count
+        if amounts:
+            self.querier.players.set_or_delete_player_items(player.id, amounts)
+
+    def create_result(self):
+        '''Returns a CombatResult summarising the finished combat'''
+        player, enemy = self.player, self.enemy
+        return objects.CombatResult(
+            'enemy' if enemy.is_alive() else 'player',
+            player.move_number,
+            enemy.move_number,
+            [health[0] for health in self.health_history],
+            [health[1] for health in self.health_history]
+        )
+
+    def player_turn(self):
+        '''The first half of a round, the player moves if they are off cooldown'''
+        if not self.player.on_cooldown():
+            self.display_combat()
+            self.player.use_item(self.player.make_move(), self.enemy)
+
+    def enemy_can_move(self):
+        '''Returns True if the enemy should move this round'''
+        return not self.enemy.on_cooldown() and self.enemy.is_alive() # Enemy may have died on players turn
+
+    def enemy_turn(self, item: Combat.Item = None):
+        '''The second half of a round, the enemy uses `item` or the item it decides on'''
+        self.enemy.use_item(item if item else self.enemy.make_move(self.player), self.player)
+        # self.display_combat()
+
+    def end_round(self):
+        '''Reduces cooldowns and records the health of both instances'''
+        self.reduce_cooldowns()
+        self.health_history.append((self.player.health, self.enemy.health))
 
     def main(self):
         while self.instances_are_alive():
-            if not self.player.on_cooldown():
-                self.display_combat()
-                self.player.use_item(self.player.make_move(), self.enemy)
-
-            if not self.enemy.on_cooldown() and self.enemy.is_alive(): # Enemy may have died on players turn
-                self.enemy.use_item(self.enemy.make_move(self.player), self.player)
-                # self.display_combat()
-
-            self.reduce_cooldowns()
+            self.player_turn()
+            if self.enemy_can_move():
+                self.enemy_turn()
+            self.end_round()
         self.display_winner()
         self.update_db_items(self.player) # Update the db to remove used items
         self.ouput(f'All items used in combat have been removed from {self.player.name}\'s inventory!')
+        return self.create_result()
 
 
 
@@ -0,0 +1,19 @@
+from random import Random
+import objects
+import pytest
+
+def make_random_loadout(rng: Random, fixed: bool = False):
+    '''Returns random (damaging, healing) items. With `fixed` every amount and cooldown is a single value
+    (eg. range(2,2) and range(3,3)), so loadouts often differ only in those and the same game states come up with different items'''
+    def random_range(low: int, high: int):
+        start = rng.randint(low, high)
+        return range(start, start if fixed else rng.randint(start, high))
+    def random_items(first_id: int, number: int, low: int, high: int):
+        return [objects.CombatItem(first_id+index, f'item {first_id+index}', rng.randint(1, 3), random_range(low, high), random_range(1, 4), range(1,2))
+            for index in range(number)]
+    return random_items(1, rng.randint(0, 4), 0, 6), random_items(10, rng.randint(0, 3), 0, 4)
+
+@pytest.fixture
+def random_loadout():
+    '''make_random_loadout(), shared by the tests that play combats'''
+    return make_random_loadout
@@ -1,142 +1,580 @@
 from __future__ import annotations
 from psycopg2.extensions import (connection as PostgresConnection, cursor as PostgresCursor)
-from objects import Item, Ingredient
+from psycopg2.pool import AbstractConnectionPool
+from objects import Ingredient
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
 from collections import Counter
+from itertools import repeat
 from query import Connection
-from psycopg2 import extras
+from io import StringIO
+from os import path
 import psycopg2
+import json
 import csv
+import os
+
+RARITIES = ('legendary', 'mythic', 'epic', 'rare', 'uncommon', 'common') # The valid_rarity constraint on Items
+COMBAT_TYPES = ('damage', 'heal') # Combat needs every range of these types
+
+def is_smallint(value: str):
+    '''Returns True if `value` is a whole number that fits in a SMALLINT column'''
+    try:
+        return -32768 <= int(value) <= 32767
+    except ValueError:
+        return False
+
+def validate_row(row: list[str]):
+    '''Checks a csv row against the constraints of the Items and ConsumableData tables,
+    returning the reason it can not be loaded or None if it is valid'''
+    if any('\ufffd' in value for value in row): # What parse_chunk() decodes bytes that are not UTF-8 to
+        return 'not valid UTF-8'
+    if len(row) < 13:
+        return f'expected 13 columns, found {len(row)}'
+    if not row[0]:
+        return 'missing name'
+    if not row[4]:
+        return 'missing category'
+    if row[2] not in RARITIES:
+        return f'invalid rarity {row[2]!r}'
+    for index, column in ((1, 'value'), (3, 'level')):
+        if not is_smallint(row[index]):
+            return f'{column} {row[index]!r} is not a whole number'
+    if row[5]:
+        for index, column in ((6, 'range'), (8, 'experience'), (10, 'cooldown')):
+            start, stop = row[index], row[index+1]
+            if not start and not stop and row[5] not in COMBAT_TYPES:
+                continue
+            if not (is_smallint(start) and is_smallint(stop)):
+                return f'{column} {start!r}-{stop!r} is not a pair of whole numbers'
+            if int(stop) < int(start):
+                return f'{column} {start}-{stop} ends before it starts'
+    if row[12] and not all(row[12].split(',')):
+        return 'recipe has an empty ingredient name'
+    return None
+
+class ItemRow(NamedTuple):
+    '''A validated csv row, lighter than an Item for passing between processes and writing straight to COPY'''
+    line: int
+    name: str
+    category: str
+    value: int
+    level: int
+    rarity: str
+    type: str | None
+    min_range: int | None
+    max_range: int | None
+    min_experience: int | None
+    max_experience: int | None
+    min_turns: int | None
+    max_turns: int | None
+    recipe: tuple[str, ...] # Ingredient names, repeated for quantities > 1
+
+def parse_row(line: int, row: list[str]):
+    '''Converts a row that passed validate_row() to an ItemRow'''
+    # Indexes:
+    # Name,Value,rarity,level,category,type,R-from,R-to,XP-from,Xp-to,cooldown-from,cooldown-to,Recipe (csv)
+    # 0      1     2      3       4      5     6     7    8       9      10             11          12
+    bounds = [int(value) if row[5] and value else None for value in row[6:12]]
+    return ItemRow(line, row[0], row[4], int(row[1]), int(row[3]), row[2], row[5] or None, *bounds, tuple(row[12].split(',')) if row[12] else ())
+
+def parse_chunk(csv_file: str, start: int, end: int):
+    '''Parses and validates the bytes `start` to `end` of a csv file, which must start and end on a line boundary.
+    Returns `tuple: [rows, rejects, lines]` with line numbers relative to the chunk and the number of lines in it.
+    Run in worker processes by Loader.parse_csv()'''
+    with open(csv_file, 'rb') as file:
+        file.seek(start)
+        text = file.read(end - start).decode(errors='replace') # Rows with bytes that are not UTF-8 are rejected by validate_row()
+    rows: list[ItemRow] = []
+    rejects: list[tuple[int, str, list[str]]] = []
+    reader = csv.reader(StringIO(text, newline=''))
+    for row in reader:
+        if not row: # A blank line, not a row
+            continue
+        reason = validate_row(row)
+        if reason:
+            rejects.append((reader.line_num, reason, row))
+        else:
+            rows.append(parse_row(reader.line_num, row))
+    return rows, rejects, text.count('\n')
+
+def split_csv(csv_file: str, chunks: int):
+    '''Splits a csv file into about `chunks` (start, end) byte ranges, each moved forward to the start of a line.
+    Assumes no quoted field contains a newline, which holds for the game data format'''
+    size = path.getsize(csv_file)
+    offsets = [0]
+    with open(csv_file, 'rb') as file:
+        for chunk in range(1, chunks):
+            file.seek(max(size*chunk//chunks, offsets[-1]))
+            if file.tell():
+                file.readline() # Finish the line the offset landed in
+            offsets.append(min(file.tell(), size))
+    offsets.append(size)
+    return [(start, end) for start, end in zip(offsets, offsets[1:]) if end > start]
 
 class Loader(Connection):
-    '''A class to load game data into the database from a csv file'''
-    def __init__(self, connection: PostgresConnection, cursor: PostgresCursor, csv_path) -> None:
-        super().__init__(connection, cursor)
+    '''A class to load game data into the database from a csv file.
+    Rows are validated up front (invalid rows are written to `<csv_path>.rejects.csv` with their line numbers)
+    and loaded in chunks of `chunk_size`, each in its own transaction. After every chunk a checkpoint is saved to
+    `<csv_path>.checkpoint.json` so a load that fails part way resumes from the last committed chunk when run again'''
+    chunk_size: int = 5000
+    use_checkpoint: bool = True
+    parse_workers: int | None = None # Processes used to parse large files, None is one per core
+    parallel_parse_bytes: int = 4_000_000 # Smaller files are parsed in this process, starting the pool would take longer
+
+    def __init__(self, connection: PostgresConnection, cursor: PostgresCursor, csv_path, pool: AbstractConnectionPool = None) -> None:
+        super().__init__(connection, cursor, pool)
+        self.csv_path = csv_path
+        self.rejects: list[tuple[int, str, list[str]]] = [] # (line number, reason, row)
+        self.lines: dict[str, int] = {} # item name -> line number it was read from
+        self.checkpoint: dict[str, int] = {'items': 0, 'recipes': 0}
         print('\nAttempting to load data from csv...')
         try:
-            self.add_items_from_csv(csv_path)
-            self.add_recipes_from_csv(csv_path)
-        except:
-            print('Some or all of your csv data is invalid!\nAny valid data has been loaded into the databse.')
-
-    def add_ConsumableData_query(self, item_type: str, item_range: range, experience: range, turns: range) -> int:
-        '''Adds a row to the ConsumableData table, returning the generated consumable_id'''
-
-        query = '''INSERT INTO ConsumableData(type, min_range, max_range, min_experience, max_experience, min_turns, max_turns)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-            RETURNING consumable_id;'''
-        item_range.start
-        self.cur.execute(query, (
-            item_type,
-            item_range.start,
-            item_range.stop,
-            experience.start,
-            experience.stop,
-            turns.start,
-            turns.stop))
-        return self.cur.fetchone()[0]
-
-    def add_item_query(self, name: str, category: str, value: int, level: int, rarity: str, description: str = None, emoji: str = None, consumable_id: int = None):
-        '''Adds a row to the Items table, linking the ConsumableData foreign key if provided'''
-
-        query = '''INSERT INTO Items(name, description, emoji, category, value, level, rarity, consumable_id)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s);'''
-        self.cur.execute(query, (name, description, emoji, category, value, level, rarity, consumable_id))
-
-    def push_item(self, item: Item):
-        '''Adds the `item` to the Items table, adding to the coresponding ConsumableData table if necessary'''
-        consumable_id = None
-        try:
-            if item.type:
-                consumable_id = self.add_ConsumableData_query(item.type, item.range, item.experience, item.turns)
-            self.add_item_query(item.name, item.category, item.value, item.level, item.rarity, item.description, item.emoji, consumable_id)
-        except psycopg2.IntegrityError:
-            pass
-
-    def add_items_from_csv(self, csv_file):
-        '''Loop through a csv file of format:
+            self.load_csv(csv_path)
+        except (psycopg2.Error, OSError, ValueError) as error:
+            print(f'Loading stopped by {type(error).__name__}: {error}')
+            if self.use_checkpoint and not isinstance(error, ValueError): # A ValueError would only stop the load again
+                print('Every chunk before the error has been loaded, load the same file again to resume from there.')
+        finally:
+            self.querier.items.invalidate_catalogue()
+            self.write_rejects()
+
+    def parse_csv(self, csv_file):
+        '''Reads every item and recipe from a csv file of format:
         Name,Value,rarity,level,category,type,R-from,R-to,XP-from,Xp-to,cooldown-from,cooldown-to,Recipe (csv)
-        and add each item to the Database
+        returning `tuple: [items, recipes]`, a list of ItemRows and a `dict: [item name, Counter of ingredient names]`
+        for the items that have a recipe. Invalid rows, and repeats of a name, are added to self.rejects instead.
+        Large files are split into chunks that are parsed and validated in a process pool
         '''
-        # Indexes:
-        # Name,Value,rarity,level,category,type,R-from,R-to,XP-from,Xp-to,cooldown-from,cooldown-to,Recipe (csv)
-        # 0      1     2      3       4      5     6     7    8       9      10             11          12
-        with open(csv_file, newline='') as csvfile:
-            file = csv.reader(csvfile)
-            count = 0
-            for row in file:
-                count += 1
-                item_type = row[5]
-                item_range, experience, turns = None, None, None
-                if item_type:
-                    if row[6]:
-                        item_range = range(int(row[6]), int(row[7]))
-                    if row[8]:
-                        experience = range(int(row[8]),int(row[9]))
-                    if row[10]:
-                        turns = range(int(row[10]), int(row[11]))
-                item = Item(
-                    None,
-                    row[0],
-                    row[4],
-                    row[1],
-                    int(row[3]),
-                    row[2],
-                    item_type=item_type,
-                    item_range=item_range,
-                    experience=experience,
-                    turns=turns
-                )
-                self.push_item(item)
-            if count:
-                print(f'Loaded {count} items into the database!')
-
-    def fetch_next_recipe_id(self) -> int:
-        '''Fetch nect recipe_id from id sequence'''
-        query = '''SELECT NEXTVAL('RecipesRecipeIdSequence');'''
-        self.cur.execute(query)
-        return self.cur.fetchone()[0]
-
-    def add_ingredients_querys(self, recipe_id: int, recipe: list[Ingredient]):
-        '''Adds many rows to the Recipes table respresenting each ingredient'''
+        workers = self.parse_workers or os.cpu_count() or 1
+        if workers > 1 and path.getsize(csv_file) >= self.parallel_parse_bytes:
+            chunks = split_csv(csv_file, workers*4) # More chunks than workers to even out the load
+            executor = ProcessPoolExecutor(max_workers=workers)
+            results = executor.map(parse_chunk, repeat(csv_file), *zip(*chunks))
+        else:
+            executor = None
+            results = [parse_chunk(csv_file, 0, path.getsize(csv_file))]
+
+        items: list[ItemRow] = []
+        recipes: dict[str, Counter[str]] = {}
+        line_offset = 0 # Lines in the chunks before this one, to turn chunk line numbers into file line numbers
+        try:
+            for rows, rejects, lines in results: # In file order, so the first use of a name is kept
+                self.rejects.extend((line + line_offset, reason, row) for line, reason, row in rejects)
+                for row in rows:
+                    line = row.line + line_offset
+                    if row.name in self.lines:
+                        self.rejects.append((line, f'duplicate name, first used on line {self.lines[row.name]}', [row.name]))
+                        continue
+                    self.lines[row.name] = line
+                    if row.recipe:
+                        recipes[row.name] = Counter(row.recipe)
+                    items.append(row._replace(line=line))
+                line_offset += lines
+        finally:
+            if executor:
+                executor.shutdown()
+        return items, recipes
+
+    def write_rejects(self):
+        '''Writes the rejected rows to `<csv_path>.rejects.csv` as: line number, reason, the original row'''
+        rejects_path = f'{self.csv_path}.rejects.csv'
+        if not self.rejects:
+            if path.isfile(rejects_path): # From an earlier load, it no longer applies
+                os.remove(rejects_path)
+            return
+        with open(rejects_path, 'w', newline='') as rejects_file:
+            writer = csv.writer(rejects_file)
+            for line_number, reason, row in sorted(self.rejects, key=lambda reject: reject[0]):
+                writer.writerow((line_number, reason, *row))
+        print(f'{len(self.rejects)} rows were rejected, see {rejects_path} for the line numbers and reasons.')
+
+    def checkpoint_path(self):
+        return f'{self.csv_path}.checkpoint.json'
+
+    def file_signature(self):
+        '''Identifies the version of the csv file a checkpoint was made for'''
+        stat = os.stat(self.csv_path)
+        return {'size': stat.st_size, 'modified': stat.st_mtime_ns}
+
+    def read_checkpoint(self):
+        '''Returns how many items and recipes an unfinished load of the same csv file committed,
+        a checkpoint for a file that has since changed is ignored'''
+        checkpoint = {'items': 0, 'recipes': 0}
+        if self.use_checkpoint and path.isfile(self.checkpoint_path()):
+            with open(self.checkpoint_path()) as checkpoint_file:
+                try:
+                    saved = json.load(checkpoint_file)
+                except ValueError:
+                    raise ValueError(f'the checkpoint {self.checkpoint_path()} is corrupt, delete it to load the file from the start')
+            if saved.get('file') == self.file_signature():
+                checkpoint.update(items=saved['items'], recipes=saved['recipes'])
+        return checkpoint
+
+    def save_checkpoint(self):
+        '''Saves self.checkpoint, written to a temporary file first so a crash never leaves half a checkpoint'''
+        if not self.use_checkpoint:
+            return
+        temporary_path = f'{self.checkpoint_path()}.tmp'
+        with open(temporary_path, 'w') as checkpoint_file:
+            json.dump({'file': self.file_signature(), **self.checkpoint}, checkpoint_file)
+        os.replace(temporary_path, self.checkpoint_path())
+
+    def clear_checkpoint(self):
+        '''Removes the checkpoint once the file is fully loaded, only a loader that uses checkpoints may remove one'''
+        if self.use_checkpoint and path.isfile(self.checkpoint_path()):
+            os.remove(self.checkpoint_path())
+
+    def create_items_staging_query(self):
+        '''Creates a temporary table to COPY new items into, it is dropped at the end of the transaction'''
+        query = '''CREATE TEMP TABLE ItemsStaging (
+            name VARCHAR NOT NULL,
+            description VARCHAR,
+            emoji VARCHAR,
+            category VARCHAR NOT NULL,
+            value SMALLINT NOT NULL,
+            level SMALLINT NOT NULL,
+            rarity VARCHAR NOT NULL,
+            consumable_id INT,
+            type VARCHAR,
+            min_range SMALLINT,
+            max_range SMALLINT,
+            min_experience SMALLINT,
+            max_experience SMALLINT,
+            min_turns SMALLINT,
+            max_turns SMALLINT
+        ) ON COMMIT DROP;'''
+        with self.open_cursor() as cur:
+            self.execute(cur, 'create_items_staging', query)
+
+    def copy_items_to_staging_query(self, items: list[ItemRow]):
+        '''Streams the items into the ItemsStaging table with a single COPY'''
+        buffer = StringIO()
+        writer = csv.writer(buffer)
+        for item in items:
+            writer.writerow((item.name, None, None, item.category, item.value, item.level, item.rarity, None, item.type,
+                item.min_range, item.max_range, item.min_experience, item.max_experience, item.min_turns, item.max_turns))
+        buffer.seek(0)
+        query = '''COPY ItemsStaging (name, description, emoji, category, value, level, rarity, consumable_id, type,
+            min_range, max_range, min_experience, max_experience, min_turns, max_turns)
+            FROM STDIN WITH (FORMAT csv);'''
+        with self.open_cursor() as cur:
+            self.copy(cur, 'copy_items_to_staging', query, buffer)
+
+    def insert_staged_items_query(self) -> int:
+        '''Moves the staged items into the ConsumableData and Items tables set-wise, returning the number of items added.
+        Items whose name is already taken are skipped, the rest are given their consumable_id from the identity
+        sequence up front so the two tables can be linked without a round trip per item'''
+        querys = ('''DELETE FROM ItemsStaging
+                USING Items
+                WHERE ItemsStaging.name = Items.name;''',
+            '''UPDATE ItemsStaging
+                SET consumable_id = NEXTVAL(pg_get_serial_sequence('ConsumableData', 'consumable_id'))
+                WHERE type IS NOT NULL;''',
+            '''INSERT INTO ConsumableData(consumable_id, type, min_range, max_range, min_experience, max_experience, min_turns, max_turns)
+                OVERRIDING SYSTEM VALUE
+                SELECT consumable_id, type, min_range, max_range, min_experience, max_experience, min_turns, max_turns
+                FROM ItemsStaging
+                WHERE consumable_id IS NOT NULL;''',
+            '''INSERT INTO Items(name, description, emoji, category, value, level, rarity, consumable_id)
+                SELECT name, description, emoji, category, value, level, rarity, consumable_id
+                FROM ItemsStaging;''')
+        with self.open_cursor() as cur:
+            for name, query in zip(('delete_existing_staged_items', 'assign_staged_consumable_ids', 'insert_staged_consumable_data', 'insert_staged_items'), querys):
+                self.execute(cur, name, query)
+            return cur.rowcount
+
+    def push_items(self, items: list[ItemRow]) -> int:
+        '''Adds all the `items` to the Items (and ConsumableData) tables, returning the number added.
+        Must be called inside transaction() as the staging table is dropped on commit.
+        An item is skipped if its name is already in the Items table, or earlier in `items`'''
+        unique: dict[str, ItemRow] = {}
+        for item in items:
+            unique.setdefault(item.name, item)
+        if not unique:
+            return 0
+        self.create_items_staging_query()
+        self.copy_items_to_staging_query(list(unique.values()))
+        return self.insert_staged_items_query()
+
+    def load_items(self, items: list[ItemRow]) -> int:
+        '''Pushes the items in chunks of chunk_size, committing and checkpointing after each chunk.
+        Returns the number of items added'''
+        count = 0
+        for start in range(self.checkpoint['items'], len(items), self.chunk_size):
+            chunk = items[start:start+self.chunk_size]
+            with self.transaction():
+                count += self.push_items(chunk)
+            self.checkpoint['items'] = start + len(chunk)
+            self.save_checkpoint()
+        return count
+
+    def fetch_next_recipe_ids_query(self, count: int) -> list[int]:
+        '''Fetches the next `count` recipe_ids from the id sequence in one query'''
+        query = '''SELECT NEXTVAL('RecipesRecipeIdSequence')
+            FROM generate_series(1, %s);'''
+        with self.open_cursor() as cur:
+            self.execute(cur, 'fetch_next_recipe_ids', query, (count,))
+            return [row[0] for row in cur.fetchall()]
+
+    def add_ingredients_query(self, rows: list[tuple[int, int, int]]):
+        '''Adds the (recipe_id, item_id, quantity) rows of every recipe to the Recipes table'''
         query = '''INSERT INTO Recipes
             VALUES %s;'''
-        rows = []
-        for ingredient in recipe:
-            rows.append((recipe_id, ingredient.item_id, ingredient.quantity))
-        extras.execute_values(self.cur, query, rows)
+        with self.open_cursor() as cur:
+            self.execute_values(cur, 'add_ingredients', query, rows, page_size=1000)
+
+    def fetch_items_without_recipe_query(self, item_ids: list[int]) -> set[int]:
+        '''Selects (and locks) those of the items that have no recipe yet'''
+        query = '''SELECT item_id
+            FROM Items
+            WHERE item_id = ANY(%s) AND
+            recipe_id IS NULL
+            FOR UPDATE;'''
+        with self.open_cursor() as cur:
+            self.execute(cur, 'fetch_items_without_recipe', query, (item_ids,))
+            return {row[0] for row in cur.fetchall()}
 
-    def add_id_to_item_query(self, recipe_id: int, item_id: int):
-        '''Updates the corresponding row in the Items table with the recipe_id of teh recipe we just added'''
+    def set_recipe_ids_query(self, links: list[tuple[int, int]]):
+        '''Sets the recipe_id of many items in the Items table in one statement, `links` is a list of (item_id, recipe_id)'''
         query = '''UPDATE Items
-            SET recipe_id = %s
-            WHERE item_id = %s;'''
-        self.cur.execute(query, (recipe_id, item_id))
+            SET recipe_id = new.recipe_id
+            FROM (VALUES %s) AS new (item_id, recipe_id)
+            WHERE Items.item_id = new.item_id;'''
+        with self.open_cursor() as cur:
+            self.execute_values(cur, 'set_recipe_ids', query, links, page_size=1000)
 
-    def push_recipe(self, item_id: int, recipe: list[Ingredient]):
-        '''Adds a recipe to a row in the Items table'''
-        recipe_id = self.fetch_next_recipe_id()
-        try:
-            self.add_ingredients_querys(recipe_id, recipe)
-            self.add_id_to_item_query(recipe_id, item_id)
-        except psycopg2.IntegrityError:
-            pass
-
-    def add_recipes_from_csv(self, csv_file):
-        '''Adds recipes to items from a csv file,
-        has to be a separate function as we need the generated ids
-        of the items we previously added to put them in the recipe'''
-        name_id_map = self.querier.items.fetch_name_id_map()
-        with open(csv_file, newline='') as csvfile:
-            file = csv.reader(csvfile)
-            count = 0
-            for row in file:
-                item_name = row[0]
-                if row[12]: #Recipe
-                    count += 1
-                    ingredients = Counter(row[12].split(','))
-                    recipe: list[Ingredient] = []
-                    for item in ingredients:
-                        recipe.append(Ingredient(name_id_map[item], ingredients[item]))
-                    self.push_recipe(name_id_map[item_name], recipe)
-            if count:
-                print(f'Added recipes to {count} Items.')
+    def resolve_recipes(self, recipes: dict[str, Counter[str]], name_id_map: dict[str, int]):
+        '''Swaps the item names in the recipes for their ids, returning a list of (item_id, recipe).
+        Recipes with an ingredient that is not an item are rejected'''
+        resolved: list[tuple[int, list[Ingredient]]] = []
+        for item_name, ingredients in recipes.items():
+            unknown = [ingredient for ingredient in ingredients if ingredient not in name_id_map]
+            if unknown:
+                self.rejects.append((self.lines[item_name], f'item loaded without its recipe, unknown ingredients: {", ".join(unknown)}', []))
+            elif item_name in name_id_map:
+                resolved.append((name_id_map[item_name], [Ingredient(name_id_map[ingredient], quantity) for ingredient, quantity in ingredients.items()]))
+        return resolved
+
+    def push_recipes(self, recipes: list[tuple[int, list[Ingredient]]]) -> int:
+        '''Adds the (item_id, recipe) recipes to the Recipes table and links them to their items,
+        returning the number of items given a recipe.
+        Items that already have a recipe are skipped, so pushing a chunk again (eg. when resuming a load that
+        stopped between its commit and its checkpoint) adds nothing'''
+        if not recipes:
+            return 0
+        without_recipe = self.fetch_items_without_recipe_query([item_id for item_id, _ in recipes])
+        recipes = [(item_id, recipe) for item_id, recipe in recipes if item_id in without_recipe]
+        if not recipes:
+            return 0
+        rows: list[tuple[int, int, int]] = []
+        links: list[tuple[int, int]] = []
+        for recipe_id, (item_id, recipe) in zip(self.fetch_next_recipe_ids_query(len(recipes)), recipes):
+            links.append((item_id, recipe_id))
+            rows.extend((recipe_id, ingredient.item_id, ingredient.quantity) for ingredient in recipe)
+        self.add_ingredients_query(rows)
+        self.set_recipe_ids_query(links)
+        return len(recipes)
+
+    def load_recipes(self, recipes: dict[str, Counter[str]]) -> int:
+        '''Resolves and pushes the recipes in chunks of chunk_size, committing and checkpointing after each chunk.
+        Returns the number of items given a recipe'''
+        resolved = self.resolve_recipes(recipes, self.querier.items.fetch_name_id_map())
+        count = 0
+        for start in range(self.checkpoint['recipes'], len(resolved), self.chunk_size):
+            chunk = resolved[start:start+self.chunk_size]
+            with self.transaction():
+                count += self.push_recipes(chunk)
+            self.checkpoint['recipes'] = start + len(chunk)
+            self.save_checkpoint()
+        return count
+
+    def load_csv(self, csv_file):
+        '''Loads the items and recipes from a csv file (see parse_csv()), reading the file only once.
+        Resumes from the checkpoint of an earlier unfinished load of the same file, if there is one'''
+        items, recipes = self.parse_csv(csv_file)
+        self.checkpoint = self.read_checkpoint()
+        if self.checkpoint['items'] or self.checkpoint['recipes']:
+            print(f"Resuming an earlier load after {self.checkpoint['items']} items and {self.checkpoint['recipes']} recipes...")
+        count = self.load_items(items)
+        if count:
+            print(f'Loaded {count} items into the database!')
+        self.querier.items.invalidate_catalogue() # The recipes need the ids of the new items
+        count = self.load_recipes(recipes)
+        if count:
+            print(f'Added recipes to {count} Items.')
+        self.clear_checkpoint()
+
+class Syncer(Loader):
+    '''Brings the Items, ConsumableData and Recipes tables in line with a csv file (in the same format the Loader reads),
+    matching items by their unique name. Only the differences are written, in one transaction: new items are added,
+    changed items are updated and items no longer in the file are removed (along with any player's stock of them).
+    Items keep their ids, so player inventories of every other item are untouched'''
+    use_checkpoint: bool = False # One transaction, there is never a partial sync to resume
+
+    def fetch_catalogue_query(self):
+        '''Selects (and locks) every item along with its consumable data, as
+            `item_id, name, category, value, level, rarity, recipe_id, consumable_id, type, min_range, max_range, min_experience, max_experience, min_turns, max_turns`'''
+        query = '''SELECT item_id, name, category, value, level, rarity, recipe_id, Items.consumable_id,
+            type, min_range, max_range, min_experience, max_experience, min_turns, max_turns
+            FROM Items
+            LEFT JOIN ConsumableData ON Items.consumable_id = ConsumableData.consumable_id
+            FOR UPDATE OF Items;'''
+        with self.open_cursor() as cur:
+            self.execute(cur, 'sync_fetch_catalogue', query)
+            return cur.fetchall()
+
+    def fetch_recipes_query(self):
+        '''Selects every ingredient of every recipe as `item name, ingredient name, quantity`'''
+        query = '''SELECT Items.name, Ingredients.name, quantity
+            FROM Items
+            INNER JOIN Recipes ON Recipes.recipe_id = Items.recipe_id
+            INNER JOIN Items AS Ingredients ON Ingredients.item_id = Recipes.item_id;'''
+        with self.open_cursor() as cur:
+            self.execute(cur, 'sync_fetch_recipes', query)
+            return cur.fetchall()
+
+    def delete_items_query(self, item_ids: list[int]):
+        '''Deletes the items along with every player's stock of them, their recipes and their consumable data'''
+        querys = (('delete_removed_player_items', '''DELETE FROM PlayerItems
+                WHERE item_id = ANY(%s);'''),
+            ('delete_removed_recipes', '''DELETE FROM Recipes
+                WHERE recipe_id IN (SELECT recipe_id FROM Items WHERE item_id = ANY(%s));'''),
+            ('delete_removed_consumable_data', '''DELETE FROM ConsumableData
+                WHERE consumable_id IN (SELECT consumable_id FROM Items WHERE item_id = ANY(%s));'''),
+            ('delete_removed_items', '''DELETE FROM Items
+                WHERE item_id = ANY(%s);'''))
+        with self.open_cursor() as cur:
+            for name, query in querys:
+                self.execute(cur, name, query, (item_ids,))
+
+    def update_items_query(self, rows: list[tuple[int, str, int, int, str]]):
+        '''Updates many items in one statement, `rows` is a list of (item_id, category, value, level, rarity)'''
+        query = '''UPDATE Items
+            SET category = new.category,
+                value = new.value,
+                level = new.level,
+                rarity = new.rarity
+            FROM (VALUES %s) AS new (item_id, category, value, level, rarity)
+            WHERE Items.item_id = new.item_id;'''
+        with self.open_cursor() as cur:
+            self.execute_values(cur, 'sync_update_items', query, rows, page_size=1000)
+
+    def update_consumable_data_query(self, rows: list[tuple]):
+        '''Updates many rows of ConsumableData in one statement,
+        `rows` is a list of (consumable_id, type, min_range, max_range, min_experience, max_experience, min_turns, max_turns)'''
+        query = '''UPDATE ConsumableData
+            SET type = new.type,
+                min_range = new.min_range::SMALLINT,
+                max_range = new.max_range::SMALLINT,
+                min_experience = new.min_experience::SMALLINT,
+                max_experience = new.max_experience::SMALLINT,
+                min_turns = new.min_turns::SMALLINT,
+                max_turns = new.max_turns::SMALLINT
+            FROM (VALUES %s) AS new (consumable_id, type, min_range, max_range, min_experience, max_experience, min_turns, max_turns)
+            WHERE ConsumableData.consumable_id = new.consumable_id;'''
+        with self.open_cursor() as cur:
+            self.execute_values(cur, 'sync_update_consumable_data', query, rows, page_size=1000)
+
+    def delete_consumable_data_query(self, consumable_ids: list[int]):
+        '''Deletes rows of ConsumableData, the items using them are set back to NULL by the foreign key'''
+        query = '''DELETE FROM ConsumableData
+            WHERE consumable_id = ANY(%s);'''
+        with self.open_cursor() as cur:
+            self.execute(cur, 'sync_delete_consumable_data', query, (consumable_ids,))
+
+    def add_consumable_data_query(self, rows: list[tuple]):
+        '''Adds consumable data to existing items that had none,
+        `rows` is a list of (item_id, type, min_range, max_range, min_experience, max_experience, min_turns, max_turns)'''
+        query = '''WITH new AS (
+                SELECT item_id, NEXTVAL(pg_get_serial_sequence('ConsumableData', 'consumable_id')) AS consumable_id, type,
+                    min_range::SMALLINT, max_range::SMALLINT, min_experience::SMALLINT, max_experience::SMALLINT, min_turns::SMALLINT, max_turns::SMALLINT
+                FROM (VALUES %s) AS data (item_id, type, min_range, max_range, min_experience, max_experience, min_turns, max_turns)
+            ), inserted AS (
+                INSERT INTO ConsumableData(consumable_id, type, min_range, max_range, min_experience, max_experience, min_turns, max_turns)
+                OVERRIDING SYSTEM VALUE
+                SELECT consumable_id, type, min_range, max_range, min_experience, max_experience, min_turns, max_turns
+                FROM new
+            )
+            UPDATE Items
+            SET consumable_id = new.consumable_id
+            FROM new
+            WHERE Items.item_id = new.item_id;'''
+        with self.open_cursor() as cur:
+            self.execute_values(cur, 'sync_add_consumable_data', query, rows, page_size=1000)
+
+    def clear_recipes_query(self, item_ids: list[int]):
+        '''Deletes the recipes of the items and unlinks them, ready for their new recipes to be pushed'''
+        querys = (('sync_delete_recipes', '''DELETE FROM Recipes
+                WHERE recipe_id IN (SELECT recipe_id FROM Items WHERE item_id = ANY(%s));'''),
+            ('sync_unlink_recipes', '''UPDATE Items
+                SET recipe_id = NULL
+                WHERE item_id = ANY(%s);'''))
+        with self.open_cursor() as cur:
+            for name, query in querys:
+                self.execute(cur, name, query, (item_ids,))
+
+    def load_csv(self, csv_file):
+        '''Syncs the catalogue to a csv file (see parse_csv()), rows the file rejects are left as they are in the database'''
+        items, recipes = self.parse_csv(csv_file)
+        rejected: dict[str, int] = {} # Rejected item name -> its line, the items are kept, not deleted
+        for line, _, row in self.rejects:
+            if row:
+                rejected.setdefault(row[0], line)
+        new_items = {item.name: item for item in items}
+        with self.transaction():
+            current = {row[1]: row for row in self.fetch_catalogue_query()}
+            current_recipes: dict[str, Counter[str]] = {}
+            for item_name, ingredient, quantity in self.fetch_recipes_query():
+                current_recipes.setdefault(item_name, Counter())[ingredient] = quantity
+
+            removed = [name for name in current if name not in new_items and name not in rejected]
+            added = [item for name, item in new_items.items() if name not in current]
+            updated, consumables_updated, consumables_added, consumables_removed = [], [], [], []
+            for name, item in new_items.items():
+                if name not in current:
+                    continue
+                row = current[name]
+                fields = (item.category, item.value, item.level, item.rarity)
+                if fields != row[2:6]:
+                    updated.append((row[0], *fields))
+                data = (item.type, item.min_range, item.max_range, item.min_experience, item.max_experience, item.min_turns, item.max_turns)
+                if row[7] is None and item.type:
+                    consumables_added.append((row[0], *data))
+                elif row[7] is not None and not item.type:
+                    consumables_removed.append(row[7])
+                elif row[7] is not None and data != row[8:15]:
+                    consumables_updated.append((row[7], *data))
+
+            # Rebuild the recipes that changed, or that use an item being removed
+            removed_names = set(removed)
+            rebuilt = [name for name in new_items if recipes.get(name) != current_recipes.get(name)
+                or any(ingredient in removed_names for ingredient in current_recipes.get(name, ()))]
+            # An item kept because its row was rejected can not be rebuilt, so a recipe of one that uses a removed item is dropped
+            orphaned = [name for name in rejected if name in current and name not in new_items
+                and any(ingredient in removed_names for ingredient in current_recipes.get(name, ()))]
+            for name in orphaned:
+                missing = [ingredient for ingredient in current_recipes[name] if ingredient in removed_names]
+                self.rejects.append((rejected[name], f'recipe removed, it uses removed items: {", ".join(missing)}', []))
+            cleared = [current[name][0] for name in rebuilt + orphaned if name in current and current[name][6] is not None]
+
+            if cleared:
+                self.clear_recipes_query(cleared)
+            if removed:
+                self.delete_items_query([current[name][0] for name in removed])
+            if updated:
+                self.update_items_query(updated)
+            if consumables_updated:
+                self.update_consumable_data_query(consumables_updated)
+            if consumables_removed:
+                self.delete_consumable_data_query(consumables_removed)
+            if consumables_added:
+                self.add_consumable_data_query(consumables_added)
+            if added:
+                self.push_items(added)
+            # Read inside the transaction so the ids of the items just added are visible
+            name_id_map = {row[1]: row[0] for row in self.fetch_catalogue_query()}
+            recipe_count = self.push_recipes(self.resolve_recipes({name: recipes[name] for name in rebuilt if name in recipes}, name_id_map))
+
+        print(f'Synced the catalogue: {len(added)} items added, {len(updated)} updated, {len(removed)} removed, '
+            f'{len(consumables_added) + len(consumables_updated) + len(consumables_removed)} consumable data changed, {recipe_count} recipes rebuilt.')
@@ -1,4 +1,7 @@
 from dotenv import load_dotenv
+from query import BaseConnection, BlockingConnectionPool
+from memory import MemoryStore
+from stats import QueryStats
 from menu import MainMenu
 from os import getenv
 import psycopg2
@@ -9,22 +12,32 @@ if __name__ == '__main__':
     db_pass = getenv('DB_PASS')
     db_name = getenv('DB_NAME')
     db_host = getenv('DB_HOST')
+    db_pool_size = int(getenv('DB_POOL_SIZE', 10))
+    BaseConnection.use_prepared_statements = getenv('DB_PREPARED_STATEMENTS', '').lower() in ('1', 'true')
+    if getenv('DB_QUERY_STATS', '').lower() in ('1', 'true'):
+        BaseConnection.query_stats = QueryStats()
 
+    if getenv('DB_BACKEND', 'postgres').lower() == 'memory':
+        # Everything is kept in process and lost on exit, no Postgres server is needed
+        print('Using the in-memory backend...')
+        MainMenu(MemoryStore(), None)
+        exit()
+
+    pool = None
     try:
-        connection = psycopg2.connect(user=db_username,
+        pool = BlockingConnectionPool(1, db_pool_size,
+            user=db_username,
             password=db_pass,
             host=db_host,
             database=db_name)
-        connection.set_session(autocommit=True)
-        cursor = connection.cursor()
 
-        print('PostgreSQL connection opened...')
-        MainMenu(connection, cursor)
+        print('PostgreSQL connection pool opened...')
+        # There is no session connection, every query borrows a connection from the pool for as long as it needs one
+        MainMenu(None, None, pool)
 
     except (Exception, psycopg2.Error) as error:
         print(f"Error: {type(error).__name__}", error)
     finally:
-        if connection:
-            cursor.close()
-            connection.close()
-            print('\nPostgreSQL connection closed.')
\ No newline at end of file
+        if pool:
+            pool.closeall()
+            print('\nPostgreSQL connection pool closed.')
@@ -0,0 +1,260 @@
+from __future__ import annotations
+from query import BaseConnection, Catalogue, Items, Players, Querier
+from contextlib import contextmanager
+from itertools import count
+from load import ItemRow, Loader, Syncer
+from setup import Setup
+
+class MemoryStore:
+    '''An in-process stand-in for the Postgres database, pass it in place of the psycopg2 connection.
+    Each table is a dict keyed by its primary key, rows are dicts of column -> value'''
+    def __init__(self) -> None:
+        self.clear()
+
+    def clear(self):
+        '''Drops all the data, the equivalent of Setup on Postgres'''
+        self.players: dict[int, dict] = {}
+        self.player_items: dict[int, dict[int, int]] = {} # player_id -> {item_id: quantity}
+        self.items: dict[int, dict] = {}
+        self.item_names: dict[str, int] = {} # The unique index on Items(name)
+        self.consumable_data: dict[int, dict] = {}
+        self.recipes: dict[int, dict[int, int]] = {} # recipe_id -> {item_id: quantity}
+        self.player_ids = count(1)
+        self.item_ids = count(1)
+        self.consumable_ids = count(1)
+        self.recipe_ids = count(1)
+        self.catalogue = Catalogue() # Each store has its own, so stores never see each others items
+
+class MemoryConnection(BaseConnection):
+    '''Mixin that points the query methods at a MemoryStore instead of a DB'''
+    @property
+    def store(self) -> MemoryStore:
+        '''The MemoryStore is passed around in place of the DB connection'''
+        return self.conn
+
+    @contextmanager
+    def transaction(self):
+        '''The store is only changed by plain dict operations, which are applied immediately'''
+        yield None
+
+class MemoryQuerier(MemoryConnection, Querier):
+    '''A Querier backed by a MemoryStore'''
+    def __init__(self, connection: MemoryStore, cursor: None, pool: None = None) -> None:
+        BaseConnection.__init__(self, connection, cursor, pool)
+        self.items = MemoryItems(connection, cursor, pool)
+        self.players = MemoryPlayers(connection, cursor, pool)
+
+class MemoryItems(MemoryConnection, Items):
+    '''Items backed by a MemoryStore'''
+    @property
+    def catalogue(self):
+        return self.store.catalogue
+
+    def invalidate_catalogue(self):
+        '''Drops the store's cached catalogue'''
+        self.store.catalogue.invalidate()
+
+    def _fetch_catalogue_query(self):
+        rows = []
+        for item_id in sorted(self.store.items):
+            item = self.store.items[item_id]
+            data = self.store.consumable_data.get(item['consumable_id'], {})
+            rows.append((item_id, item['name'], item['category'], item['value'], item['level'], item['rarity'], item['description'], item['emoji'],
+                data.get('type'), data.get('min_range'), data.get('max_range'), data.get('min_experience'), data.get('max_experience'), data.get('min_turns'), data.get('max_turns')))
+        return rows
+
+    def iter_items(self, itersize: int = 2000):
+        '''There is no server-side cursor to stream from, so this reads the store's catalogue instead'''
+        return iter(self.load_catalogue().items.values())
+
+class MemoryPlayers(MemoryConnection, Players):
+    '''Players backed by a MemoryStore'''
+    def player_row(self, player: dict):
+        return (player['player_id'], player['name'], player['max_health'], player['coins'], player['energy'], player['experience'])
+
+    def _add_player_query(self, player_name: str):
+        player = {'player_id': next(self.store.player_ids), 'name': player_name, 'max_health': 10, 'coins': 1000, 'energy': 0, 'experience': 0}
+        self.store.players[player['player_id']] = player
+        return self.player_row(player)
+
+    def _delete_player_query(self, player_id: int):
+        self.store.players.pop(int(player_id), None)
+
+    def _fetch_player_query(self, player_id: int):
+        player = self.store.players.get(int(player_id))
+        return self.player_row(player) if player else None
+
+    def _fetch_players_query(self):
+        return [self.player_row(player) for player in self.store.players.values()]
+
+    def _fetch_players_page_query(self, after_id: int, limit: int):
+        player_ids = sorted(player_id for player_id in self.store.players if player_id > after_id)[:limit]
+        return [self.player_row(self.store.players[player_id]) for player_id in player_ids]
+
+    def stream_players(self, itersize: int = 2000):
+        '''There is no server-side cursor to stream from, so this pages through the store instead'''
+        return self.iter_players(itersize)
+
+    def _fetch_player_items_query(self, player_id):
+        items = self.store.player_items.get(int(player_id), {})
+        return [(item_id, self.store.items[item_id]['name'], quantity) for item_id, quantity in items.items() if item_id in self.store.items]
+
+    def _fetch_player_items_page_query(self, player_id: int, after_item_id: int, limit: int):
+        items = self.store.player_items.get(int(player_id), {})
+        item_ids = sorted(item_id for item_id in items if item_id > after_item_id and item_id in self.store.items)[:limit]
+        return [(item_id, self.store.items[item_id]['name'], items[item_id]) for item_id in item_ids]
+
+    def stream_player_items(self, player_id: int, itersize: int = 2000):
+        '''There is no server-side cursor to stream from, so this pages through the store instead'''
+        return self.iter_player_items(player_id, itersize)
+
+    def _delete_player_item_query(self, player_id: int, item_id: int):
+        self.store.player_items.get(int(player_id), {}).pop(int(item_id), None)
+
+    def _set_player_item_query(self, player_id: int, item_id: int, amount: int):
+        items = self.store.player_items.get(int(player_id), {})
+        if int(item_id) in items:
+            items[int(item_id)] = int(amount)
+
+    def _set_player_items_query(self, player_id: int, amounts: list[tuple[int, int]]):
+        for item_id, amount in amounts:
+            self._set_player_item_query(player_id, item_id, amount)
+
+    def _delete_player_items_query(self, player_id: int, item_ids: list[int]):
+        for item_id in item_ids:
+            self._delete_player_item_query(player_id, item_id)
+
+    def _upsert_player_item_query(self, player_id: int, item_id: int, amount: int):
+        items = self.store.player_items.setdefault(int(player_id), {})
+        items[int(item_id)] = items.get(int(item_id), 0) + int(amount)
+        return (items[int(item_id)],)
+
+    def _grant_player_items_query(self, grants: list[tuple[int, int, int]]):
+        return [(player_id, item_id, self._upsert_player_item_query(player_id, item_id, amount)[0]) for player_id, item_id, amount in grants]
+
+    def _fetch_combat_items_query(self, player_id: int):
+        rows = []
+        for item_id, quantity in self.store.player_items.get(int(player_id), {}).items():
+            item = self.store.items.get(item_id)
+            data = self.store.consumable_data.get(item['consumable_id']) if item else None
+            if data and data['type'] in ('damage', 'heal'):
+                rows.append((data['type'], item_id, item['name'], quantity, data['min_range'], data['max_range'],
+                    data['min_turns'], data['max_turns'], data['min_experience'], data['max_experience']))
+        return rows
+
+class MemorySetup(MemoryConnection, Setup):
+    '''Setup for a MemoryStore, there are no tables to create so it just clears the store'''
+    def clear_previous_tables(self):
+        self.store.clear()
+
+    def create_player_items_table(self):
+        pass
+
+    def create_player_table(self):
+        pass
+
+    def create_game_data_tables(self):
+        pass
+
+    def create_indexes(self):
+        pass
+
+class MemoryLoader(MemoryConnection, Loader):
+    '''Loads game data from a csv file into a MemoryStore'''
+    use_checkpoint: bool = False # The store does not outlive the process, so there is never a load to resume
+    def add_consumable_data(self, item_type: str, bounds: tuple[int | None, ...]) -> int:
+        '''Adds consumable data, `bounds` are (min_range, max_range, min_experience, max_experience, min_turns, max_turns).
+        Returns the new consumable_id'''
+        consumable_id = next(self.store.consumable_ids)
+        columns = ('min_range', 'max_range', 'min_experience', 'max_experience', 'min_turns', 'max_turns')
+        self.store.consumable_data[consumable_id] = {'type': item_type, **dict(zip(columns, bounds))}
+        return consumable_id
+
+    def create_items_staging_query(self):
+        '''The staging table is just a list on the loader'''
+        self.staged: list[ItemRow] = []
+
+    def copy_items_to_staging_query(self, items: list[ItemRow]):
+        self.staged.extend(items)
+
+    def insert_staged_items_query(self) -> int:
+        count = 0
+        for item in self.staged:
+            if item.name in self.store.item_names: # Matches the UNIQUE constraint on Items(name)
+                continue
+            consumable_id = None
+            if item.type:
+                consumable_id = self.add_consumable_data(item.type, (item.min_range, item.max_range, item.min_experience, item.max_experience, item.min_turns, item.max_turns))
+            item_id = next(self.store.item_ids)
+            self.store.items[item_id] = {'item_id': item_id, 'name': item.name, 'description': None, 'emoji': None, 'category': item.category,
+                'value': item.value, 'level': item.level, 'rarity': item.rarity, 'recipe_id': None, 'consumable_id': consumable_id}
+            self.store.item_names[item.name] = item_id
+            count += 1
+        self.staged = []
+        return count
+
+    def fetch_next_recipe_ids_query(self, count: int) -> list[int]:
+        return [next(self.store.recipe_ids) for _ in range(count)]
+
+    def add_ingredients_query(self, rows: list[tuple[int, int, int]]):
+        for recipe_id, item_id, quantity in rows:
+            self.store.recipes.setdefault(recipe_id, {})[item_id] = quantity
+
+    def fetch_items_without_recipe_query(self, item_ids: list[int]) -> set[int]:
+        return {item_id for item_id in item_ids if self.store.items[item_id]['recipe_id'] is None}
+
+    def set_recipe_ids_query(self, links: list[tuple[int, int]]):
+        for item_id, recipe_id in links:
+            self.store.items[item_id]['recipe_id'] = recipe_id
+
+class MemorySyncer(MemoryLoader, Syncer):
+    '''Syncs the catalogue in a MemoryStore to a csv file'''
+    def fetch_catalogue_query(self):
+        rows = []
+        for item_id, item in self.store.items.items():
+            data = self.store.consumable_data.get(item['consumable_id'], {})
+            rows.append((item_id, item['name'], item['category'], item['value'], item['level'], item['rarity'], item['recipe_id'], item['consumable_id'],
+                data.get('type'), data.get('min_range'), data.get('max_range'), data.get('min_experience'), data.get('max_experience'), data.get('min_turns'), data.get('max_turns')))
+        return rows
+
+    def fetch_recipes_query(self):
+        rows = []
+        for item in self.store.items.values():
+            for ingredient_id, quantity in self.store.recipes.get(item['recipe_id'], {}).items():
+                rows.append((item['name'], self.store.items[ingredient_id]['name'], quantity))
+        return rows
+
+    def delete_items_query(self, item_ids: list[int]):
+        for items in self.store.player_items.values():
+            for item_id in item_ids:
+                items.pop(item_id, None)
+        for item_id in item_ids:
+            item = self.store.items.pop(item_id)
+            del self.store.item_names[item['name']]
+            self.store.recipes.pop(item['recipe_id'], None)
+            self.store.consumable_data.pop(item['consumable_id'], None)
+
+    def update_items_query(self, rows: list[tuple[int, str, int, int, str]]):
+        for item_id, category, value, level, rarity in rows:
+            self.store.items[item_id].update(category=category, value=value, level=level, rarity=rarity)
+
+    def update_consumable_data_query(self, rows: list[tuple]):
+        columns = ('type', 'min_range', 'max_range', 'min_experience', 'max_experience', 'min_turns', 'max_turns')
+        for consumable_id, *data in rows:
+            self.store.consumable_data[consumable_id] = dict(zip(columns, data))
+
+    def delete_consumable_data_query(self, consumable_ids: list[int]):
+        for consumable_id in consumable_ids:
+            del self.store.consumable_data[consumable_id]
+        for item in self.store.items.values(): # ON DELETE SET NULL
+            if item['consumable_id'] in consumable_ids:
+                item['consumable_id'] = None
+
+    def add_consumable_data_query(self, rows: list[tuple]):
+        for item_id, item_type, *bounds in rows:
+            self.store.items[item_id]['consumable_id'] = self.add_consumable_data(item_type, bounds)
+
+    def clear_recipes_query(self, item_ids: list[int]):
+        for item_id in item_ids:
+            self.store.recipes.pop(self.store.items[item_id]['recipe_id'], None)
+            self.store.items[item_id]['recipe_id'] = None
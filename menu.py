@@ -1,15 +1,18 @@
 from psycopg2.extensions import (connection as PostgresConnection, cursor as PostgresCursor)
+from psycopg2.pool import AbstractConnectionPool
 from difflib import get_close_matches
-from query import Connection
+from memory import MemoryStore, MemorySetup, MemoryLoader, MemorySyncer
+from query import BaseConnection, Connection
+from stats import QueryStats
 from combat import Combat
-from load import Loader
+from load import Loader, Syncer
 from setup import Setup
 from os import path
 
 class Menu(Connection):
     '''Class for common menu methods'''
-    def __init__(self, connection: PostgresConnection, cursor: PostgresCursor) -> None:
-        super().__init__(connection, cursor)
+    def __init__(self, connection: PostgresConnection, cursor: PostgresCursor, pool: AbstractConnectionPool = None) -> None:
+        super().__init__(connection, cursor, pool)
 
     def create_menu_options(self, options: dict[str, any]):
         '''Create a menu from the list of options, returning the corresponding function'''
@@ -40,32 +43,44 @@ class Menu(Connection):
 
 class SetupMenu(Menu):
     '''actions relating to setting up the database'''
-    def __init__(self, connection: PostgresConnection, cursor: PostgresCursor) -> None:
-        super().__init__(connection, cursor)
+    def __init__(self, connection: PostgresConnection, cursor: PostgresCursor, pool: AbstractConnectionPool = None) -> None:
+        super().__init__(connection, cursor, pool)
         options = {
             'Setup': self.setup,
             'Load': self.load,
+            'Sync': self.sync,
             'Back': self.back
         }
         self.create_menu_options(options)()
 
     def setup(self):
         '''sets up the Databse with all appropriate tables, dropping all existing tables beforehand'''
-        Setup(self.conn, self.cur)
+        setup = MemorySetup if isinstance(self.conn, MemoryStore) else Setup
+        setup(self.conn, self.cur, self.pool)
         print('\nDatabase setup successfully!')
     
     def load(self):
         '''loads items into the database from a csv file'''
         csv_path = input('Please enter the path to the csv file: ')
         if csv_path.endswith('.csv') and path.isfile(csv_path):
-            Loader(self.conn, self.cur, csv_path)
+            loader = MemoryLoader if isinstance(self.conn, MemoryStore) else Loader
+            loader(self.conn, self.cur, csv_path, self.pool)
+            return
+        print('That file is not csv or does not exist!')
+
+    def sync(self):
+        '''updates the items to match a csv file, keeping player data'''
+        csv_path = input('Please enter the path to the csv file: ')
+        if csv_path.endswith('.csv') and path.isfile(csv_path):
+            syncer = MemorySyncer if isinstance(self.conn, MemoryStore) else Syncer
+            syncer(self.conn, self.cur, csv_path, self.pool)
             return
         print('That file is not csv or does not exist!')
 
 class PlayerMenu(Menu):
     '''actions relating to Player objects'''
-    def __init__(self, connection: PostgresConnection, cursor: PostgresCursor) -> None:
-        super().__init__(connection, cursor)
+    def __init__(self, connection: PostgresConnection, cursor: PostgresCursor, pool: AbstractConnectionPool = None) -> None:
+        super().__init__(connection, cursor, pool)
         options = {
             'Add': self.add,
             'Remove': self.remove,
@@ -92,12 +107,13 @@ class PlayerMenu(Menu):
     def player_list(self):
         '''displays all current players in the database'''
         print('\nAll Players:')
-        print('\n'.join([f'{player.id}:{player.name}' for player in self.querier.players.fetch_players()]))
+        for player in self.querier.players.iter_players():
+            print(f'{player.id}:{player.name}')
 
 class InventoryMenu(Menu):
     '''actions relating to Player Inventories'''
-    def __init__(self, connection: PostgresConnection, cursor: PostgresCursor) -> None:
-        super().__init__(connection, cursor)
+    def __init__(self, connection: PostgresConnection, cursor: PostgresCursor, pool: AbstractConnectionPool = None) -> None:
+        super().__init__(connection, cursor, pool)
         options = {
             'View': self.view,
             'Add': self.add,
@@ -111,44 +127,42 @@ class InventoryMenu(Menu):
         player = self.request_player_id()
         if player:
             print(f"\n{player.name}'s Items:")
-            print('\n'.join([f'{item.name} x{item.count}' for item in self.querier.players.fetch_player_items(player.id)]))
+            for item in self.querier.players.iter_player_items(player.id):
+                print(f'{item.name} x{item.count}')
 
     def _get_player_and_item(self):
-        '''Prompts the user for a player id and an item,
-            also returns a name_id_map to save us fetching it again'''
+        '''Prompts the user for a player id and an item'''
         player = self.request_player_id()
         if player:
             name_or_id = input('Enter an item name or id: ')
-            name_id_map = self.querier.items.fetch_name_id_map()
-            item_id = self.querier.items.get_item_id(name_id_map, name_or_id)
+            item_id = self.querier.items.get_item_id(self.querier.items.load_catalogue(), name_or_id)
             if item_id:
-                return name_id_map, player, item_id
+                return player, item_id
             print('Invalid item name or id!')
-            return name_id_map, player, None
-        return None, None, None
+            return player, None
+        return None, None
 
     def add(self):
         '''adds/updates an item to/in a Players inventory'''
-        name_id_map, player, item_id = self._get_player_and_item()
+        player, item_id = self._get_player_and_item()
         if player and item_id:
             amount = input('Enter an amount: ')
             while not amount.isdigit():
                 amount = input('Invalid input, try again: ')
-            id_name_map = {b: a for a, b in name_id_map.items()} #Reverse the name_id_map so we can recover the name
-            print(f"\n'{player.name}' now has '{id_name_map[item_id]}' x{self.querier.players.update_player_item(player.id, item_id, amount)}")
+            item_name = self.querier.items.fetch_id_name_map()[item_id]
+            print(f"\n'{player.name}' now has '{item_name}' x{self.querier.players.update_player_item(player.id, item_id, amount)}")
 
     def delete(self):
         '''deletes an entry from a players inventory (if present)'''
-        name_id_map, player, item_id = self._get_player_and_item()
+        player, item_id = self._get_player_and_item()
         if player and item_id:
-            id_name_map = {b: a for a, b in name_id_map.items()} #Reverse the name_id_map so we can recover the name
             self.querier.players.delete_player_item(player.id, item_id)
-            print(f"\nRemoved all '{id_name_map[item_id]}' items from player '{player.name}'")
+            print(f"\nRemoved all '{self.querier.items.fetch_id_name_map()[item_id]}' items from player '{player.name}'")
 
 class ItemMenu(Menu):
     '''actions relating to Item objects'''
-    def __init__(self, connection: PostgresConnection, cursor: PostgresCursor) -> None:
-        super().__init__(connection, cursor)
+    def __init__(self, connection: PostgresConnection, cursor: PostgresCursor, pool: AbstractConnectionPool = None) -> None:
+        super().__init__(connection, cursor, pool)
         options = {
             'List': self.item_list,
             'Back': self.back
@@ -158,25 +172,66 @@ class ItemMenu(Menu):
     def item_list(self):
         '''displays all current items in the database'''
         print('\nAll Items:')
-        print('\n'.join([f'{item.id}:{item.name}' for item in self.querier.items.fetch_items()]))
+        for item in self.querier.items.iter_items():
+            print(f'{item.id}:{item.name}')
 
 class CombatMenu(Menu):
     '''start a Combat instance'''
-    def __init__(self, connection: PostgresConnection, cursor: PostgresCursor) -> None:
-        super().__init__(connection, cursor)
+    def __init__(self, connection: PostgresConnection, cursor: PostgresCursor, pool: AbstractConnectionPool = None) -> None:
+        super().__init__(connection, cursor, pool)
         player = self.request_player_id()
         if player:
-            Combat(connection, cursor, player)
+            Combat(connection, cursor, player, pool)
+
+class StatsMenu(Menu):
+    '''view timings of the queries made'''
+    def __init__(self, connection: PostgresConnection, cursor: PostgresCursor, pool: AbstractConnectionPool = None) -> None:
+        super().__init__(connection, cursor, pool)
+        options = {
+            'View': self.view,
+            'Dump': self.dump,
+            'Reset': self.reset,
+            'Toggle': self.toggle,
+            'Back': self.back
+        }
+        self.create_menu_options(options)()
+
+    def view(self):
+        '''displays the calls, rows and latency of each query'''
+        if not BaseConnection.query_stats:
+            print('\nQuery stats are not being recorded, use Toggle (or set DB_QUERY_STATS=1) to start recording them')
+            return
+        print(f'\n{BaseConnection.query_stats.report()}')
+
+    def dump(self):
+        '''saves the query stats to a json file'''
+        if not BaseConnection.query_stats:
+            print('\nQuery stats are not being recorded!')
+            return
+        json_path = input('Please enter the path to save the json file to: ')
+        BaseConnection.query_stats.dump(json_path)
+        print(f'\nSaved query stats to {json_path}')
+
+    def reset(self):
+        '''clears the recorded query stats'''
+        if BaseConnection.query_stats:
+            BaseConnection.query_stats.reset()
+        print('\nQuery stats cleared.')
+
+    def toggle(self):
+        '''starts/stops recording query stats'''
+        BaseConnection.query_stats = None if BaseConnection.query_stats else QueryStats()
+        print(f"\nQuery stats are {'now' if BaseConnection.query_stats else 'no longer'} being recorded.")
 
 class QuitMenu(Menu):
     '''exit the program'''
-    def __init__(self, connection: PostgresConnection, cursor: PostgresCursor) -> None:
-        super().__init__(connection, cursor)
+    def __init__(self, connection: PostgresConnection, cursor: PostgresCursor, pool: AbstractConnectionPool = None) -> None:
+        super().__init__(connection, cursor, pool)
         exit()
 
 class MainMenu(Menu):
-    def __init__(self, connection: PostgresConnection, cursor: PostgresCursor) -> None:
-        super().__init__(connection, cursor)
+    def __init__(self, connection: PostgresConnection, cursor: PostgresCursor, pool: AbstractConnectionPool = None) -> None:
+        super().__init__(connection, cursor, pool)
         # Display the main menu
         options = {
             'Setup': SetupMenu,
@@ -184,7 +239,8 @@ class MainMenu(Menu):
             'Inventory': InventoryMenu,
             'Items': ItemMenu,
             'Combat': CombatMenu,
+            'Stats': StatsMenu,
             'Quit': QuitMenu
         }
         while True:
-            self.create_menu_options(options)(self.conn, self.cur) #All menus take these params
\ No newline at end of file
+            self.create_menu_options(options)(self.conn, self.cur, self.pool) #All menus take these params
\ No newline at end of file
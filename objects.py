@@ -1,5 +1,6 @@
 class CombatItem:
     '''Class representation of a combat item'''
+    __slots__ = ('id', 'name', 'count', 'range', 'turns', 'experience')
     def __init__(self, item_id: int, name: str, count: int, item_range: range, turns: range, experience: range) -> None:
         self.id = item_id
         self.name = name
@@ -8,6 +9,23 @@ class CombatItem:
         self.turns = turns
         self.experience = experience
 
+    def clone(self):
+        '''Returns a copy of the item, ranges are immutable so they can be shared'''
+        return type(self)(self.id, self.name, self.count, self.range, self.turns, self.experience)
+
+# The default attack Combat.BaseClass.ensure_move_available gives an instance with no items left,
+# the search (search.py) and batch.py model it from this too
+PUNCH = CombatItem(None, 'punch', 1, range(1,2), range(2,2), range(0,0))
+
+class CombatResult:
+    '''Class representation of the outcome of a combat'''
+    def __init__(self, winner: str, player_moves: int, enemy_moves: int, player_health: list[int], enemy_health: list[int]) -> None:
+        self.winner = winner
+        self.player_moves = player_moves
+        self.enemy_moves = enemy_moves
+        self.player_health = player_health # Health at the end of each round, starting with the initial health
+        self.enemy_health = enemy_health
+
 class PlayerItem:
     '''Class representation of a player item'''
     def __init__(self, item_id: int, name: str, quantity: int) -> None:
@@ -33,6 +51,7 @@ class Ingredient:
 
 class ConsumableData:
     '''Class representation of Item consumable data'''
+    __slots__ = ('type', 'range', 'experience', 'turns')
     def __init__(self,
         item_type: str = None,
         item_range: range = None,
@@ -49,7 +68,8 @@ class ConsumableData:
             self.turns = turns
 
 class Item(ConsumableData):
-    '''Class representation of an Item'''          
+    '''Class representation of an Item'''
+    __slots__ = ('id', 'name', 'description', 'emoji', 'category', 'value', 'level', 'rarity')
     def __init__(self,
             item_id: int,
             name: str,
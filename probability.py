@@ -0,0 +1,22 @@
+from __future__ import annotations
+from itertools import accumulate
+
+def roll_distribution(ranges: list[range]):
+    '''Returns the distribution of the total rolled when rolling every range in `ranges` once,
+    each roll is a uniform integer between range.start and range.stop (inclusive, matching Combat.Item.roll_amount).
+    Returns `tuple: [lowest_total, probabilities]` where probabilities[i] is the chance of rolling lowest_total + i'''
+    lowest_total = 0
+    probabilities = [1.0]
+    for item_range in ranges:
+        width = item_range.stop - item_range.start + 1
+        lowest_total += item_range.start
+        # Convolving with a uniform distribution is a sliding window sum, so use prefix sums
+        prefix = [0.0, *accumulate(probabilities)]
+        length = len(probabilities)
+        probabilities = [(prefix[min(i+1, length)] - prefix[max(0, i-width+1)])/width for i in range(length+width-1)]
+    return lowest_total, probabilities
+
+def chance_of_at_least(ranges: list[range], value: int):
+    '''Returns a float between 0 and 1 denoting the chance the total rolled from `ranges` is >= `value`'''
+    lowest_total, probabilities = roll_distribution(ranges)
+    return min(1.0, sum(probabilities[max(0, value-lowest_total):]))
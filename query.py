@@ -1,82 +1,331 @@
 from __future__ import annotations
 from psycopg2.extensions import (connection as PostgresConnection, cursor as PostgresCursor)
 from objects import CombatItem, Item, Player, PlayerItem
+from psycopg2.pool import AbstractConnectionPool, PoolError, ThreadedConnectionPool
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from stats import QueryStats
+from collections import Counter
+from itertools import count
+from threading import BoundedSemaphore, Lock
+from weakref import WeakKeyDictionary
+from psycopg2 import extras
+import psycopg2
+import re
+
+def to_positional_params(query: str):
+    '''Converts the %s placeholders psycopg2 uses into the $1, $2... placeholders PREPARE needs'''
+    count = 0
+    def replace(match: re.Match):
+        nonlocal count
+        count += 1
+        return f'${count}'
+    return re.sub(r'(?<!%)%s', replace, query).replace('%%', '%')
+
+class BlockingConnectionPool(ThreadedConnectionPool):
+    '''A ThreadedConnectionPool whose getconn() waits for a connection to be put back when all `maxconn` are in use,
+    instead of raising PoolError straight away. It only raises once `timeout` seconds have passed (if one is given)'''
+    def __init__(self, minconn: int, maxconn: int, *args, timeout: float | None = None, **kwargs) -> None:
+        super().__init__(minconn, maxconn, *args, **kwargs)
+        self.available = BoundedSemaphore(maxconn)
+        self.timeout = timeout
+
+    def getconn(self, key=None):
+        if not self.available.acquire(timeout=self.timeout):
+            raise PoolError(f'no connection was put back within {self.timeout}s')
+        try:
+            return super().getconn(key)
+        except BaseException:
+            self.available.release()
+            raise
+
+    def putconn(self, conn=None, key=None, close=False):
+        super().putconn(conn, key, close)
+        self.available.release()
 
 class BaseConnection:
-    '''Base class for only a DB connection and cursor'''
-    def __init__(self, connection: PostgresConnection, cursor: PostgresCursor) -> None:
+    '''Base class for only a DB connection and cursor, optionally backed by a connection pool'''
+    # When True, queries run through execute() are prepared once per connection and then EXECUTEd
+    use_prepared_statements: bool = False
+    # Names of the statements prepared on each connection, entries go when the connection is garbage collected
+    prepared: WeakKeyDictionary[PostgresConnection, set[str]] = WeakKeyDictionary()
+    # Numbers the server-side cursors opened by stream(), names only have to be unique per connection
+    stream_ids = count()
+    # Set to a QueryStats to record the latency and rows of every query run through execute()
+    query_stats: QueryStats | None = None
+
+    def __init__(self, connection: PostgresConnection, cursor: PostgresCursor, pool: AbstractConnectionPool = None) -> None:
         self.conn = connection
         self.cur = cursor
+        self.pool = pool
+        # Many threads may share one instance, so the transaction's cursor is tracked per thread/task rather than on self
+        self.transaction_cursor: ContextVar[PostgresCursor | None] = ContextVar('transaction_cursor', default=None)
+
+    @contextmanager
+    def open_cursor(self):
+        '''Yields a cursor to use for a single operation.
+        Inside this thread's (or task's) transaction() this is the transaction's cursor,
+        with a pool this is a new cursor on a pooled connection (returned to the pool afterwards), otherwise the shared cursor'''
+        transaction_cursor = self.transaction_cursor.get()
+        if transaction_cursor is not None:
+            yield transaction_cursor
+            return
+        if self.pool is None:
+            yield self.cur
+            return
+        connection = self.pool.getconn()
+        try:
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                yield cursor
+        finally:
+            self.pool.putconn(connection)
+
+    def execute(self, cur: PostgresCursor, name: str, query: str, params: tuple = (), prepare: bool = False):
+        '''Executes `query` on `cur`, recording its latency and rowcount under `name` when query_stats is set.
+        With `prepare` and use_prepared_statements it is sent as a named prepared statement instead,
+        so it is only planned the first time it is used on each connection (only for SELECT/INSERT/UPDATE/DELETE)'''
+        start = perf_counter() if self.query_stats else 0
+        if not (prepare and self.use_prepared_statements):
+            cur.execute(query, params)
+        else:
+            prepared = self.prepared.setdefault(cur.connection, set())
+            if name not in prepared:
+                cur.execute(f'PREPARE {name} AS {to_positional_params(query).rstrip().rstrip(";")}')
+                prepared.add(name)
+            if params:
+                cur.execute(f'EXECUTE {name} ({", ".join(["%s"]*len(params))});', params)
+            else:
+                cur.execute(f'EXECUTE {name};')
+        if self.query_stats:
+            self.query_stats.record(name, perf_counter() - start, cur.rowcount)
+
+    def execute_values(self, cur: PostgresCursor, name: str, query: str, argslist: list[tuple], page_size: int = 100, fetch: bool = False):
+        '''extras.execute_values(), recorded under `name` when query_stats is set'''
+        start = perf_counter() if self.query_stats else 0
+        result = extras.execute_values(cur, query, argslist, page_size=page_size, fetch=fetch)
+        if self.query_stats:
+            self.query_stats.record(name, perf_counter() - start, len(result) if fetch else cur.rowcount)
+        return result
+
+    def copy(self, cur: PostgresCursor, name: str, query: str, file):
+        '''Runs a `COPY ... FROM STDIN` query reading from the file like object `file`, recorded under `name` when query_stats is set'''
+        start = perf_counter() if self.query_stats else 0
+        cur.copy_expert(query, file)
+        if self.query_stats:
+            self.query_stats.record(name, perf_counter() - start, cur.rowcount)
+
+    def stream(self, name: str, query: str, params: tuple = (), itersize: int = 2000):
+        '''Yields the rows of `query` from a server-side (named) cursor, fetching `itersize` rows per round trip.
+        Named cursors only last as long as their transaction, so inside transaction() this uses the transaction's connection.
+        Otherwise it is run in a transaction of its own, ended when the generator finishes or is closed, on a connection
+        nothing else is using: one from the pool, or without a pool one opened for the stream'''
+        transaction_cursor = self.transaction_cursor.get()
+        if transaction_cursor is not None:
+            yield from self.fetch_stream(transaction_cursor.connection, name, query, params, itersize)
+            return
+        if self.pool:
+            connection = self.pool.getconn()
+        else: # Not the shared connection, a stream that is never closed would leave it inside the stream's transaction
+            connection = psycopg2.connect(self.conn.dsn, password=self.conn.info.password)
+        autocommit = connection.autocommit
+        try:
+            connection.autocommit = False
+            with connection: # Commits, or rolls back if the stream raised or was closed part way
+                yield from self.fetch_stream(connection, name, query, params, itersize)
+        finally:
+            if self.pool:
+                connection.autocommit = autocommit
+                self.pool.putconn(connection)
+            else:
+                connection.close()
+
+    def fetch_stream(self, connection: PostgresConnection, name: str, query: str, params: tuple, itersize: int):
+        '''Yields the rows of `query` from a named cursor on `connection` (which must be in a transaction), see stream().
+        The time spent on the DB and the number of rows streamed are recorded under `name` when query_stats is set'''
+        with connection.cursor(name=f'stream_{next(self.stream_ids)}') as cur:
+            seconds = rows = 0
+            try:
+                start = perf_counter()
+                cur.execute(query, params)
+                while page := cur.fetchmany(itersize):
+                    seconds += perf_counter() - start
+                    rows += len(page)
+                    yield from page
+                    start = perf_counter()
+                seconds += perf_counter() - start
+            finally:
+                if self.query_stats:
+                    self.query_stats.record(name, seconds, rows)
+
+    @contextmanager
+    def transaction(self):
+        '''All queries made by this thread (or task) inside this context are committed together,
+        or rolled back if an exception is raised'''
+        connection = self.pool.getconn() if self.pool else self.conn
+        autocommit = connection.autocommit
+        connection.autocommit = False
+        try:
+            with connection.cursor() as cursor:
+                token = self.transaction_cursor.set(cursor)
+                try:
+                    yield cursor
+                finally:
+                    self.transaction_cursor.reset(token)
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+        finally:
+            connection.autocommit = autocommit
+            if self.pool:
+                self.pool.putconn(connection)
+
+def create_querier(connection: PostgresConnection, cursor: PostgresCursor, pool: AbstractConnectionPool = None):
+    '''Returns the Querier for the storage backend `connection` belongs to'''
+    from memory import MemoryStore, MemoryQuerier # memory.py builds on this module
+    if isinstance(connection, MemoryStore):
+        return MemoryQuerier(connection, cursor, pool)
+    return Querier(connection, cursor, pool)
 
 class Querier(BaseConnection):
     '''Addition to the BaseConnection: allows easy, indexed access to objects attributes via query lookups in the DB'''
-    def __init__(self, connection: PostgresConnection, cursor: PostgresCursor) -> None:
-        super().__init__(connection, cursor)
-        self.items = Items(connection, cursor)
-        self.players = Players(connection, cursor)
+    def __init__(self, connection: PostgresConnection, cursor: PostgresCursor, pool: AbstractConnectionPool = None) -> None:
+        super().__init__(connection, cursor, pool)
+        self.items = Items(connection, cursor, pool)
+        self.players = Players(connection, cursor, pool)
 
 class Connection(BaseConnection):
     '''A connection to the DB WITH hepler querier functions'''
-    def __init__(self, connection: PostgresConnection, cursor: PostgresCursor) -> None:
-        super().__init__(connection, cursor)
-        self.querier = Querier(connection, cursor)
+    def __init__(self, connection: PostgresConnection, cursor: PostgresCursor, pool: AbstractConnectionPool = None) -> None:
+        super().__init__(connection, cursor, pool)
+        self.querier = create_querier(connection, cursor, pool)
+
+class Catalogue:
+    '''An in-process cache of every item, shared by all Items instances.
+    Item data only changes through Loader/Setup, which invalidate it'''
+    def __init__(self) -> None:
+        self.items: dict[int, Item] = {}
+        self.name_id_map: dict[str, int] = {}
+        self.id_name_map: dict[int, str] = {}
+        self.loaded = False
+        self.generation: int = 0 # Counts the invalidations, so a load that started before one is not cached
+        self.lock = Lock()
+
+    def is_loaded(self):
+        return self.loaded
+
+    def load(self, items: list[Item], generation: int):
+        '''Replaces the cached items, the maps are built before being swapped in so readers never see a partial catalogue.
+        `generation` is self.generation from before the items were fetched, if the catalogue has been invalidated since
+        the items may be stale, so they are returned in a Catalogue of their own instead of being cached'''
+        maps = ({item.id: item for item in items}, {item.name: item.id for item in items}, {item.id: item.name for item in items})
+        with self.lock:
+            catalogue = self if generation == self.generation else Catalogue()
+            catalogue.items, catalogue.name_id_map, catalogue.id_name_map = maps
+            catalogue.loaded = True
+        return catalogue
+
+    def invalidate(self):
+        '''Marks the catalogue as stale, it is reloaded on its next use'''
+        with self.lock:
+            self.generation += 1
+            self.loaded = False
 
 class Items(BaseConnection):
     '''Encompassing class for common item methods'''
-    def __init__(self, connection: PostgresConnection, cursor: PostgresCursor) -> None:
-        super().__init__(connection, cursor)
-
-    def _fetch_name_id_query(self):
-        '''Selects the name and item_id of all items in the Items table'''
-        query = '''SELECT name, item_id
-            FROM Items;'''
-        self.cur.execute(query)
-        return self.cur.fetchall()
+    catalogue = Catalogue()
+    # Every item in the Items table along with its consumable data (if any), also used by async_query.AsyncItems
+    catalogue_query = '''SELECT item_id, name, category, value, level, rarity, description, emoji,
+        type, min_range, max_range, min_experience, max_experience, min_turns, max_turns
+        FROM Items
+        LEFT JOIN ConsumableData ON Items.consumable_id = ConsumableData.consumable_id
+        ORDER BY item_id;'''
+    def __init__(self, connection: PostgresConnection, cursor: PostgresCursor, pool: AbstractConnectionPool = None) -> None:
+        super().__init__(connection, cursor, pool)
+
+    def _fetch_catalogue_query(self):
+        '''Selects every item in the Items table along with its consumable data (if any)'''
+        with self.open_cursor() as cur:
+            self.execute(cur, 'fetch_catalogue', self.catalogue_query)
+            return cur.fetchall()
+
+    def load_catalogue(self):
+        '''Returns the shared Catalogue, loading it from the DB if it has been invalidated (or never loaded)'''
+        catalogue = self.catalogue
+        if not catalogue.is_loaded():
+            generation = catalogue.generation
+            return catalogue.load(self.catalogue_items(self._fetch_catalogue_query()), generation)
+        return catalogue
+
+    @staticmethod
+    def catalogue_item(row: tuple):
+        '''Builds the Item object from a row of _fetch_catalogue_query()'''
+        def to_range(start: int | None, stop: int | None):
+            return range(start, stop) if start is not None else None
+        return Item(*row[:8], row[8], to_range(row[9], row[10]), to_range(row[11], row[12]), to_range(row[13], row[14]))
+
+    @staticmethod
+    def catalogue_items(rows: list[tuple]):
+        '''Builds the Item objects from the rows of _fetch_catalogue_query()'''
+        return [Items.catalogue_item(row) for row in rows]
+
+    @staticmethod
+    def invalidate_catalogue():
+        '''Drops the cached catalogue, must be called whenever the Items/ConsumableData tables change'''
+        Items.catalogue.invalidate()
 
     def fetch_name_id_map(self):
-        '''Fetch and generate a name to id map for all items in the Items table
+        '''Returns a name to id map for all items in the Items table (from the catalogue, do not mutate it)
         Returns a `dict: [names, item_ids]`'''
-        name_id_map: dict[str, int] = {}
-        for row in self._fetch_name_id_query():
-            name_id_map[row[0]] = row[1]
-        return name_id_map
-    
-    def get_item_id(self, name_id_map: dict[str, int], name_or_id: str | int):
-        '''Gets an item's id from its name or id'''
+        return self.load_catalogue().name_id_map
+
+    def fetch_id_name_map(self):
+        '''Returns an id to name map for all items in the Items table (from the catalogue, do not mutate it)
+        Returns a `dict: [item_ids, names]`'''
+        return self.load_catalogue().id_name_map
+
+    def fetch_item(self, item_id: int):
+        '''Returns the Item with `item_id`, or None if there is no such item'''
+        return self.load_catalogue().items.get(item_id)
+
+    def get_item_id(self, catalogue: Catalogue, name_or_id: str | int):
+        '''Gets an item's id from its name or id, looked up in `catalogue` (see load_catalogue())'''
         try:
             name_or_id = int(name_or_id)
-            if name_or_id in name_id_map.values():
+            if name_or_id in catalogue.id_name_map:
                 return name_or_id
         except ValueError: # Must be a string
             try:
-                return name_id_map[name_or_id]
+                return catalogue.name_id_map[name_or_id]
             except KeyError:
                 pass
         return None
 
-    def _fetch_items_query(self):
-        '''Fetches all items from the database, returing all items common attributes'''
-        query = '''SELECT item_id, name, category, value, level, rarity, description, emoji
-            FROM Items;'''
-        self.cur.execute(query)
-        return self.cur.fetchall()
-
     def fetch_items(self):
-        '''Fetches all items from the database, returing a list of Item objects'''
-        return [Item(*row) for row in self._fetch_items_query()]
+        '''Returns a list of every Item in the catalogue'''
+        return list(self.load_catalogue().items.values())
+
+    def iter_items(self, itersize: int = 2000):
+        '''Yields every Item (in item_id order) from a single query on a server-side cursor,
+        without loading the whole table or the catalogue into memory'''
+        for row in self.stream('stream_items', self.catalogue_query, itersize=itersize):
+            yield self.catalogue_item(row)
 
 class Players(BaseConnection):
     '''Encompassing class for common Player methods'''
-    def __init__(self, connection: PostgresConnection, cursor: PostgresCursor) -> None:
-        super().__init__(connection, cursor)
+    def __init__(self, connection: PostgresConnection, cursor: PostgresCursor, pool: AbstractConnectionPool = None) -> None:
+        super().__init__(connection, cursor, pool)
 
     def _add_player_query(self, player_name: str):
         '''Add a new player to DB'''
         query = '''INSERT INTO Players(name)
             VALUES (%s)
             RETURNING *;'''
-        self.cur.execute(query, (player_name,))
-        return self.cur.fetchone()
+        with self.open_cursor() as cur:
+            self.execute(cur, 'add_player', query, (player_name,))
+            return cur.fetchone()
 
     def add_player(self, player_name: str):
         '''Adds a new player to the DB with specified name, returning a player object'''
@@ -86,7 +335,8 @@ class Players(BaseConnection):
         '''Remove a player from the DB'''
         query = '''DELETE FROM Players
             WHERE player_id = %s;'''
-        self.cur.execute(query, (player_id,))
+        with self.open_cursor() as cur:
+            self.execute(cur, 'delete_player', query, (player_id,))
 
     def delete_player(self, player_id: int):
         '''Deletes the specified player from the DB'''
@@ -98,8 +348,9 @@ class Players(BaseConnection):
         query = '''SELECT *
             FROM Players
             WHERE player_id = %s;'''
-        self.cur.execute(query, (player_id,))
-        return self.cur.fetchone()
+        with self.open_cursor() as cur:
+            self.execute(cur, 'fetch_player', query, (player_id,), prepare=True)
+            return cur.fetchone()
 
     def fetch_player(self, player_id: int):
         '''Queries the DB for the specified player_id
@@ -113,13 +364,45 @@ class Players(BaseConnection):
         '''Fetches all players from the database, returing all players'''
         query = '''SELECT *
             FROM Players;'''
-        self.cur.execute(query)
-        return self.cur.fetchall()
+        with self.open_cursor() as cur:
+            self.execute(cur, 'fetch_players', query)
+            return cur.fetchall()
 
     def fetch_players(self):
         '''Fetches all players from the database, returing a list of Player objects'''
         return [Player(*row) for row in self._fetch_players_query()]
 
+    def _fetch_players_page_query(self, after_id: int, limit: int):
+        '''Fetches up to `limit` players with a player_id greater than `after_id`, in player_id order'''
+        query = '''SELECT *
+            FROM Players
+            WHERE player_id > %s
+            ORDER BY player_id
+            LIMIT %s;'''
+        with self.open_cursor() as cur:
+            self.execute(cur, 'fetch_players_page', query, (after_id, limit), prepare=True)
+            return cur.fetchall()
+
+    def iter_players(self, page_size: int = 500):
+        '''Yields every player as a Player object, fetching `page_size` players per query.
+            Pages continue from the last player_id seen (keyset pagination) so each page is an index range scan'''
+        after_id = 0
+        while True:
+            rows = self._fetch_players_page_query(after_id, page_size)
+            for row in rows:
+                yield Player(*row)
+            if len(rows) < page_size:
+                return
+            after_id = rows[-1][0]
+
+    def stream_players(self, itersize: int = 2000):
+        '''Yields every player as a Player object from a single query on a server-side cursor'''
+        query = '''SELECT *
+            FROM Players
+            ORDER BY player_id;'''
+        for row in self.stream('stream_players', query, itersize=itersize):
+            yield Player(*row)
+
     def _fetch_player_items_query(self, player_id):
         '''Fetch all rows from PlayerItems with matching player_id
             and join item id to Items table to get item info'''
@@ -127,20 +410,56 @@ class Players(BaseConnection):
             FROM PlayerItems
             INNER JOIN Items ON Items.item_id = PlayerItems.item_id
             WHERE player_id = %s;'''
-        self.cur.execute(query, (player_id,))
-        return self.cur.fetchall()
+        with self.open_cursor() as cur:
+            self.execute(cur, 'fetch_player_items', query, (player_id,), prepare=True)
+            return cur.fetchall()
 
     def fetch_player_items(self, player_id):
         '''Fetch all items from the PlayerItems table for specified player_id,
             returning a list of Items'''
         return [PlayerItem(*row) for row in self._fetch_player_items_query(player_id)]
 
+    def _fetch_player_items_page_query(self, player_id: int, after_item_id: int, limit: int):
+        '''Fetches up to `limit` of the player's items with an item_id greater than `after_item_id`, in item_id order'''
+        query = '''SELECT PlayerItems.item_id, name, quantity
+            FROM PlayerItems
+            INNER JOIN Items ON Items.item_id = PlayerItems.item_id
+            WHERE player_id = %s AND
+            PlayerItems.item_id > %s
+            ORDER BY PlayerItems.item_id
+            LIMIT %s;'''
+        with self.open_cursor() as cur:
+            self.execute(cur, 'fetch_player_items_page', query, (player_id, after_item_id, limit), prepare=True)
+            return cur.fetchall()
+
+    def iter_player_items(self, player_id: int, page_size: int = 500):
+        '''Yields the player's items as PlayerItem objects, fetching `page_size` items per query (keyset paginated on item_id)'''
+        after_item_id = 0
+        while True:
+            rows = self._fetch_player_items_page_query(player_id, after_item_id, page_size)
+            for row in rows:
+                yield PlayerItem(*row)
+            if len(rows) < page_size:
+                return
+            after_item_id = rows[-1][0]
+
+    def stream_player_items(self, player_id: int, itersize: int = 2000):
+        '''Yields the player's items as PlayerItem objects from a single query on a server-side cursor'''
+        query = '''SELECT PlayerItems.item_id, name, quantity
+            FROM PlayerItems
+            INNER JOIN Items ON Items.item_id = PlayerItems.item_id
+            WHERE player_id = %s
+            ORDER BY PlayerItems.item_id;'''
+        for row in self.stream('stream_player_items', query, (player_id,), itersize):
+            yield PlayerItem(*row)
+
     def _delete_player_item_query(self, player_id: int, item_id: int):
         '''Deletes the item for the player from the PlayerItems table'''
         query = '''DELETE FROM PlayerItems
             WHERE player_id = %s AND
             item_id = %s;'''
-        self.cur.execute(query, (player_id, item_id))
+        with self.open_cursor() as cur:
+            self.execute(cur, 'delete_player_item', query, (player_id, item_id), prepare=True)
 
     def delete_player_item(self, player_id: int, item_id: int):
         '''Deletes the specified item for the specified player from the PlayerItems table'''
@@ -152,7 +471,8 @@ class Players(BaseConnection):
             SET quantity = %s
             WHERE player_id = %s AND
             item_id = %s;'''
-        self.cur.execute(query, (amount, player_id, item_id))
+        with self.open_cursor() as cur:
+            self.execute(cur, 'set_player_item', query, (amount, player_id, item_id), prepare=True)
 
     def set_or_delete_player_item(self, player_id: int, item_id: int, amount: int):
         '''Sets the quantity of the specified player's item to `amount`,
@@ -164,54 +484,99 @@ class Players(BaseConnection):
         # else: Set quantity to required amount
         self._set_player_item_query(player_id, item_id, amount)
 
-    def _update_player_item_query(self, player_id: int, item_id: int, amount: int) -> int:
-        '''Attempts to update the quantity of an item in the PlayerItems table,
-            returing the row (if present)'''
+    def _set_player_items_query(self, player_id: int, amounts: list[tuple[int, int]]):
+        '''Sets the quantities of many of the specified player's items in the PlayerItems table in one statement,
+            `amounts` is a list of (item_id, quantity)'''
         query = '''UPDATE PlayerItems
-            SET quantity = quantity + %s
+            SET quantity = new.quantity
+            FROM (VALUES %s) AS new (player_id, item_id, quantity)
+            WHERE PlayerItems.player_id = new.player_id AND
+            PlayerItems.item_id = new.item_id;'''
+        with self.open_cursor() as cur:
+            self.execute_values(cur, 'set_player_items', query, [(player_id, item_id, amount) for item_id, amount in amounts], page_size=max(1, len(amounts)))
+
+    def _delete_player_items_query(self, player_id: int, item_ids: list[int]):
+        '''Deletes many items for the player from the PlayerItems table in one statement'''
+        query = '''DELETE FROM PlayerItems
             WHERE player_id = %s AND
-            item_id = %s
+            item_id = ANY(%s);'''
+        with self.open_cursor() as cur:
+            self.execute(cur, 'delete_player_items', query, (player_id, item_ids))
+
+    def set_or_delete_player_items(self, player_id: int, amounts: dict[int, int]):
+        '''Bulk version of set_or_delete_player_item(), `amounts` is a `dict: [item_id, amount]`.
+            All the changes are made in a single transaction'''
+        to_set = [(item_id, amount) for item_id, amount in amounts.items() if amount > 0]
+        to_delete = [item_id for item_id, amount in amounts.items() if amount <= 0]
+        with self.transaction():
+            if to_set:
+                self._set_player_items_query(player_id, to_set)
+            if to_delete:
+                self._delete_player_items_query(player_id, to_delete)
+
+    def _upsert_player_item_query(self, player_id: int, item_id: int, amount: int):
+        '''Adds the item to the player in the PlayerItems table, or adds `amount` to the quantity if they already have it,
+            returning the new quantity'''
+        query = '''INSERT INTO PlayerItems (player_id, item_id, quantity)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (player_id, item_id) DO UPDATE
+            SET quantity = PlayerItems.quantity + EXCLUDED.quantity
             RETURNING quantity;'''
-        self.cur.execute(query, (amount, player_id, item_id))
-        return self.cur.fetchone()
-
-    def _add_player_item_query(self, player_id: int, item_id: int, amount: int):
-        '''Adds the item to the specified player in the PlayerItems table'''
-        query = '''INSERT INTO PlayerItems
-            VALUES (%s, %s, %s);'''
-        self.cur.execute(query, (player_id, item_id, amount))
+        with self.open_cursor() as cur:
+            self.execute(cur, 'upsert_player_item', query, (player_id, item_id, amount), prepare=True)
+            return cur.fetchone()
 
     def update_player_item(self, player_id: int, item_id: int, amount: int):
         '''Adds or Updates an item to/in a players inventory, returning the new item quantity'''
-        res = self._update_player_item_query(player_id, item_id, amount)
-        if not res:
-            # Data is not in DB and needs to be added
-            self._add_player_item_query(player_id, item_id, amount)
-            return amount
-        return res[0]
+        return self._upsert_player_item_query(player_id, item_id, amount)[0]
+
+    def _grant_player_items_query(self, grants: list[tuple[int, int, int]]):
+        '''Upserts many (player_id, item_id, amount) rows into the PlayerItems table in one statement,
+            returning the (player_id, item_id, quantity) of each row'''
+        query = '''INSERT INTO PlayerItems (player_id, item_id, quantity)
+            VALUES %s
+            ON CONFLICT (player_id, item_id) DO UPDATE
+            SET quantity = PlayerItems.quantity + EXCLUDED.quantity
+            RETURNING player_id, item_id, quantity;'''
+        with self.open_cursor() as cur:
+            return self.execute_values(cur, 'grant_player_items', query, grants, page_size=max(1, len(grants)), fetch=True)
+
+    def grant_player_items(self, grants: list[tuple[int, int, int]]):
+        '''Bulk version of update_player_item(), `grants` is a list of (player_id, item_id, amount) for any number of players.
+            Returns a `dict: [(player_id, item_id), new quantity]`'''
+        # A row can only be updated once per statement, so total up any repeated (player, item) pairs first
+        totals: Counter[tuple[int, int]] = Counter()
+        for player_id, item_id, amount in grants:
+            totals[(player_id, item_id)] += amount
+        if not totals:
+            return {}
+        # Sorted so concurrent grants lock the rows in the same order
+        rows = self._grant_player_items_query([(player_id, item_id, amount) for (player_id, item_id), amount in sorted(totals.items())])
+        return {(player_id, item_id): quantity for player_id, item_id, quantity in rows}
 
     def _fetch_combat_items_query(self, player_id: int):
         '''Selects all item attributes required in combat for a specified player_id'''
 
         query = '''SELECT type, Items.item_id, name, quantity, min_range, max_range, min_turns, max_turns, min_experience, max_experience
-            FROM Items
-            INNER JOIN PlayerItems ON Items.item_id = PlayerItems.item_id
+            FROM PlayerItems
+            INNER JOIN Items ON Items.item_id = PlayerItems.item_id
             INNER JOIN ConsumableData ON Items.consumable_id = ConsumableData.consumable_id
-            WHERE Items.item_id IN (
-                SELECT PlayerItems.item_id
-                FROM PlayerItems
-                WHERE player_id = %s
-            ) AND
-            Items.consumable_id IS NOT NULL AND
-            type in ('damage', 'heal');'''
-        self.cur.execute(query, (player_id,))
-        return self.cur.fetchall()
+            WHERE PlayerItems.player_id = %s AND
+            type IN ('damage', 'heal');'''
+        with self.open_cursor() as cur:
+            self.execute(cur, 'fetch_combat_items', query, (player_id,), prepare=True)
+            return cur.fetchall()
          
     def fetch_combat_items(self, player_id: int):
         '''Returns two lists of CombatItem objects, damaging & healing, for use in Combat'''
+        return self.combat_items(self._fetch_combat_items_query(player_id))
+
+    @staticmethod
+    def combat_items(rows: list[tuple]):
+        '''Splits the rows of _fetch_combat_items_query() into two lists of CombatItem objects, damaging & healing'''
         damaging: list[CombatItem] = []
         healing: list[CombatItem] = []
-        for row in self._fetch_combat_items_query(player_id):
+        for row in rows:
             item = CombatItem(row[1], row[2], row[3], range(row[4], row[5]), range(row[6], row[7]), range(row[8], row[9]))
             if row[0] == 'damage':
                 damaging.append(item)
@@ -0,0 +1,165 @@
+from __future__ import annotations
+from time import perf_counter
+import objects
+
+class SearchTimeout(Exception):
+    '''Raised inside the search when the time budget for a move has been used up'''
+    pass
+
+class SearchItem:
+    '''The parts of a combat item the search needs, with every (amount, cooldown) outcome precomputed'''
+    def __init__(self, name: str, item_range: range, turns: range, is_heal: bool) -> None:
+        self.name = name
+        self.is_heal = is_heal
+        self.infinite = name == objects.PUNCH.name # The default punch attack is never used up
+        amounts = range(item_range.start, item_range.stop+1)
+        cooldowns = range(turns.start, turns.stop+1)
+        probability = 1/(len(amounts)*len(cooldowns))
+        self.outcomes: list[tuple[int, int, float]] = [(amount, cooldown, probability) for amount in amounts for cooldown in cooldowns]
+
+PUNCH = SearchItem(objects.PUNCH.name, objects.PUNCH.range, objects.PUNCH.turns, False)
+
+class Expectimax:
+    '''A depth limited expectimax search over combat states from the enemy's point of view.
+    The enemy picks the move with the highest expected value, the player is modelled as picking uniformly from their items
+    and every roll of damage/healing and cooldown is a chance node.
+
+    A state is the tuple `(enemy_health, player_health, enemy_cooldown, player_cooldown, enemy_counts, player_counts)`
+    where the counts are tuples of how many of each item remain, states are stored in a transposition table.'''
+    def __init__(self, enemy_damaging: list, enemy_healing: list, player_damaging: list, player_healing: list,
+            enemy_max_health: int, player_max_health: int, max_depth: int = 6, time_budget: float = 0.02, max_entries: int = 500_000,
+            node_budget: int | None = None) -> None:
+        self.enemy_items = [SearchItem(item.name, item.range, item.turns, False) for item in enemy_damaging] + [SearchItem(item.name, item.range, item.turns, True) for item in enemy_healing]
+        self.player_items = [SearchItem(item.name, item.range, item.turns, False) for item in player_damaging] + [SearchItem(item.name, item.range, item.turns, True) for item in player_healing]
+        self.enemy_max_health = enemy_max_health
+        self.player_max_health = player_max_health
+        self.max_depth = max_depth
+        self.time_budget = time_budget # In seconds
+        self.node_budget = node_budget # Nodes expanded per move, unlike the time budget this does not depend on machine load
+        self.max_entries = max_entries
+        self.table: dict[tuple, tuple[int, float]] = {} # state key -> (depth searched, value)
+        self.deadline: float = 0
+        self.nodes: int = 0
+        self.depth_reached: int = 0
+
+    def evaluate(self, state: tuple):
+        '''Heuristic value of a non terminal state: the difference in % health remaining'''
+        return state[0]/self.enemy_max_health - state[1]/self.player_max_health
+
+    def check_time(self):
+        '''Raises SearchTimeout if the time (or node) budget has been used up'''
+        self.nodes += 1
+        if perf_counter() > self.deadline or (self.node_budget is not None and self.nodes > self.node_budget):
+            raise SearchTimeout
+
+    def available(self, items: list[SearchItem], counts: tuple[int, ...]):
+        '''Returns the indexes of the items that can be used, -1 is the default punch'''
+        indexes = [index for index, count in enumerate(counts) if count > 0]
+        return indexes if indexes else [-1]
+
+    def use(self, items: list[SearchItem], counts: tuple[int, ...], index: int):
+        '''Returns the item at `index` and the counts after using it'''
+        if index == -1:
+            return PUNCH, counts
+        item = items[index]
+        if item.infinite:
+            return item, counts
+        return item, counts[:index] + (counts[index]-1,) + counts[index+1:]
+
+    def round_start(self, state: tuple, depth: int):
+        '''Value of a state at the start of a round (the player moves first if they are off cooldown)'''
+        enemy_health, player_health, enemy_cooldown, player_cooldown, enemy_counts, player_counts = state
+        if not enemy_health:
+            return -1.0
+        if not player_health:
+            return 1.0
+        if not depth:
+            return self.evaluate(state)
+
+        # Skip the rounds where neither instance can move
+        skip = min(enemy_cooldown, player_cooldown)
+        if skip > 0:
+            enemy_cooldown -= skip
+            player_cooldown -= skip
+            state = (enemy_health, player_health, enemy_cooldown, player_cooldown, enemy_counts, player_counts)
+
+        if player_cooldown > 0:
+            return self.enemy_turn(state, depth)
+
+        key = (0, *state)
+        stored = self.table.get(key)
+        if stored and stored[0] >= depth:
+            return stored[1]
+        self.check_time()
+
+        indexes = self.available(self.player_items, player_counts)
+        value = 0.0
+        for index in indexes:
+            item, counts = self.use(self.player_items, player_counts, index)
+            for amount, cooldown, probability in item.outcomes:
+                if item.is_heal:
+                    new_state = (enemy_health, min(self.player_max_health, player_health+amount), enemy_cooldown, cooldown, enemy_counts, counts)
+                else:
+                    new_state = (max(0, enemy_health-amount), player_health, enemy_cooldown, cooldown, enemy_counts, counts)
+                value += probability*self.enemy_turn(new_state, depth-1)
+        value /= len(indexes)
+        self.table[key] = (depth, value)
+        return value
+
+    def enemy_turn(self, state: tuple, depth: int):
+        '''Value of the second half of a round, the enemy moves if it is alive and off cooldown'''
+        if not state[0]:
+            return -1.0
+        if state[2] > 0:
+            return self.end_round(state, depth)
+        if not depth:
+            return self.evaluate(state)
+        return max(self.action_values(state, depth).values())
+
+    def end_round(self, state: tuple, depth: int):
+        '''Reduces both cooldowns at the end of a round'''
+        enemy_health, player_health, enemy_cooldown, player_cooldown, enemy_counts, player_counts = state
+        return self.round_start((enemy_health, player_health, enemy_cooldown-1, player_cooldown-1, enemy_counts, player_counts), depth)
+
+    def action_values(self, state: tuple, depth: int):
+        '''Returns a `dict: [item index, expected value]` of every move the enemy can make in `state`'''
+        enemy_health, player_health, enemy_cooldown, player_cooldown, enemy_counts, player_counts = state
+        key = (1, *state)
+        stored = self.table.get(key)
+        if stored and stored[0] >= depth:
+            return stored[1]
+        self.check_time()
+
+        values: dict[int, float] = {}
+        for index in self.available(self.enemy_items, enemy_counts):
+            item, counts = self.use(self.enemy_items, enemy_counts, index)
+            value = 0.0
+            for amount, cooldown, probability in item.outcomes:
+                if item.is_heal:
+                    new_state = (min(self.enemy_max_health, enemy_health+amount), player_health, cooldown, player_cooldown, counts, player_counts)
+                else:
+                    new_state = (enemy_health, max(0, player_health-amount), cooldown, player_cooldown, counts, player_counts)
+                value += probability*self.end_round(new_state, depth-1)
+            values[index] = value
+        self.table[key] = (depth, values)
+        return values
+
+    def best_move(self, state: tuple):
+        '''Iteratively deepens the search until max_depth or the time (or node) budget runs out,
+        returning the index of the best enemy item found by the deepest completed search (-1 for punch)'''
+        if len(self.table) > self.max_entries:
+            self.table.clear()
+        self.deadline = perf_counter() + self.time_budget
+        self.nodes = 0
+        self.depth_reached = 0
+        best = None
+        for depth in range(1, self.max_depth+1):
+            try:
+                values = self.action_values(state, depth)
+            except SearchTimeout:
+                break
+            best = max(values, key=values.get)
+            self.depth_reached = depth
+        if best is None: # Not even depth 1 finished, fall back to the first available move
+            best = self.available(self.enemy_items, state[4])[0]
+        return best
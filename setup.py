@@ -1,10 +1,11 @@
 from psycopg2.extensions import (connection as PostgresConnection, cursor as PostgresCursor)
-from query import BaseConnection
+from psycopg2.pool import AbstractConnectionPool
+from query import BaseConnection, Items
 
 class Setup(BaseConnection):
     '''Setup class containing functions to setup the required tables in a database'''
-    def __init__(self, connection: PostgresConnection, cursor: PostgresCursor) -> None:
-        super().__init__(connection, cursor)
+    def __init__(self, connection: PostgresConnection, cursor: PostgresCursor, pool: AbstractConnectionPool = None) -> None:
+        super().__init__(connection, cursor, pool)
 
         # Remove any previous tables
         self.clear_previous_tables()
@@ -13,26 +14,30 @@ class Setup(BaseConnection):
         self.create_player_items_table()
         self.create_player_table()
         self.create_game_data_tables()
+        self.create_indexes()
+        Items.invalidate_catalogue()
 
     def clear_previous_tables(self):
         '''Drops all named tables in the DB'''
-        querys = ('DROP TABLE IF EXISTS Players;',
-            'DROP TABLE IF EXISTS PlayerItems;',
-            'DROP TABLE IF EXISTS Recipes;',
-            'DROP TABLE IF EXISTS Items;',
-            'DROP TABLE IF EXISTS ConsumableData;')
-        for query in querys:
-            self.cur.execute(query)
+        querys = (('drop_players', 'DROP TABLE IF EXISTS Players;'),
+            ('drop_player_items', 'DROP TABLE IF EXISTS PlayerItems;'),
+            ('drop_recipes', 'DROP TABLE IF EXISTS Recipes;'),
+            ('drop_items', 'DROP TABLE IF EXISTS Items;'),
+            ('drop_consumable_data', 'DROP TABLE IF EXISTS ConsumableData;'))
+        with self.open_cursor() as cur:
+            for name, query in querys:
+                self.execute(cur, name, query)
 
     def create_player_items_table(self):
         '''Creates the table to store player inventories'''
         query = '''CREATE TABLE IF NOT EXISTS PlayerItems (
             player_id BIGINT NOT NULL,
-            item_id SMALLINT NOT NULL,
+            item_id INT NOT NULL,
             quantity SMALLINT DEFAULT 1 NOT NULL,
             PRIMARY KEY(player_id, item_id)
         );'''
-        self.cur.execute(query)
+        with self.open_cursor() as cur:
+            self.execute(cur, 'create_player_items_table', query)
     
     def create_player_table(self):
         '''Creates the table to store players and player information'''
@@ -44,7 +49,8 @@ class Setup(BaseConnection):
             energy SMALLINT DEFAULT 0,
             experience INT DEFAULT 0
         );'''
-        self.cur.execute(query)
+        with self.open_cursor() as cur:
+            self.execute(cur, 'create_player_table', query)
 
     def create_game_data_tables(self):
         '''Creates the table to store game item information'''
@@ -61,7 +67,8 @@ class Setup(BaseConnection):
             CONSTRAINT if_min_experience_then_check_max_experience_greater_or_equal CHECK ( (min_experience IS NULL) OR (max_experience >= min_experience) ),
             CONSTRAINT if_min_turns_then_check_max_turns_greater_or_equal CHECK ( (min_turns IS NULL) OR (max_turns >= min_turns) )
         );'''
-        self.cur.execute(query)
+        with self.open_cursor() as cur:
+            self.execute(cur, 'create_consumable_data_table', query)
         
         query = '''CREATE TABLE IF NOT EXISTS Items (
             item_id INT PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
@@ -72,25 +79,38 @@ class Setup(BaseConnection):
             value SMALLINT NOT NULL,
             level SMALLINT NOT NULL,
             rarity VARCHAR NOT NULL CONSTRAINT valid_rarity CHECK (rarity IN ('legendary', 'mythic', 'epic', 'rare', 'uncommon', 'common')),
-            recipe_id SMALLINT,
-            consumable_id SMALLINT,
+            recipe_id INT,
+            consumable_id INT,
             CONSTRAINT fk_ConsumableData
                 FOREIGN KEY(consumable_id) 
                 REFERENCES ConsumableData(consumable_id)
                 ON DELETE SET NULL
         );'''
-        self.cur.execute(query)
+        with self.open_cursor() as cur:
+            self.execute(cur, 'create_items_table', query)
 
         query = '''CREATE SEQUENCE IF NOT EXISTS RecipesRecipeIdSequence;'''
-        self.cur.execute(query)
+        with self.open_cursor() as cur:
+            self.execute(cur, 'create_recipe_id_sequence', query)
 
         query = '''CREATE TABLE IF NOT EXISTS Recipes (
-            recipe_id SMALLINT NOT NULL,
-            item_id SMALLINT NOT NULL,
+            recipe_id INT NOT NULL,
+            item_id INT NOT NULL,
             quantity SMALLINT DEFAULT 1 NOT NULL,
             PRIMARY KEY (recipe_id, item_id)
         );'''
-        self.cur.execute(query)
+        with self.open_cursor() as cur:
+            self.execute(cur, 'create_recipes_table', query)
 
         query = '''ALTER SEQUENCE RecipesRecipeIdSequence OWNED BY Recipes.recipe_id;'''
-        self.cur.execute(query)
\ No newline at end of file
+        with self.open_cursor() as cur:
+            self.execute(cur, 'own_recipe_id_sequence', query)
+
+    def create_indexes(self):
+        '''Creates the indexes used when loading a players combat items,
+        PlayerItems(player_id) does not need one as it is the first column of the PlayerItems primary key'''
+        querys = (('create_items_consumable_id_index', 'CREATE INDEX IF NOT EXISTS ItemsConsumableIdIndex ON Items(consumable_id);'),
+            ('create_consumable_data_type_index', 'CREATE INDEX IF NOT EXISTS ConsumableDataTypeIndex ON ConsumableData(type);'))
+        with self.open_cursor() as cur:
+            for name, query in querys:
+                self.execute(cur, name, query)
\ No newline at end of file
@@ -0,0 +1,200 @@
+from __future__ import annotations
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from random import choice, seed
+from operator import attrgetter
+from collections import Counter
+from itertools import product
+from query import Querier
+from combat import Combat
+import objects
+
+class SimulatedCombat(Combat):
+    '''A headless Combat: no DB connection, no input/output and no DB writes.
+    The player is controlled by the same AI as the enemy (or by a `strategy`)'''
+    class Enemy(Combat.Enemy):
+        '''An Enemy that does not display anything'''
+        # A time budget would make results depend on machine load, so simulations use a node budget instead.
+        # The real game's 20ms budget expands about 400 nodes per move, reaching the same depths (mostly 2-3, up to 8 late on)
+        search_time_budget: float = float('inf')
+        search_node_budget: int = 400
+        __slots__ = ()
+        def ouput(self, text: str):
+            pass
+
+    class AIPlayer(Combat.Enemy):
+        '''A player controlled by the enemy AI, used for Enemy-vs-Enemy simulations'''
+        search_time_budget: float = float('inf')
+        search_node_budget: int = 400
+        __slots__ = ('id', 'opponent')
+        def __init__(self, player_id: int, name: str, max_health: int, damaging: list[Combat.Item], healing: list[Combat.Item], health=None, difficulty=None, risk=None) -> None:
+            self.init_ai(difficulty, risk)
+            Combat.BaseClass.__init__(self, name, max_health, damaging, healing, health)
+            self.id = player_id
+            self.opponent: Combat.BaseClass | None = None
+
+        def ouput(self, text: str):
+            pass
+
+        def make_move(self):
+            '''Uses the enemy AI against the opponent to pick a move'''
+            return super().make_move(self.opponent)
+
+    class ScriptedPlayer(Combat.Player):
+        '''A player whose moves are picked by `strategy(player, enemy)` instead of input'''
+        __slots__ = ('strategy', 'opponent')
+        def __init__(self, player_id: int, name: str, max_health: int, damaging: list[Combat.Item], healing: list[Combat.Item], strategy, health=None) -> None:
+            super().__init__(player_id, name, max_health, damaging, healing, health)
+            self.strategy = strategy
+            self.opponent: Combat.BaseClass | None = None
+
+        def ouput(self, text: str):
+            pass
+
+        def make_move(self):
+            '''Returns the item picked by the strategy'''
+            return self.strategy(self, self.opponent)
+
+    def __init__(self,
+            damaging: list[objects.CombatItem],
+            healing: list[objects.CombatItem],
+            max_health: int = 10,
+            difficulty: float = None,
+            risk: float = None,
+            player_difficulty: float = None,
+            player_risk: float = None,
+            strategy = None,
+            run: bool = True
+        ) -> None:
+        # No call to Combat.__init__, there is no DB connection to open
+        self.enemy_difficulty = difficulty
+        self.enemy_risk = risk
+        self.player_difficulty = player_difficulty
+        self.player_risk = player_risk
+        self.strategy = strategy
+        self.create_instances(None, 'player', max_health, damaging, healing)
+        self.result: objects.CombatResult | None = None
+        if run: # Otherwise the rounds are played by the caller (see batch.py)
+            self.result = self.main()
+
+    def create_instances(self, player_id: int, name: str, max_health: int, damaging: list[objects.CombatItem], healing: list[objects.CombatItem]):
+        '''Creates the AI (or scripted) player and the enemy, both with a copy of the items'''
+        def to_combat_items(items: list[objects.CombatItem]):
+            return [Combat.Item(item.id, item.name, item.count, item.range, item.turns, item.experience) for item in items]
+
+        if self.strategy:
+            self.player = self.ScriptedPlayer(player_id, name, max_health, to_combat_items(damaging), to_combat_items(healing), self.strategy)
+        else:
+            self.player = self.AIPlayer(player_id, name, max_health, to_combat_items(damaging), to_combat_items(healing), difficulty=self.player_difficulty, risk=self.player_risk)
+        self.enemy = self.Enemy(self.player, to_combat_items(damaging), to_combat_items(healing), difficulty=self.enemy_difficulty, risk=self.enemy_risk)
+        self.player.opponent = self.enemy
+        self.instances = (self.player, self.enemy)
+        self.health_history = [(self.player.health, self.enemy.health)]
+
+    def ouput(self, text: str):
+        pass
+
+    def display_combat(self):
+        pass
+
+    def update_db_items(self, player: Combat.Player):
+        '''Simulated combats never write to the DB'''
+        pass
+
+def random_strategy(player: Combat.Player, enemy: Combat.Enemy):
+    '''Picks a random item from the players items'''
+    return choice(player.get_all_items())
+
+def strongest_attack_strategy(player: Combat.Player, enemy: Combat.Enemy):
+    '''Always attacks with the item with the largest range avg, or heals if there are no attacks'''
+    return max(player.damaging or player.healing, key=attrgetter('range_avg'))
+
+def simulate(damaging: list[objects.CombatItem], healing: list[objects.CombatItem], max_health: int = 10, **kwargs):
+    '''Runs a single headless combat, returning its CombatResult'''
+    return SimulatedCombat(damaging, healing, max_health, **kwargs).result
+
+class SimulationStats:
+    '''Running totals for a set of simulated combats, results are added one at a time so they never need to be kept'''
+    def __init__(self) -> None:
+        self.fights: int = 0
+        self.enemy_wins: int = 0
+        self.player_moves: int = 0
+        self.enemy_moves: int = 0
+        self.player_health: Counter[int] = Counter() # Final health -> number of fights
+        self.enemy_health: Counter[int] = Counter()
+
+    def add(self, result: objects.CombatResult):
+        '''Adds a single CombatResult to the totals'''
+        self.fights += 1
+        if result.winner == 'enemy':
+            self.enemy_wins += 1
+        self.player_moves += result.player_moves
+        self.enemy_moves += result.enemy_moves
+        self.player_health[result.player_health[-1]] += 1
+        self.enemy_health[result.enemy_health[-1]] += 1
+
+    def merge(self, other: SimulationStats):
+        '''Adds the totals of `other` to self'''
+        self.fights += other.fights
+        self.enemy_wins += other.enemy_wins
+        self.player_moves += other.player_moves
+        self.enemy_moves += other.enemy_moves
+        self.player_health.update(other.player_health)
+        self.enemy_health.update(other.enemy_health)
+
+    def enemy_win_rate(self):
+        '''Returns a float between 0-1 representing the % of fights the enemy won'''
+        return self.enemy_wins/self.fights if self.fights else 0
+
+    def mean_player_moves(self):
+        return self.player_moves/self.fights if self.fights else 0
+
+    def mean_enemy_moves(self):
+        return self.enemy_moves/self.fights if self.fights else 0
+
+def fetch_loadouts(querier: Querier, player_ids: list[int]):
+    '''Returns the (damaging, healing) combat items of each player, for use as simulation loadouts'''
+    return [querier.players.fetch_combat_items(player_id) for player_id in player_ids]
+
+def _run_chunk(damaging: list[objects.CombatItem], healing: list[objects.CombatItem], max_health: int, difficulty: float, risk: float,
+        player_difficulty: float, player_risk: float, first_fight: int, fights: int, base_seed: int):
+    '''Runs `fights` combats in a worker process, returning their SimulationStats.
+    Every fight is seeded from its own number so results do not depend on how fights are split between workers'''
+    stats = SimulationStats()
+    for fight in range(first_fight, first_fight+fights):
+        seed(base_seed*1_000_000_007 + fight)
+        stats.add(simulate(damaging, healing, max_health, difficulty=difficulty, risk=risk, player_difficulty=player_difficulty, player_risk=player_risk))
+    return stats
+
+def run_simulations(
+        loadouts: list[tuple[list[objects.CombatItem], list[objects.CombatItem]]],
+        difficulties: list[float],
+        risks: list[float],
+        fights: int,
+        max_health: int = 10,
+        base_seed: int = 0,
+        workers: int = None,
+        chunk_size: int = 500,
+        player_difficulties: list[float] = (0.5,),
+        player_risks: list[float] = (0.5,)
+    ):
+    '''Simulates `fights` Enemy-vs-Enemy combats for every combination of loadout, enemy difficulty and risk
+    and player difficulty and risk across a process pool.
+    Returns a `dict: [(loadout_index, difficulty, risk, player_difficulty, player_risk), SimulationStats]`'''
+    results: dict[tuple[int, float, float, float, float], SimulationStats] = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        fight_number = 0 # Unique across the whole sweep, used to seed each fight
+        for loadout_index, (damaging, healing) in enumerate(loadouts):
+            for difficulty, risk, player_difficulty, player_risk in product(difficulties, risks, player_difficulties, player_risks):
+                key = (loadout_index, difficulty, risk, player_difficulty, player_risk)
+                results[key] = SimulationStats()
+                for first_fight in range(0, fights, chunk_size):
+                    future = executor.submit(_run_chunk, damaging, healing, max_health, difficulty, risk, player_difficulty, player_risk,
+                        fight_number+first_fight, min(chunk_size, fights-first_fight), base_seed)
+                    futures[future] = key
+                fight_number += fights
+
+        # Merge each chunk as soon as it finishes
+        for future in as_completed(futures):
+            results[futures.pop(future)].merge(future.result())
+    return results
@@ -88,28 +88,23 @@ WHERE player_id = $player_id AND
 
 -- Select item with consumable data and join
 SELECT type, Items.item_id, name, quantity, min_range, max_range, min_turns, max_turns, min_experience, max_experience
-FROM Items
-INNER JOIN PlayerItems ON Items.item_id = PlayerItems.item_id
+FROM PlayerItems
+INNER JOIN Items ON Items.item_id = PlayerItems.item_id
 INNER JOIN ConsumableData ON Items.consumable_id = ConsumableData.consumable_id
-WHERE Items.item_id IN (
-    SELECT PlayerItems.item_id
-    FROM PlayerItems
-    WHERE player_id = $player_id
-) AND
-Items.consumable_id IS NOT NULL AND
+WHERE PlayerItems.player_id = $player_id AND
 type IN ('damage', 'heal');
 
+-- Indexes for the above (PlayerItems(player_id) is covered by the PlayerItems primary key)
+CREATE INDEX IF NOT EXISTS ItemsConsumableIdIndex ON Items(consumable_id);
+CREATE INDEX IF NOT EXISTS ConsumableDataTypeIndex ON ConsumableData(type);
 
--- Update item in players inv
-UPDATE PlayerItems
-    SET quantity = quantity + $amount
-WHERE player_id = $player_id AND
-    id = $item_id
-RETURNING quantity;
 
--- Add an item to players inv
-INSERT INTO PlayerItems
-VALUES ($player_id, $id, $quantity);
+-- Add an item to players inv, or add to its quantity if they already have it
+INSERT INTO PlayerItems (player_id, item_id, quantity)
+VALUES ($player_id, $item_id, $amount)
+ON CONFLICT (player_id, item_id) DO UPDATE
+SET quantity = PlayerItems.quantity + EXCLUDED.quantity
+RETURNING quantity;
 
 
 -- Sequence to keep track of the next recipe_id
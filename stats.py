@@ -0,0 +1,82 @@
+from __future__ import annotations
+from bisect import bisect_left
+from threading import Lock
+import json
+
+class QueryStat:
+    '''The totals and latency histogram for a single named query'''
+    # Upper bounds (in seconds) of the histogram buckets, the last bucket catches everything slower
+    buckets: tuple[float, ...] = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, float('inf'))
+    __slots__ = ('calls', 'rows', 'total', 'max', 'histogram')
+    def __init__(self) -> None:
+        self.calls: int = 0
+        self.rows: int = 0
+        self.total: float = 0 # Seconds
+        self.max: float = 0
+        self.histogram: list[int] = [0]*len(self.buckets)
+
+    def add(self, seconds: float, rows: int):
+        self.calls += 1
+        self.rows += max(0, rows) # rowcount is -1 when it is not known
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.histogram[bisect_left(self.buckets, seconds)] += 1
+
+    def percentile(self, fraction: float):
+        '''Estimates a latency percentile from the histogram, returning the upper bound of the bucket it falls in'''
+        target = fraction*self.calls
+        seen = 0
+        for bound, count in zip(self.buckets, self.histogram):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            'calls': self.calls,
+            'rows': self.rows,
+            'total_ms': self.total*1000,
+            'mean_ms': self.total/self.calls*1000 if self.calls else 0,
+            'p50_ms': self.percentile(0.5)*1000,
+            'p95_ms': self.percentile(0.95)*1000,
+            'max_ms': self.max*1000,
+            'histogram': {('inf' if bound == float('inf') else f'{bound*1000:g}ms'): count for bound, count in zip(self.buckets, self.histogram)}
+        }
+
+class QueryStats:
+    '''Call counts, rows returned/affected and latency histograms of every query run through BaseConnection.execute(),
+    keyed by query name. Safe to share between threads'''
+    def __init__(self) -> None:
+        self.queries: dict[str, QueryStat] = {}
+        self.lock = Lock()
+
+    def record(self, name: str, seconds: float, rows: int):
+        '''Adds one execution of the query `name`'''
+        with self.lock:
+            stat = self.queries.get(name)
+            if stat is None:
+                stat = self.queries[name] = QueryStat()
+            stat.add(seconds, rows)
+
+    def reset(self):
+        with self.lock:
+            self.queries.clear()
+
+    def to_dict(self):
+        '''Returns a `dict: [query name, stats]` ordered by total time spent, slowest first'''
+        with self.lock:
+            ordered = sorted(self.queries.items(), key=lambda item: item[1].total, reverse=True)
+            return {name: stat.to_dict() for name, stat in ordered}
+
+    def dump(self, path: str):
+        '''Writes the stats to `path` as JSON'''
+        with open(path, 'w') as file:
+            json.dump(self.to_dict(), file, indent=4)
+
+    def report(self):
+        '''Returns the stats as a table, one line per query'''
+        lines = [f'{"query":<28} {"calls":>8} {"rows":>9} {"total ms":>10} {"mean ms":>9} {"p95 ms":>9} {"max ms":>9}']
+        for name, stat in self.to_dict().items():
+            lines.append(f'{name:<28} {stat["calls"]:>8} {stat["rows"]:>9} {stat["total_ms"]:>10.1f} {stat["mean_ms"]:>9.2f} {stat["p95_ms"]:>9.2f} {stat["max_ms"]:>9.2f}')
+        return '\n'.join(lines)
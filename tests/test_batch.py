@@ -0,0 +1,46 @@
+from random import Random, random
+from batch import BatchSimulation, decide_moves
+from simulate import SimulatedCombat
+import numpy as np
+import objects
+
+def scalar_combat(batch: BatchSimulation, game: int, damaging: list[objects.CombatItem], healing: list[objects.CombatItem], max_health: int):
+    '''Returns a SimulatedCombat in the same state as `game` of the batch'''
+    combat = SimulatedCombat(damaging, healing, max_health, difficulty=batch.enemy.difficulty[game], risk=batch.enemy.risk[game],
+        player_difficulty=batch.player.difficulty[game], player_risk=batch.player.risk[game], run=False)
+    for instance, side in ((combat.player, batch.player), (combat.enemy, batch.enemy)):
+        instance.health = int(side.health[game])
+        for column, item in enumerate(instance.damaging + instance.healing):
+            item.count = int(side.counts[game, column])
+            if not side.held[game, column]:
+                instance.remove_item(instance.healing if side.is_heal[column] else instance.damaging, item)
+    return combat
+
+def test_batch_moves_are_scalar_candidates(random_loadout):
+    '''Every move the batch decides is one Enemy.make_move() could make in the same state'''
+    for loadout in range(40):
+        rng = Random(loadout)
+        damaging, healing = random_loadout(rng)
+        max_health = rng.randint(5, 15)
+        columns = {item.id: column for column, item in enumerate(damaging + healing)}
+        batch = BatchSimulation(damaging, healing, 50, max_health, seed=loadout)
+        while batch.active.any():
+            for side, opponent in ((batch.player, batch.enemy), (batch.enemy, batch.player)):
+                games = np.flatnonzero(batch.active & (side.cooldown == 0) & (side.health > 0))
+                for game, column in zip(games, decide_moves(side, opponent, games, np.random.default_rng(loadout))):
+                    combat = scalar_combat(batch, game, damaging, healing, max_health)
+                    instance, target = (combat.player, combat.enemy) if side is batch.player else (combat.enemy, combat.player)
+                    move, attacks, heals = instance.move_candidates(target)
+                    candidates = [move] if move is not None else attacks + heals
+                    assert column in [side.punch if item.name == objects.PUNCH.name else columns[item.id] for item in candidates]
+            batch.step()
+
+def test_searched_games_follow_the_seed(random_loadout):
+    '''Games played with the search (difficulty of at least 0.65) give the same results for the same seed'''
+    damaging, healing = random_loadout(Random(3))
+    def results():
+        return [(result.winner, result.player_health, result.enemy_health)
+            for result in BatchSimulation(damaging, healing, 20, difficulty=0.7, player_difficulty=0.7, seed=7).run()]
+    first = results()
+    random() # Moves the random module on, so only the batch's seed decides the results
+    assert results() == first
@@ -0,0 +1,23 @@
+from random import Random, seed
+from simulate import simulate
+from combat import Combat, DecisionCache
+
+def play(fights: int, random_loadout):
+    '''Plays seeded Enemy-vs-Enemy fights with the heuristic AI, returning what happened in each'''
+    results = []
+    for fight in range(fights):
+        rng = Random(fight)
+        damaging, healing = random_loadout(rng, fixed=True)
+        seed(fight)
+        result = simulate(damaging, healing, 10, difficulty=rng.choice((0.3, 0.5)), risk=rng.choice((0.4, 0.6)),
+            player_difficulty=rng.choice((0.3, 0.5)), player_risk=rng.choice((0.4, 0.6)))
+        results.append((result.winner, result.player_health, result.enemy_health))
+    return results
+
+def test_decision_cache_does_not_change_outcomes(monkeypatch, random_loadout):
+    monkeypatch.setattr(Combat.Enemy, 'decision_cache', DecisionCache(0))
+    uncached = play(3000, random_loadout)
+    cache = DecisionCache(50_000)
+    monkeypatch.setattr(Combat.Enemy, 'decision_cache', cache)
+    assert play(3000, random_loadout) == uncached
+    assert cache.hits
@@ -0,0 +1,152 @@
+from load import parse_chunk, split_csv, validate_row
+from memory import MemoryLoader, MemoryStore
+import csv
+import json
+import pytest
+
+VALID = ['sword', '10', 'rare', '1', 'weapon', 'damage', '2', '4', '1', '2', '1', '2', '']
+
+@pytest.mark.parametrize('changes, reason', [
+    ({}, None),
+    ({5: '', 6: '', 7: '', 8: '', 9: '', 10: '', 11: ''}, None),
+    ({12: 'stick,stone'}, None),
+    ({0: ''}, 'missing name'),
+    ({4: ''}, 'missing category'),
+    ({2: 'shiny'}, "invalid rarity 'shiny'"),
+    ({1: 'ten'}, "value 'ten' is not a whole number"),
+    ({3: '40000'}, "level '40000' is not a whole number"),
+    ({7: ''}, "range '2'-'' is not a pair of whole numbers"),
+    ({8: '3'}, 'experience 3-2 ends before it starts'),
+    ({12: 'stick,,stone'}, 'recipe has an empty ingredient name'),
+    ({0: 'sw�rd'}, 'not valid UTF-8'),
+])
+def test_validate_row(changes: dict, reason: str | None):
+    row = [changes.get(index, value) for index, value in enumerate(VALID)]
+    assert validate_row(row) == reason
+
+def test_validate_row_counts_columns():
+    assert validate_row(VALID[:5]) == 'expected 13 columns, found 5'
+
+def write_csv(tmp_path, rows: int):
+    '''Writes a csv of `rows` valid items named `item <number>`, returning its path'''
+    csv_path = tmp_path / 'items.csv'
+    with open(csv_path, 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        for number in range(rows):
+            writer.writerow([f'item {number}', *VALID[1:]])
+    return str(csv_path)
+
+@pytest.mark.parametrize('chunks', [1, 2, 3, 7, 16, 200])
+def test_split_csv_at_line_starts(tmp_path, chunks: int):
+    '''The chunks are contiguous, cover the whole file and each one starts at the start of a line'''
+    csv_path = write_csv(tmp_path, 50)
+    with open(csv_path, 'rb') as csv_file:
+        data = csv_file.read()
+    ranges = split_csv(csv_path, chunks)
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(data)
+    assert all(end == start for (_, end), (start, _) in zip(ranges, ranges[1:]))
+    assert all(start == 0 or data[start-1:start] == b'\n' for start, _ in ranges)
+    assert len(ranges) <= chunks
+
+def test_parse_chunk(tmp_path):
+    '''Blank lines are skipped but counted, and rejects keep the line number they were read from'''
+    csv_path = tmp_path / 'items.csv'
+    csv_path.write_bytes(b'sword,10,rare,1,weapon,damage,2,4,1,2,1,2,\n\n'
+        + b'dagger,5,shiny,1,weapon,damage,1,2,1,2,1,2,\n'
+        + b'cl\xffb,8,common,1,weapon,damage,1,3,1,2,1,2,\n'
+        + b'potion,5,common,0,consumable,heal,1,3,1,1,1,1,"sword,sword"\n')
+    rows, rejects, lines = parse_chunk(str(csv_path), 0, csv_path.stat().st_size)
+    assert [(row.line, row.name, row.recipe) for row in rows] == [(1, 'sword', ()), (5, 'potion', ('sword', 'sword'))]
+    assert [(line, reason) for line, reason, _ in rejects] == [(3, "invalid rarity 'shiny'"), (4, 'not valid UTF-8')]
+    assert lines == 5
+
+class ParallelLoader(MemoryLoader):
+    parse_workers = 2
+    parallel_parse_bytes = 0 # Every file is split between the workers
+
+def test_parallel_parse_matches_serial(tmp_path):
+    '''Parsing in chunks in a process pool gives the same items, recipes and rejects (with file line numbers) as one pass'''
+    csv_path = write_csv(tmp_path, 200)
+    with open(csv_path, 'a', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(['item 3', *VALID[1:]]) # A repeat of a name
+        writer.writerow(['broken', 'ten', *VALID[2:]])
+        writer.writerow(['crafted', *VALID[1:12], 'item 0,item 1,item 1'])
+    serial_store, parallel_store = MemoryStore(), MemoryStore()
+    serial, parallel = MemoryLoader(serial_store, None, csv_path), ParallelLoader(parallel_store, None, csv_path)
+    assert serial.lines == parallel.lines and serial.rejects == parallel.rejects
+    assert serial_store.items == parallel_store.items and serial_store.recipes == parallel_store.recipes
+    assert sorted(line for line, _, _ in serial.rejects) == [201, 202]
+
+def test_rejects_are_written(tmp_path):
+    '''Rejected rows go to <csv>.rejects.csv with their line number and reason, and the file goes once every row loads'''
+    csv_path = write_csv(tmp_path, 3)
+    with open(csv_path, 'a', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(['item 0', *VALID[1:]])
+        writer.writerow(['crafted', *VALID[1:12], 'item 0,unknown'])
+    loader = MemoryLoader(MemoryStore(), None, csv_path)
+    with open(f'{csv_path}.rejects.csv', newline='') as rejects_file:
+        rejects = list(csv.reader(rejects_file))
+    assert [row[:2] for row in rejects] == [['4', 'duplicate name, first used on line 1'],
+        ['5', 'item loaded without its recipe, unknown ingredients: unknown']]
+    assert 'crafted' in loader.querier.items.fetch_name_id_map()
+
+    write_csv(tmp_path, 3)
+    MemoryLoader(MemoryStore(), None, csv_path)
+    assert not (tmp_path / 'items.csv.rejects.csv').exists()
+
+class CheckpointLoader(MemoryLoader):
+    '''A MemoryLoader that checkpoints like the Postgres one, and can be made to crash before a checkpoint is saved'''
+    use_checkpoint = True
+    chunk_size = 3
+    crash_at: dict[str, int] = {}
+    pushed: list[str] = []
+
+    def save_checkpoint(self):
+        if self.checkpoint == self.crash_at: # The chunk is committed but the checkpoint is never saved
+            raise OSError('crashed')
+        super().save_checkpoint()
+
+    def push_items(self, items):
+        self.pushed.extend(item.name for item in items)
+        return super().push_items(items)
+
+@pytest.mark.parametrize('crash_at, saved', [
+    ({'items': 6, 'recipes': 0}, {'items': 3, 'recipes': 0}),
+    ({'items': 15, 'recipes': 3}, {'items': 15, 'recipes': 0}),
+])
+def test_checkpoint_resume(tmp_path, monkeypatch, crash_at: dict, saved: dict):
+    '''A load that stops between a commit and its checkpoint resumes from the last checkpoint,
+    pushing the chunk again adds nothing and the result is the same as an uninterrupted load'''
+    csv_path = write_csv(tmp_path, 10)
+    with open(csv_path, 'a', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        for number in range(5):
+            writer.writerow([f'crafted {number}', *VALID[1:12], f'item {number},item {number+1}'])
+    expected = MemoryStore()
+    MemoryLoader(expected, None, csv_path)
+
+    store = MemoryStore()
+    monkeypatch.setattr(CheckpointLoader, 'crash_at', crash_at)
+    monkeypatch.setattr(CheckpointLoader, 'pushed', [])
+    CheckpointLoader(store, None, csv_path)
+    with open(f'{csv_path}.checkpoint.json') as checkpoint_file:
+        checkpoint = json.load(checkpoint_file)
+    assert (checkpoint['items'], checkpoint['recipes']) == (saved['items'], saved['recipes'])
+
+    monkeypatch.setattr(CheckpointLoader, 'crash_at', {})
+    monkeypatch.setattr(CheckpointLoader, 'pushed', [])
+    CheckpointLoader(store, None, csv_path)
+    assert len(CheckpointLoader.pushed) == 15 - saved['items']
+    assert store.items == expected.items and store.recipes == expected.recipes
+    assert not (tmp_path / 'items.csv.checkpoint.json').exists()
+
+def test_corrupt_checkpoint_stops_the_load(tmp_path, capsys):
+    csv_path = write_csv(tmp_path, 3)
+    with open(f'{csv_path}.checkpoint.json', 'w') as checkpoint_file:
+        checkpoint_file.write('{"items": ')
+    store = MemoryStore()
+    CheckpointLoader(store, None, csv_path)
+    assert 'checkpoint' in capsys.readouterr().out and not store.items
+    assert (tmp_path / 'items.csv.checkpoint.json').exists()
@@ -0,0 +1,91 @@
+from memory import MemoryLoader, MemoryQuerier, MemoryStore
+from query import Catalogue
+import pytest
+
+CSV = '''stick,1,common,0,material,,,,,,,,
+stone,2,common,0,material,,,,,,,,
+sword,10,rare,1,weapon,damage,2,4,1,2,1,2,
+potion,5,common,0,consumable,heal,1,3,1,1,1,1,
+club,8,uncommon,1,weapon,damage,1,3,1,2,1,2,"stick,stick,stone"
+'''
+
+@pytest.fixture
+def store(tmp_path):
+    '''A MemoryStore with the items of CSV loaded into it'''
+    csv_path = tmp_path / 'items.csv'
+    csv_path.write_text(CSV)
+    store = MemoryStore()
+    MemoryLoader(store, None, str(csv_path))
+    return store
+
+@pytest.fixture
+def querier(store):
+    return MemoryQuerier(store, None)
+
+def test_loaded_items(store, querier):
+    '''Every row is loaded through the staged path, with its consumable data and recipe'''
+    catalogue = querier.items.load_catalogue()
+    assert sorted(catalogue.name_id_map) == ['club', 'potion', 'stick', 'stone', 'sword']
+    sword = catalogue.items[catalogue.name_id_map['sword']]
+    assert (sword.type, sword.range, sword.experience, sword.turns) == ('damage', range(2,4), range(1,2), range(1,2))
+    assert catalogue.items[catalogue.name_id_map['stick']].type is None
+    club = store.items[catalogue.name_id_map['club']]
+    assert store.recipes[club['recipe_id']] == {catalogue.name_id_map['stick']: 2, catalogue.name_id_map['stone']: 1}
+    assert len(store.consumable_data) == 3
+
+def test_loading_again_adds_nothing(store, tmp_path):
+    '''Items are matched by name and items with a recipe are skipped, so a second load changes nothing'''
+    items, recipes = dict(store.items), dict(store.recipes)
+    MemoryLoader(store, None, str(tmp_path / 'items.csv'))
+    assert store.items == items and store.recipes == recipes
+
+def test_get_item_id(querier):
+    catalogue = querier.items.load_catalogue()
+    stick = catalogue.name_id_map['stick']
+    assert querier.items.get_item_id(catalogue, 'stick') == stick
+    assert querier.items.get_item_id(catalogue, str(stick)) == stick
+    assert querier.items.get_item_id(catalogue, stick) == stick
+    assert querier.items.get_item_id(catalogue, 'no such item') is None
+    assert querier.items.get_item_id(catalogue, 999) is None
+
+def test_catalogue_invalidated_during_a_load_is_not_cached():
+    '''A load that started before an invalidation returns its items without caching them'''
+    catalogue = Catalogue()
+    generation = catalogue.generation
+    catalogue.invalidate()
+    loaded = catalogue.load([], generation)
+    assert loaded is not catalogue and loaded.is_loaded()
+    assert not catalogue.is_loaded()
+    assert catalogue.load([], catalogue.generation) is catalogue and catalogue.is_loaded()
+
+def test_players_are_paged_in_id_order(querier):
+    added = [querier.players.add_player(f'player {number}').id for number in range(7)]
+    querier.players.delete_player(added[3])
+    expected = [player_id for player_id in added if player_id != added[3]]
+    assert [player.id for player in querier.players.iter_players(page_size=2)] == expected
+    assert [player.id for player in querier.players.stream_players(itersize=3)] == expected
+    assert sorted(player.id for player in querier.players.fetch_players()) == expected
+    assert querier.players.fetch_player(added[3]) is None
+
+def test_player_items(querier):
+    catalogue = querier.items.load_catalogue()
+    sword, potion, stick = (catalogue.name_id_map[name] for name in ('sword', 'potion', 'stick'))
+    player = querier.players.add_player('player')
+    other = querier.players.add_player('other')
+    assert querier.players.update_player_item(player.id, sword, 2) == 2
+    assert querier.players.update_player_item(player.id, sword, 1) == 3
+    grants = querier.players.grant_player_items([(player.id, potion, 4), (player.id, stick, 1), (other.id, sword, 1)])
+    assert grants == {(player.id, potion): 4, (player.id, stick): 1, (other.id, sword): 1}
+
+    items = querier.players.fetch_player_items(player.id)
+    assert sorted((item.id, item.count) for item in items) == sorted([(sword, 3), (potion, 4), (stick, 1)])
+    assert [item.id for item in querier.players.iter_player_items(player.id, page_size=1)] == sorted([sword, potion, stick])
+    assert [item.id for item in querier.players.stream_player_items(player.id, itersize=2)] == sorted([sword, potion, stick])
+
+    damaging, healing = querier.players.fetch_combat_items(player.id)
+    assert [(item.id, item.count) for item in damaging] == [(sword, 3)]
+    assert [(item.id, item.count) for item in healing] == [(potion, 4)]
+
+    querier.players.set_or_delete_player_items(player.id, {sword: 1, potion: 0})
+    assert sorted((item.id, item.count) for item in querier.players.fetch_player_items(player.id)) == sorted([(sword, 1), (stick, 1)])
+    assert [(item.id, item.count) for item in querier.players.fetch_player_items(other.id)] == [(sword, 1)]
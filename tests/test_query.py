@@ -0,0 +1,62 @@
+from query import BaseConnection, Players, to_positional_params
+from dotenv import load_dotenv
+from setup import Setup
+from os import getenv
+import psycopg2
+import pytest
+
+@pytest.fixture
+def cursor():
+    '''A cursor on the database configured for main.py, with the tables made by Setup in a schema of their own.
+    Everything is rolled back afterwards so the database is left as it was'''
+    load_dotenv()
+    if not getenv('DB_NAME'):
+        pytest.skip('No database configured (DB_NAME etc. as used by main.py)')
+    connection = psycopg2.connect(user=getenv('DB_USERNAME'), password=getenv('DB_PASS'), host=getenv('DB_HOST'), database=getenv('DB_NAME'))
+    try:
+        with connection.cursor() as cur:
+            cur.execute('CREATE SCHEMA explain_test;')
+            cur.execute('SET LOCAL search_path TO explain_test;')
+            Setup(connection, cur)
+            # The tables are empty, so make the planner pick an index wherever one can be used
+            cur.execute('SET LOCAL enable_seqscan = off;')
+            yield cur
+    finally:
+        connection.rollback()
+        connection.close()
+
+def plan_nodes(plan: dict):
+    '''Yields every node of an EXPLAIN (FORMAT JSON) plan'''
+    yield plan
+    for child in plan.get('Plans', ()):
+        yield from plan_nodes(child)
+
+def explain(cur, query: str, params: tuple = ()):
+    cur.execute(f'EXPLAIN (FORMAT JSON) {query}', params)
+    return list(plan_nodes(cur.fetchone()[0][0]['Plan']))
+
+def test_combat_item_query_uses_indexes(cursor, monkeypatch):
+    # Run the real query from Players, as an EXPLAIN
+    monkeypatch.setattr(BaseConnection, 'execute', lambda self, cur, name, query, params=(), prepare=False: cur.execute(f'EXPLAIN (FORMAT JSON) {query}', params))
+    nodes = list(plan_nodes(Players(None, cursor)._fetch_combat_items_query(1)[0][0][0]['Plan']))
+    assert not [node for node in nodes if node['Node Type'] == 'Seq Scan']
+    # Only the player's rows of PlayerItems are read, through its primary key (player_id, item_id)
+    player_items = [node for node in nodes if node.get('Relation Name') == 'playeritems']
+    assert player_items
+    for node in player_items:
+        if node['Node Type'] == 'Bitmap Heap Scan':
+            # The index is named on the Bitmap Index Scan underneath
+            node, = node['Plans']
+        assert node.get('Index Name') == 'playeritems_pkey' and 'player_id' in node.get('Index Cond', '')
+
+def test_setup_indexes_are_used(cursor):
+    nodes = explain(cursor, 'SELECT item_id FROM Items WHERE consumable_id = %s;', (1,))
+    assert 'itemsconsumableidindex' in {node.get('Index Name') for node in nodes}
+    nodes = explain(cursor, "SELECT consumable_id FROM ConsumableData WHERE type IN ('damage', 'heal');")
+    assert 'consumabledatatypeindex' in {node.get('Index Name') for node in nodes}
+
+def test_to_positional_params():
+    '''%s placeholders are numbered in order and escaped percent signs are unescaped, as PREPARE expects'''
+    assert to_positional_params('SELECT %s, %s WHERE name LIKE %s;') == 'SELECT $1, $2 WHERE name LIKE $3;'
+    assert to_positional_params("SELECT 10 %% 3, '%%s', %s;") == "SELECT 10 % 3, '%s', $1;"
+    assert to_positional_params('SELECT 1;') == 'SELECT 1;'
@@ -0,0 +1,37 @@
+from stats import QueryStat, QueryStats
+import json
+import pytest
+
+def test_query_stat():
+    stat = QueryStat()
+    for seconds in (0.0002, 0.0002, 0.003, 0.2):
+        stat.add(seconds, 2)
+    stat.add(0.0004, -1) # rowcount is -1 when it is not known
+    stats = stat.to_dict()
+    assert (stats['calls'], stats['rows']) == (5, 8)
+    assert stats['total_ms'] == pytest.approx(203.8) and stats['max_ms'] == pytest.approx(200)
+    assert stats['p50_ms'] == 0.5 # The upper bound of the bucket the middle call falls in
+    assert stats['p95_ms'] == pytest.approx(200) # The last bucket is capped at the slowest call
+    assert sum(stats['histogram'].values()) == 5 and stats['histogram']['0.5ms'] == 3
+
+def test_empty_query_stat():
+    stats = QueryStat().to_dict()
+    assert (stats['calls'], stats['mean_ms'], stats['p95_ms']) == (0, 0, 0)
+
+def test_query_stats(tmp_path):
+    stats = QueryStats()
+    stats.record('fast', 0.001, 1)
+    stats.record('slow', 0.5, 10)
+    stats.record('fast', 0.001, 1)
+    assert list(stats.to_dict()) == ['slow', 'fast'] # Slowest first
+    assert stats.to_dict()['fast']['calls'] == 2
+
+    report = stats.report().splitlines()
+    assert len(report) == 3 and report[1].startswith('slow') and report[2].startswith('fast')
+
+    stats.dump(tmp_path / 'stats.json')
+    with open(tmp_path / 'stats.json') as stats_file:
+        assert json.load(stats_file) == json.loads(json.dumps(stats.to_dict()))
+
+    stats.reset()
+    assert stats.to_dict() == {}
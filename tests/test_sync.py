@@ -0,0 +1,96 @@
+from memory import MemoryLoader, MemoryQuerier, MemoryStore, MemorySyncer
+import csv
+import pytest
+
+CSV = '''stick,1,common,0,material,,,,,,,,
+stone,2,common,0,material,,,,,,,,
+sword,10,rare,1,weapon,damage,2,4,1,2,1,2,
+potion,5,common,0,consumable,heal,1,3,1,1,1,1,
+club,8,uncommon,1,weapon,damage,1,3,1,2,1,2,"stick,stick,stone"
+'''
+
+@pytest.fixture
+def csv_path(tmp_path):
+    csv_path = tmp_path / 'items.csv'
+    csv_path.write_text(CSV)
+    return str(csv_path)
+
+@pytest.fixture
+def store(csv_path):
+    '''A MemoryStore loaded from CSV, with a player who has one of every item'''
+    store = MemoryStore()
+    MemoryLoader(store, None, csv_path)
+    querier = MemoryQuerier(store, None)
+    player = querier.players.add_player('player')
+    querier.players.grant_player_items([(player.id, item_id, 1) for item_id in store.items])
+    return store
+
+def sync(store: MemoryStore, csv_path: str, text: str):
+    '''Syncs the store to a csv of `text`, returning the syncer'''
+    with open(csv_path, 'w') as csv_file:
+        csv_file.write(text)
+    return MemorySyncer(store, None, csv_path)
+
+def recipes(store: MemoryStore):
+    '''Returns `dict: [item name, dict: [ingredient name, quantity]]` for every item with a recipe'''
+    return {item['name']: {store.items[ingredient_id]['name']: quantity for ingredient_id, quantity in store.recipes[item['recipe_id']].items()}
+        for item in store.items.values() if item['recipe_id'] is not None}
+
+def test_same_file_changes_nothing(store, csv_path, capsys):
+    items, consumable_data, recipe_rows = dict(store.items), dict(store.consumable_data), dict(store.recipes)
+    sync(store, csv_path, CSV)
+    assert 'Synced the catalogue: 0 items added, 0 updated, 0 removed, 0 consumable data changed, 0 recipes rebuilt.' in capsys.readouterr().out
+    assert (store.items, store.consumable_data, store.recipes) == (items, consumable_data, recipe_rows)
+
+def test_items_are_added_updated_and_removed(store, csv_path):
+    '''Kept items keep their ids and players keep their stock of them, only the stock of removed items goes'''
+    ids = dict(store.item_names)
+    sync(store, csv_path, '''stick,1,common,0,material,,,,,,,,
+stone,3,rare,0,material,,,,,,,,
+sword,10,rare,1,weapon,damage,3,5,1,2,1,2,
+club,8,uncommon,1,weapon,,,,,,,,"stick,stick,stone"
+axe,12,epic,2,weapon,damage,2,6,1,3,2,3,"stick,stone,stone"
+shield,9,common,1,armour,heal,1,2,1,1,1,1,
+''')
+    assert set(store.item_names) == {'stick', 'stone', 'sword', 'club', 'axe', 'shield'}
+    assert all(store.item_names[name] == ids[name] for name in ('stick', 'stone', 'sword', 'club'))
+    assert (store.items[ids['stone']]['value'], store.items[ids['stone']]['rarity']) == (3, 'rare')
+
+    sword = store.consumable_data[store.items[ids['sword']]['consumable_id']]
+    assert (sword['min_range'], sword['max_range']) == (3, 5)
+    assert store.items[ids['club']]['consumable_id'] is None
+    assert store.consumable_data[store.items[store.item_names['shield']]['consumable_id']]['type'] == 'heal'
+    assert len(store.consumable_data) == 3 # sword, axe and shield
+
+    assert recipes(store) == {'club': {'stick': 2, 'stone': 1}, 'axe': {'stick': 1, 'stone': 2}}
+    assert set(store.player_items[1]) == {ids[name] for name in ('stick', 'stone', 'sword', 'club')}
+
+def test_changed_recipe_is_rebuilt(store, csv_path):
+    sync(store, csv_path, CSV.replace('"stick,stick,stone"', '"stone,potion"'))
+    assert recipes(store) == {'club': {'stone': 1, 'potion': 1}}
+    assert len(store.recipes) == 1
+
+def test_rejected_rows_are_kept(store, csv_path):
+    '''An item whose row is rejected is left as it is, not removed'''
+    items = dict(store.items)
+    sync(store, csv_path, CSV.replace('sword,10,rare', 'sword,10,shiny'))
+    assert store.items == items
+
+def test_recipe_using_a_removed_item(store, csv_path):
+    '''A kept item whose recipe uses a removed item is given its recipe again if it can be, or loses it'''
+    sync(store, csv_path, CSV.replace('stone,2,common,0,material,,,,,,,,\n', ''))
+    assert recipes(store) == {}
+    assert store.recipes == {}
+
+def test_rejected_item_recipe_using_a_removed_item(store, csv_path):
+    '''An item kept because its row is rejected can not be rebuilt, so its recipe is removed
+    rather than left using an item that no longer exists, and the rejects file says so'''
+    syncer = sync(store, csv_path, CSV.replace('stone,2,common,0,material,,,,,,,,\n', '').replace('club,8,uncommon', 'club,8,shiny'))
+    assert 'stone' not in store.item_names and 'club' in store.item_names
+    assert store.items[store.item_names['club']]['recipe_id'] is None and store.recipes == {}
+    with open(f'{csv_path}.rejects.csv', newline='') as rejects_file:
+        reasons = [row[1] for row in csv.reader(rejects_file)]
+    assert reasons == ["invalid rarity 'shiny'", 'recipe removed, it uses removed items: stone']
+    assert syncer.fetch_recipes_query() == []
+    sync(store, csv_path, CSV) # The store is still consistent enough to sync again
+    assert recipes(store) == {'club': {'stick': 2, 'stone': 1}}